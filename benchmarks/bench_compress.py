@@ -0,0 +1,78 @@
+"""
+Bandwidth benchmark of COMPRESS=DEFLATE against the local fake Gmail server.
+
+Fetches the headers, sizes and labels of every message, as the header index
+and reports do, with and without compression and reports the bytes on the
+wire and the elapsed time.
+
+Usage:
+    python benchmarks/bench_compress.py --messages 100000 --bandwidth 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, CommandProfiler, FakeGmail, FakeGmailServer, SYNC_ITEMS
+
+
+def wire_bytes(client, profiler) -> int:
+    deflate = getattr(client.imap, "deflate", None)
+    if deflate is not None:
+        return deflate.wire_bytes_in + deflate.wire_bytes_out
+    return sum(command["bytes_sent"] + command["bytes_received"] for command in profiler.report()["commands"])
+
+
+def run(gmail, compress, chunk_size):
+    profiler = CommandProfiler()
+    with FakeGmailServer(gmail) as server:
+        client = SMPTClient(
+            server.host, server.port, gmail.user, gmail.password,
+            use_ssl=False, profiler=profiler, compress=compress,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.connect()
+        msg_ids = client.get_msg_ids("", "2100-01-01")
+        before = wire_bytes(client, profiler)
+        started = time.perf_counter()
+        fetched = sum(1 for _ in client.fetch(msg_ids, SYNC_ITEMS, chunk_size))
+        seconds = time.perf_counter() - started
+        transferred = wire_bytes(client, profiler) - before
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.close()
+    return {"compress": compress, "messages": fetched, "wire_bytes": transferred, "seconds": round(seconds, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Messages per FETCH")
+    parser.add_argument(
+        "--bandwidth", type=float, help="Also estimate the transfer time on a link of this many Mbit/s"
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    gmail = FakeGmail().populate(args.messages, seed=args.messages)
+    results = [run(gmail, compress, args.chunk_size) for compress in (False, True)]
+    print(f"{'compress':>10} {'messages':>10} {'wire MB':>10} {'seconds':>10}" + (f" {'link s':>10}" if args.bandwidth else ""))
+    for result in results:
+        line = (
+            f"{str(result['compress']):>10} {result['messages']:>10} "
+            f"{result['wire_bytes'] / 1e6:>10.2f} {result['seconds']:>10.2f}"
+        )
+        if args.bandwidth:
+            result["link_seconds"] = round(result["wire_bytes"] * 8 / (args.bandwidth * 1e6), 3)
+            line += f" {result['link_seconds']:>10.2f}"
+        print(line)
+    print(f"Compression ratio: {results[0]['wire_bytes'] / max(results[1]['wire_bytes'], 1):.1f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
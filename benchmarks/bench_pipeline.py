@@ -0,0 +1,57 @@
+"""
+Round-trip benchmark of pipelined UID commands against the local fake Gmail server.
+
+Fetches the sizes of every message and moves them to Trash in chunks over a
+link with a simulated round trip time, once with one command in flight and
+once per pipeline window, and reports the elapsed time of each.
+
+Usage:
+    python benchmarks/bench_pipeline.py --messages 20000 --rtt 0.1 --windows 1 4 16
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, FakeGmail, FakeGmailServer
+
+
+def run(count, rtt, window, chunk_size):
+    gmail = FakeGmail().populate(count, seed=count)
+    with FakeGmailServer(gmail, rtt=rtt) as server:
+        client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False, window=window)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.connect()
+        msg_ids = client.get_msg_ids("", "2100-01-01")
+        started = time.perf_counter()
+        fetched = sum(1 for _ in client.fetch(msg_ids, "(UID RFC822.SIZE)", chunk_size))
+        fetch_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        list(client.move_chunks_to_trash([chunk for chunk, _ in msg_ids.chunks(chunk_size)], targeted=True))
+        move_seconds = time.perf_counter() - started
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.close()
+    return {
+        "window": window,
+        "messages": fetched,
+        "fetch_seconds": round(fetch_seconds, 3),
+        "targeted_move_seconds": round(move_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rtt", type=float, default=0.1, help="Simulated round trip time in seconds")
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+    results = [run(args.messages, args.rtt, window, args.chunk_size) for window in args.windows]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
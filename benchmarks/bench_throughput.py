@@ -0,0 +1,83 @@
+"""
+Throughput benchmark of SMPTClient against the local fake Gmail server.
+
+Reports messages/sec for search, Trash label-store and expunge at several
+mailbox sizes so performance regressions can be caught offline.
+
+Usage:
+    python benchmarks/bench_throughput.py --scales 1000 10000 100000 --latency 0.005
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, FakeGmail, FakeGmailServer, CHUNK_SIZE, TRASH_FOLDER
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run_scale(count, latency, chunk_size, targeted):
+    gmail = FakeGmail().populate(count, seed=count)
+    with FakeGmailServer(gmail, latency=latency) as server:
+        client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.connect()
+            msg_ids, search = timed(lambda: client.get_msg_ids("", "2100-01-01"))
+            gm_msgids, store = timed(
+                lambda: [
+                    gm_msgid
+                    for chunk, _ in msg_ids.chunks(chunk_size)
+                    for gm_msgid in client.move_to_trash(chunk, targeted)
+                ]
+            )
+            client.imap.select(TRASH_FOLDER)
+            if targeted:
+                _, expunge = timed(
+                    lambda: client.expunge_uids(client.search_gm_msgids(gm_msgids), chunk_size)
+                )
+            else:
+                _, expunge = timed(
+                    lambda: (client.imap.store("1:*", "+FLAGS", "\\Deleted"), client.imap.expunge())
+                )
+            client.close()
+    return {
+        "messages": count,
+        "search_per_sec": round(count / search),
+        "store_per_sec": round(count / store),
+        "expunge_per_sec": round(count / expunge),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every command")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--targeted", action="store_true", help="Benchmark targeted UID EXPUNGE")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'messages':>10} {'search/s':>12} {'store/s':>12} {'expunge/s':>12}")
+    for count in args.scales:
+        result = run_scale(count, args.latency, args.chunk_size, args.targeted)
+        results.append(result)
+        print(
+            f"{result['messages']:>10} {result['search_per_sec']:>12} "
+            f"{result['store_per_sec']:>12} {result['expunge_per_sec']:>12}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
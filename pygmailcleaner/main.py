@@ -1,11 +1,49 @@
 import logging
 import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from .utils import (
     YesNoQuestionHandler,
     DateQuestionHandler,
     ValueQuestionHandler,
     SMPTClient,
+    SMPTClientPool,
+    HeaderIndex,
+    index_path,
+    top_senders,
+    largest_messages,
+    format_size,
+    quote,
+    load_rules,
+    RateLimiter,
+    HOST_RATE_LIMIT,
+    impact_report,
+    CommandProfiler,
+    DeleteJournal,
+    Archiver,
+    open_archive,
+    COMPRESSIONS,
+    ThreadIndex,
+    THREAD_MODES,
+    DuplicateIndex,
+    Watcher,
+    SearchCache,
+    search_cache_path,
+    IDLE_TIMEOUT,
+    POLL_INTERVAL,
+    MsgIdSet,
+    TermSets,
+    Query,
+    QueryError,
+    Before,
+    And,
+    From,
+    sender_query,
     return_logo,
     METHODS,
 )
@@ -13,26 +51,39 @@ from .utils import (
 logger = logging.getLogger()
 
 
+def get_cumulative_query(methods) -> Query:
+    """
+    Combine the queries of the provided methods based on their responses.
+
+    Args:
+        methods (list): List of methods containing queries and responses.
+
+    Returns:
+        Query: The query matching every chosen method.
+    """
+
+    queries = [
+        method["y_query"] if method["response"] == "y" else method["n_query"]
+        for method in methods
+    ]
+    return And(*[query for query in queries if query is not None])
+
+
 def get_cumulative_search_term(methods) -> str:
     """
     Formulate the cumulative search term based on the provided methods.
 
     Args:
-        methods (list): List of methods containing search terms and responses.
+        methods (list): List of methods containing queries and responses.
 
     Returns:
         str: The cumulative search term.
     """
 
     logger.info("Calculating cumulative search term...")
-    cumulative_search_term = ""
-    for method in methods:
-        if method["response"] == "y":
-            cumulative_search_term += method["y_search_term"] + " "
-        else:
-            cumulative_search_term += method["n_search_term"] + " "
-    logger.info(f"Cumulative search term: {cumulative_search_term.strip()}")
-    return cumulative_search_term.strip()
+    cumulative_search_term = get_cumulative_query(methods).to_gm_raw()
+    logger.info(f"Cumulative search term: {cumulative_search_term}")
+    return cumulative_search_term
 
 
 def get_commands_choices() -> tuple[list, str]:
@@ -66,18 +117,61 @@ def get_general_stats(gmail: SMPTClient) -> bool:
 
     logger.debug("Retrieving general statistics...")
 
-    msg_ids = gmail.get_msg_ids("")
-    total_msgs = gmail.count_msgs(msg_ids)
+    status = gmail.get_status(gmail.folder, ("MESSAGES", "UNSEEN"))
+
+    print(f"Total number of messages: {status.get('MESSAGES')}")
+    print(f"Unread messages: {status.get('UNSEEN')}")
+
+    return True
 
-    print(f"Total number of messages: {total_msgs}")
-    msg_ids = gmail.get_msg_ids("in:unread")
-    unread_msgs = gmail.count_msgs(msg_ids)
 
-    print(f"Unread messages: {unread_msgs}")
+def get_label_stats(gmail: SMPTClient, labels: list) -> bool:
+    """
+    Retrieve and display message counts for the given labels.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        labels (list): The label names to report on.
+
+    Returns:
+        bool: True if statistics are retrieved successfully.
+    """
+
+    logger.debug("Retrieving label statistics...")
+
+    for label in labels:
+        status = gmail.get_status(quote(label), ("MESSAGES", "UNSEEN"))
+        print(
+            f"Label {label}: {status.get('MESSAGES')} messages, {status.get('UNSEEN')} unread"
+        )
 
     return True
 
 
+def sync_header_index(gmail: SMPTClient) -> dict:
+    """
+    Incrementally sync the local header index of the user's account.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+
+    Returns:
+        dict: The number of new, updated and removed messages.
+    """
+
+    logger.debug("Syncing header index...")
+
+    index = HeaderIndex(index_path(gmail.user))
+    summary = index.sync(gmail)
+    print(
+        f"Header index: {index.count()} messages "
+        f"({summary['new']} new, {summary['updated']} updated, {summary['removed']} removed)"
+    )
+    index.close()
+
+    return summary
+
+
 def get_response_summary(responses: dict) -> bool:
     """
     Display a summary of the user's responses.
@@ -97,21 +191,37 @@ def get_response_summary(responses: dict) -> bool:
     print("3. Included filters:")
     for i in responses.get("included_filters"):
         print(f"   - {i}")
+    thread_stats = responses.get("thread_stats")
+    if thread_stats:
+        print(f"4. Threads ({responses.get('threads')}):")
+        print(f"   - Threads touched: {thread_stats['threads']}")
+        print(f"   - Fully matched threads: {thread_stats['complete_threads']}")
+        print(f"   - Partially matched threads: {thread_stats['partial_threads']}")
+        print(
+            f"   - Emails: {thread_stats['matched']} matched, {thread_stats['thread_messages']} in touched threads"
+        )
 
     return True
 
 
 def handle_deletions(
-    gmail: SMPTClient, msg_ids: str, responses: dict, search_string: str
+    gmail: SMPTClient,
+    msg_ids: MsgIdSet,
+    responses: dict,
+    search_string: str,
+    journal: DeleteJournal = None,
+    archiver: Archiver = None,
 ) -> bool:
     """
     Handle the deletion of emails based on the user's responses and search string.
 
     Args:
-        gmail (SMPTClient): An instance of the SMPTClient class.
-        msg_ids (str): The message IDs to be deleted.
+        gmail (SMPTClient): An instance of the SMPTClient or SMPTClientPool class.
+        msg_ids (MsgIdSet): The message UIDs to be deleted.
         responses (dict): Dictionary containing the user's responses.
         search_string (str): The search string used to filter emails.
+        journal (DeleteJournal): Optional journal making the deletion resumable.
+        archiver (Archiver): Optional archiver storing every email before it is deleted.
 
     Returns:
         bool: True if deletions are handled successfully.
@@ -121,14 +231,15 @@ def handle_deletions(
     print(
         f"Number of emails to be deleted using gmail filter: ({search_string}): {gmail.count_msgs(msg_ids)}"
     )
+    targeted = responses.get("targeted_expunge", False)
     if responses.get("delete_immediately") == "y":
-        gmail.delete_msgs(msg_ids)
+        gmail.delete_msgs(msg_ids, targeted=targeted, journal=journal, archiver=archiver)
     else:
         logger.info("Skipping deletion")
 
     if responses.get("delete_immediately") == "n":
         get_continue_confirmation("Would you like to delete now")
-        gmail.delete_msgs(msg_ids)
+        gmail.delete_msgs(msg_ids, targeted=targeted, journal=journal, archiver=archiver)
         logger.info("Deletion complete")
 
     return True
@@ -212,6 +323,752 @@ def get_credentials() -> dict:
         }
 
 
+def print_impact_report(report: dict) -> bool:
+    """
+    Display the impact report of a dry run.
+
+    Args:
+        report (dict): The report returned by `impact_report`.
+
+    Returns:
+        bool: True if the report is displayed successfully.
+    """
+
+    print("\nDry run impact:")
+    print(f"Messages: {report['messages']}")
+    print(f"Space reclaimed: {format_size(report['bytes'])}")
+    print("Size histogram:")
+    for bucket in report["histogram"]:
+        print(f"   - {bucket['bucket']}: {bucket['count']} messages, {format_size(bucket['bytes'])}")
+    print("Labels:")
+    labels = sorted(report["labels"].items(), key=lambda item: -item[1]["bytes"])
+    for label, stats in labels:
+        print(f"   - {label}: {stats['count']} messages, {format_size(stats['bytes'])}")
+    if report["filters"]:
+        print("Messages to delete matching each filter:")
+        for description, count in report["filters"].items():
+            print(f"   - {description}: {count}")
+
+    return True
+
+
+def run_deletions(gmail: SMPTClient, msg_ids: MsgIdSet, responses: dict, search_string: str, args) -> bool:
+    """
+    Confirm and run the deletion, over a pool of connections if requested.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        msg_ids (MsgIdSet): The message UIDs to be deleted.
+        responses (dict): Dictionary containing the user's responses.
+        search_string (str): The search string used to filter emails.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if deletions are handled successfully.
+    """
+
+    if args.threads != "messages":
+        thread_index = ThreadIndex.build(gmail, msg_ids)
+        responses["threads"] = args.threads
+        responses["thread_stats"] = thread_index.stats()
+        msg_ids = thread_index.select(args.threads)
+        search_string = f"{search_string} threads:{args.threads}"
+    get_response_summary(responses)
+    if args.dry_run:
+        print(f"Dry run, calculating the impact of deleting {gmail.count_msgs(msg_ids)} emails...")
+        report = impact_report(
+            gmail, msg_ids, responses.get("filter_terms"), responses.get("date_until")
+        )
+        print_impact_report(report)
+        return True
+
+    get_continue_confirmation("Would you like to continue")
+    journal = None
+    if not args.no_journal:
+        journal = DeleteJournal.for_search(gmail, f"{search_string} before:{responses.get('date_until')}")
+    if args.archive:
+        archive = open_archive(args.archive, args.archive_format, args.archive_compression)
+        if args.connections > 1:
+            logger.warning("Archiving deletes over a single connection, ignoring --connections")
+        handle_deletions(gmail, msg_ids, responses, search_string, journal, Archiver(archive))
+        archive.close()
+        print(f"Archived to {args.archive}")
+    elif args.connections > 1:
+        pool = SMPTClientPool(
+            server=gmail.server,
+            port=gmail.port,
+            user=gmail.user,
+            password=gmail.password,
+            size=args.connections,
+            profiler=gmail.profiler,
+            compress=gmail.compress,
+        )
+        pool.connect()
+        handle_deletions(pool, msg_ids, responses, search_string, journal)
+        pool.close()
+    else:
+        handle_deletions(gmail, msg_ids, responses, search_string, journal)
+
+    return True
+
+
+def search_msg_ids(gmail: SMPTClient, query: Query, date_until: str, use_index: bool = False) -> MsgIdSet:
+    """
+    Find the emails matching a query up to a date, from the local header index when possible.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        query (Query): The query to match.
+        date_until (str): The date to search up until.
+        use_index (bool): Evaluate the query against the synced header index instead of searching the server.
+
+    Returns:
+        MsgIdSet: The message UIDs matching the query.
+    """
+
+    if use_index:
+        index = HeaderIndex(index_path(gmail.user))
+        try:
+            msg_ids = index.search(And(query, Before(date_until)), gmail.folder)
+            logger.info(f"Found {len(msg_ids)} emails in the header index")
+            return msg_ids
+        except QueryError as e:
+            logger.info(f"Searching the server, the header index cannot evaluate the filters: {e}")
+        finally:
+            index.close()
+    return gmail.get_msg_ids(query, date_until)
+
+
+def run_filters_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Delete emails matching the filters chosen by the user.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    get_general_stats(gmail)
+    if args.label_stats:
+        get_label_stats(gmail, args.label_stats)
+
+    filter_date = get_date_input()
+    filters, search_string = get_commands_choices()
+
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": filters,
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+        "filter_terms": {
+            method["description"]: method["y_query"]
+            for method in METHODS
+            if method.get("response") == "y" and method["y_query"] is not None
+        },
+    }
+    msg_ids = search_msg_ids(gmail, get_cumulative_query(METHODS), filter_date, args.index)
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def print_top_senders(senders: list) -> bool:
+    """
+    Display a numbered table of the top senders.
+
+    Args:
+        senders (list): The senders returned by `top_senders`.
+
+    Returns:
+        bool: True if the table is displayed successfully.
+    """
+
+    print("\nTop senders:")
+    for i, sender in enumerate(senders, start=1):
+        print(
+            f"{i:>3}. {sender['sender']} - {sender['count']} messages, {format_size(sender['bytes'])}"
+        )
+
+    return True
+
+
+def get_top_senders_choices(senders: list) -> list:
+    """
+    Prompt the user to pick senders from the top senders table.
+
+    Args:
+        senders (list): The senders returned by `top_senders`.
+
+    Returns:
+        list: The chosen sender addresses.
+    """
+
+    question = {
+        "question": "Which senders would you like to delete? (e.g. '1,3,5')",
+        "format": r"^\s*\d+(\s*,\s*\d+)*\s*$",
+        "validation": "Must be a comma separated list of numbers",
+        "sensitive": False,
+    }
+    choice = ValueQuestionHandler(question).run()
+    chosen = []
+    for i in choice.split(","):
+        i = int(i)
+        if 0 < i <= len(senders) and senders[i - 1]["sender"] != "(unknown)":
+            chosen.append(senders[i - 1]["sender"])
+    return chosen
+
+
+def get_sender_search_term(senders: list) -> str:
+    """
+    Formulate a short search term describing a list of senders.
+
+    The term names the first sender and the number of others, followed by a
+    digest of the whole list so different lists never share a deletion journal.
+
+    Args:
+        senders (list): The sender addresses or domains.
+
+    Returns:
+        str: The search term.
+    """
+
+    if len(senders) == 1:
+        return From(senders[0]).to_gm_raw()
+    digest = hashlib.sha256("\n".join(sorted(senders)).encode()).hexdigest()[:12]
+    return f"{From(senders[0]).to_gm_raw()} or {len(senders) - 1} more senders #{digest}"
+
+
+def run_top_senders_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Rank the senders of the user's mail and delete mail from the chosen ones.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    filter_date = get_date_input()
+    msg_ids = gmail.get_msg_ids("", filter_date)
+    print(f"Scanning {gmail.count_msgs(msg_ids)} messages for top senders...")
+    senders = top_senders(gmail, msg_ids, k=args.top, by=args.by)
+    print_top_senders(senders)
+
+    chosen = get_top_senders_choices(senders)
+    if not chosen:
+        print("No senders selected")
+        return True
+    search_string = get_sender_search_term(chosen)
+
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": [f"From {sender}" for sender in chosen],
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+        "filter_terms": {f"From {sender}": From(sender) for sender in chosen},
+    }
+    msg_ids = gmail.get_msg_ids_any([From(sender) for sender in chosen], filter_date)
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def read_senders(senders: list, path: str = None) -> list:
+    """
+    Collect sender addresses and domains from the command line and a file.
+
+    Args:
+        senders (list): Addresses or domains such as "*@example.com".
+        path (str): Optional file with one sender per line, "#" starts a comment.
+
+    Returns:
+        list: The distinct senders in order.
+    """
+
+    senders = list(senders or [])
+    if path:
+        with open(path) as f:
+            senders += [line.split("#", 1)[0].strip() for line in f]
+    return list(dict.fromkeys(sender.strip().lower() for sender in senders if sender.strip()))
+
+
+def run_senders_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Delete mail from a list of senders and domains with a handful of searches.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    senders = read_senders(args.senders, args.file)
+    if not senders:
+        print("No senders given")
+        return True
+    filter_date = get_date_input()
+    queries = [sender_query(sender) for sender in senders]
+    msg_ids = gmail.get_msg_ids_any(queries, filter_date)
+    search_string = get_sender_search_term([query.address for query in queries])
+
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": [f"From {query.address}" for query in queries],
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+    }
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def print_largest_messages(messages: list) -> bool:
+    """
+    Display a numbered table of the largest emails.
+
+    Args:
+        messages (list): The emails returned by `largest_messages`.
+
+    Returns:
+        bool: True if the table is displayed successfully.
+    """
+
+    print("\nLargest emails:")
+    for i, message in enumerate(messages, start=1):
+        attachment = " [attachment]" if message["attachment"] else ""
+        print(
+            f"{i:>3}. {format_size(message['bytes'])} - {message['sender']} - {message['subject'][:60]}{attachment}"
+        )
+
+    return True
+
+
+def get_largest_messages_choices(messages: list) -> MsgIdSet:
+    """
+    Prompt the user to pick emails from the largest emails table.
+
+    Args:
+        messages (list): The emails returned by `largest_messages`.
+
+    Returns:
+        MsgIdSet: The uids of the chosen emails.
+    """
+
+    question = {
+        "question": "Which emails would you like to delete? (e.g. '1,3,5' or '1-20')",
+        "format": r"^\s*\d+(\s*-\s*\d+)?(\s*,\s*\d+(\s*-\s*\d+)?)*\s*$",
+        "validation": "Must be a comma separated list of numbers or ranges",
+        "sensitive": False,
+    }
+    choice = ValueQuestionHandler(question).run()
+    chosen = []
+    for part in choice.split(","):
+        low, _, high = part.partition("-")
+        for i in range(int(low), int(high or low) + 1):
+            if 0 < i <= len(messages):
+                chosen.append(messages[i - 1]["uid"])
+    return MsgIdSet(chosen)
+
+
+def run_largest_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Rank the largest emails and delete the chosen ones.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    filter_date = get_date_input()
+    msg_ids = gmail.get_msg_ids("", filter_date)
+    print(f"Scanning {gmail.count_msgs(msg_ids)} messages for the {args.top} largest...")
+    messages = largest_messages(gmail, msg_ids, k=args.top)
+    print_largest_messages(messages)
+
+    msg_ids = get_largest_messages_choices(messages)
+    if not msg_ids:
+        print("No emails selected")
+        return True
+    search_string = f"largest uids:{msg_ids}"
+
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": [f"{len(msg_ids)} chosen largest emails"],
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+    }
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def print_count_matrix(term_sets: TermSets, rows: list) -> bool:
+    """
+    Display the number of emails per atomic term, their overlaps and every filter combination.
+
+    Args:
+        term_sets (TermSets): The searched term sets.
+        rows (list): The rows returned by `TermSets.count_matrix`.
+
+    Returns:
+        bool: True if the matrix is displayed successfully.
+    """
+
+    print(f"\nEmails up to the date: {term_sets.count(None)}")
+    print("Emails per term (overlap with the other terms):")
+    overlaps = term_sets.overlaps()
+    for term in term_sets.sets:
+        shared = ", ".join(
+            f"{other}: {overlaps.get((term, other), overlaps.get((other, term)))}"
+            for other in term_sets.sets
+            if other != term
+        )
+        print(f"   - {term}: {overlaps[(term, term)]}" + (f" ({shared})" if shared else ""))
+
+    print("\nEmails matched by every filter combination:")
+    descriptions = list(rows[0]["responses"]) if rows else []
+    for i, description in enumerate(descriptions, start=1):
+        print(f"   F{i}: {description}")
+    print("  #  " + " ".join(f"F{i}" for i in range(1, len(descriptions) + 1)) + "  emails")
+    for i, row in enumerate(rows, start=1):
+        choices = " ".join(f"{row['responses'][description]:>2}" for description in descriptions)
+        print(f"{i:>3}  {choices}  {row['count']}")
+
+    return True
+
+
+def run_explore_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Count every combination of filters from one search per filter term and delete a chosen one.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    filter_date = get_date_input()
+    queries = [
+        query for method in METHODS for query in (method["y_query"], method["n_query"]) if query is not None
+    ]
+    term_sets = TermSets.search(gmail, queries, filter_date)
+    rows = term_sets.count_matrix(METHODS)
+    print_count_matrix(term_sets, rows)
+
+    question = {
+        "question": "Which combination would you like to delete? (0 to exit)",
+        "format": r"^\s*\d+\s*$",
+        "validation": "Must be a number",
+        "sensitive": False,
+    }
+    choice = int(ValueQuestionHandler(question).run())
+    if not 0 < choice <= len(rows):
+        print("No combination selected")
+        return True
+    methods = [
+        {**method, "response": rows[choice - 1]["responses"][method["description"]]}
+        for method in METHODS
+    ]
+    query = get_cumulative_query(methods)
+    search_string = query.to_gm_raw()
+
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": [method["description"] for method in methods if method["response"] == "y"],
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+        "filter_terms": {
+            method["description"]: method["y_query"]
+            for method in methods
+            if method["response"] == "y" and method["y_query"] is not None
+        },
+    }
+    msg_ids = term_sets.evaluate(query)
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def print_duplicate_stats(stats: dict) -> bool:
+    """
+    Display the result of a duplicate scan.
+
+    Args:
+        stats (dict): The statistics returned by `DuplicateIndex.stats`.
+
+    Returns:
+        bool: True if the statistics are displayed successfully.
+    """
+
+    print(f"\nScanned {stats['scanned']} emails, hashed {stats['candidates']} with matching headers")
+    print(f"Duplicate groups: {stats['groups']}")
+    print(f"Redundant copies: {stats['redundant']} ({format_size(stats['bytes'])})")
+
+    return True
+
+
+def run_dedupe_workflow(gmail: SMPTClient, args) -> bool:
+    """
+    Find exact duplicates and delete every copy but the oldest.
+
+    Args:
+        gmail (SMPTClient): An instance of the SMPTClient class.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if the workflow completes successfully.
+    """
+
+    filter_date = get_date_input()
+    msg_ids = gmail.get_msg_ids("", filter_date)
+    print(f"Scanning {gmail.count_msgs(msg_ids)} messages for duplicates...")
+    duplicates = DuplicateIndex.build(gmail, msg_ids, path=args.index_file or "")
+    stats = duplicates.stats()
+    msg_ids = duplicates.redundant()
+    duplicates.close()
+    print_duplicate_stats(stats)
+    if not msg_ids:
+        print("No duplicates found")
+        return True
+
+    if args.threads != "messages":
+        # expanding to threads would also delete the copies being kept
+        logger.warning("Ignoring --threads, duplicates are deleted one by one")
+        args.threads = "messages"
+    search_string = "duplicates"
+    responses = {
+        "date_until": filter_date,
+        "delete_immediately": get_delete_input(),
+        "included_filters": ["Duplicates (every copy but the oldest)"],
+        "search_string": search_string,
+        "targeted_expunge": args.targeted_expunge,
+    }
+
+    return run_deletions(gmail, msg_ids, responses, search_string, args)
+
+
+def write_profile(profiler: CommandProfiler, directory: str) -> bool:
+    """
+    Display the per-command profile and export it as JSON and a Prometheus textfile.
+
+    Args:
+        profiler (CommandProfiler): The profiler shared by the connections.
+        directory (str): The directory the reports are written to.
+
+    Returns:
+        bool: True if the profile is written successfully.
+    """
+
+    report = profiler.report()
+    print("\nIMAP command profile:")
+    for command in report["commands"]:
+        print(
+            f"   - {command['command']}: {command['count']} calls, {command['seconds']:.3f}s, "
+            f"sent {format_size(command['bytes_sent'])}, received {format_size(command['bytes_received'])}"
+        )
+    json_path = os.path.join(directory, "pygmailcleaner_profile.json")
+    prometheus_path = os.path.join(directory, "pygmailcleaner.prom")
+    profiler.write_json(json_path)
+    profiler.write_prometheus(prometheus_path)
+    print(f"Profile written to {json_path} and {prometheus_path}")
+
+    return True
+
+
+def clean_account(rule: dict, rate_limiter=None) -> dict:
+    """
+    Run a non-interactive cleanup of one account as described by its rule.
+
+    Args:
+        rule (dict): An account rule returned by `load_rules`.
+        rate_limiter (RateLimiter): Optional limiter shared by every account.
+
+    Returns:
+        dict: A machine-readable summary of the cleanup.
+    """
+
+    started = time.monotonic()
+    result = {
+        "account": rule["email"],
+        "date_until": rule["date_until"],
+        "search": None,
+        "matched": 0,
+        "deleted": 0,
+        "status": "ok",
+        "error": None,
+    }
+    gmail = SMPTClient(
+        server=rule["server"],
+        port=rule["port"],
+        user=rule["email"],
+        password=rule["password"],
+        rate_limiter=rate_limiter,
+        compress=rule["compress"],
+        search_cache=SearchCache(path=search_cache_path(rule["email"])) if rule["search_cache"] else None,
+    )
+    try:
+        gmail.connect()
+        search_string = get_cumulative_search_term(rule["methods"])
+        result["search"] = search_string
+        msg_ids = gmail.get_msg_ids(get_cumulative_query(rule["methods"]), rule["date_until"])
+        if rule["threads"] != "messages":
+            thread_index = ThreadIndex.build(gmail, msg_ids)
+            result["threads"] = thread_index.stats()
+            msg_ids = thread_index.select(rule["threads"])
+            search_string = f"{search_string} threads:{rule['threads']}"
+        result["matched"] = gmail.count_msgs(msg_ids)
+        if rule["dry_run"]:
+            result["impact"] = impact_report(gmail, msg_ids)
+        else:
+            journal = DeleteJournal.for_search(gmail, f"{search_string} before:{rule['date_until']}")
+            archiver = None
+            if rule["archive"]:
+                archiver = Archiver(open_archive(rule["archive"], rule["archive_format"], rule["archive_compression"]))
+            try:
+                gmail.delete_msgs(
+                    msg_ids,
+                    chunk_size=rule["chunk_size"],
+                    targeted=rule["targeted_expunge"],
+                    journal=journal,
+                    archiver=archiver,
+                )
+            finally:
+                if archiver is not None:
+                    archiver.archive.close()
+                    result["archived"] = archiver.messages
+            result["deleted"] = result["matched"]
+        gmail.close()
+        gmail.search_cache.close()
+    except Exception as e:
+        logger.error(f"Cleanup of {rule['email']} failed: {e}")
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_batch(args) -> list:
+    """
+    Clean every account of a rules file concurrently in a process pool.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        list: The summary of every account, see `clean_account`.
+    """
+
+    rules = load_rules(args.rules)
+    logger.info(f"Cleaning {len(rules)} accounts with {args.processes} processes")
+    with multiprocessing.Manager() as manager:
+        rate_limiter = RateLimiter(manager, rate=args.rate_limit)
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            results = list(
+                executor.map(clean_account, rules, [rate_limiter] * len(rules))
+            )
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    return results
+
+
+def watch_account(rule: dict, args) -> Watcher:
+    """
+    Delete new mail of one account matching its rule until interrupted.
+
+    Args:
+        rule (dict): An account rule returned by `load_rules`.
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        Watcher: The watcher with its counters, once it stops.
+    """
+
+    gmail = SMPTClient(
+        server=rule["server"],
+        port=rule["port"],
+        user=rule["email"],
+        password=rule["password"],
+        compress=rule["compress"],
+    )
+    search_string = get_cumulative_search_term(rule["methods"])
+    archiver = None
+    if rule["archive"] and not rule["dry_run"]:
+        archiver = Archiver(open_archive(rule["archive"], rule["archive_format"], rule["archive_compression"]))
+    watcher = Watcher(
+        gmail,
+        get_cumulative_query(rule["methods"]),
+        idle_timeout=args.idle_timeout,
+        poll_interval=args.poll_interval,
+        chunk_size=rule["chunk_size"],
+        dry_run=rule["dry_run"],
+        threads=rule["threads"],
+        targeted=rule["targeted_expunge"],
+        archiver=archiver,
+    )
+    try:
+        gmail.connect()
+        logger.info(f"Watching {rule['email']} for: {search_string}")
+        watcher.run()
+    except Exception as e:
+        logger.error(f"Watching {rule['email']} failed: {e}")
+    finally:
+        if archiver is not None:
+            archiver.archive.close()
+    return watcher
+
+
+def run_watch(args) -> bool:
+    """
+    Watch every account of a rules file, each on its own connection and thread.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        bool: True if interrupted, False if every watcher stopped on its own.
+    """
+
+    rules = load_rules(args.rules)
+    if args.account:
+        rules = [rule for rule in rules if rule["email"] in args.account]
+    if not rules:
+        print("No accounts to watch")
+        return False
+    threads = [
+        threading.Thread(target=watch_account, args=(rule, args), daemon=True)
+        for rule in rules
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Watching {len(threads)} accounts for new mail, press Ctrl+C to stop")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+        return True
+    return False
+
+
 def main():
     """
     Main function to run the Gmail Cleaner CLI application.
@@ -223,6 +1080,163 @@ def main():
         default="notset",
         help="Provide logging level. Example --loglevel debug, default=notset",
     )
+    parser.add_argument(
+        "--targeted-expunge",
+        action="store_true",
+        help="Only expunge the messages moved to Trash instead of emptying the whole Trash folder",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="Number of parallel IMAP connections used for deletion, default=1",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Sync the local header index before cleaning, only changes since the last run are downloaded",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report the number of emails, space reclaimed and size histogram instead of deleting",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress the IMAP connection with COMPRESS=DEFLATE when the server supports it",
+    )
+    parser.add_argument(
+        "--search-cache",
+        action="store_true",
+        help="Keep search results on disk so searches are skipped on later runs while the mailbox is unchanged",
+    )
+    parser.add_argument(
+        "--no-journal",
+        action="store_true",
+        help="Do not record deletion progress, interrupted deletions then start over",
+    )
+    parser.add_argument(
+        "--threads",
+        choices=THREAD_MODES,
+        default="messages",
+        help="Delete matching emails only (messages), every email of a matching conversation (all) "
+        "or only conversations where every email matches (complete), default=messages",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Save every email to this mbox file or Maildir directory before deleting it",
+    )
+    parser.add_argument(
+        "--archive-format",
+        choices=["mbox", "maildir"],
+        default="mbox",
+        help="Format of the --archive, default=mbox",
+    )
+    parser.add_argument(
+        "--archive-compression",
+        choices=[compression for compression in COMPRESSIONS if compression],
+        help="Compress the --archive with gzip or zstd (requires the zstandard package)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=".",
+        metavar="DIR",
+        help="Record latency and bytes of every IMAP command and write a JSON report and Prometheus textfile to DIR, default=.",
+    )
+    parser.add_argument(
+        "--label-stats",
+        nargs="+",
+        metavar="LABEL",
+        help="Also show message counts for these labels, e.g. --label-stats INBOX Work",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("filters", help="Delete emails by filters (default)")
+    top_senders_parser = subparsers.add_parser(
+        "top-senders", help="Rank senders by message count or size and delete by sender"
+    )
+    top_senders_parser.add_argument(
+        "--top", type=int, default=20, help="Number of senders to show, default=20"
+    )
+    top_senders_parser.add_argument(
+        "--by",
+        choices=["count", "bytes"],
+        default="count",
+        help="Rank senders by message count or total bytes, default=count",
+    )
+    subparsers.add_parser(
+        "explore", help="Count every combination of filters with one search per filter term"
+    )
+    senders_parser = subparsers.add_parser(
+        "senders", help="Delete mail from a list of senders or domains"
+    )
+    senders_parser.add_argument(
+        "senders", nargs="*", help="Addresses or domains, e.g. news@example.com example.org *@example.net"
+    )
+    senders_parser.add_argument(
+        "--file", help="File with one address or domain per line"
+    )
+    largest_parser = subparsers.add_parser(
+        "largest", help="Rank the largest emails and delete the chosen ones"
+    )
+    largest_parser.add_argument(
+        "--top", type=int, default=50, help="Number of emails to show, default=50"
+    )
+    dedupe_parser = subparsers.add_parser(
+        "dedupe", help="Delete exact duplicate emails, keeping the oldest copy"
+    )
+    dedupe_parser.add_argument(
+        "--index-file",
+        metavar="PATH",
+        help="SQLite file holding the message digests, default a temporary database",
+    )
+    batch_parser = subparsers.add_parser(
+        "batch", help="Clean many accounts non-interactively from a rules file"
+    )
+    batch_parser.add_argument(
+        "rules", help="Path to a TOML or JSON rules file"
+    )
+    batch_parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of accounts cleaned concurrently, default=number of cores",
+    )
+    batch_parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=HOST_RATE_LIMIT,
+        help=f"Maximum IMAP commands per second per host across all accounts, default={HOST_RATE_LIMIT}",
+    )
+    batch_parser.add_argument(
+        "--output", help="Write the JSON result summary to this file instead of stdout"
+    )
+    watch_parser = subparsers.add_parser(
+        "watch", help="Keep deleting new emails matching the filters of a rules file as they arrive"
+    )
+    watch_parser.add_argument(
+        "rules", help="Path to a TOML or JSON rules file"
+    )
+    watch_parser.add_argument(
+        "--account",
+        nargs="+",
+        metavar="EMAIL",
+        help="Only watch these accounts of the rules file",
+    )
+    watch_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help=f"Seconds before IDLE is renewed, default={IDLE_TIMEOUT:g}",
+    )
+    watch_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help=f"Seconds between polls on servers without IDLE, default={POLL_INTERVAL:g}",
+    )
     args = parser.parse_args()
 
     if args.loglevel.lower() != "notset":
@@ -230,37 +1244,51 @@ def main():
             level=args.loglevel.upper(), format="%(levelname)s: %(message)s"
         )
 
+    if args.command == "batch":
+        results = run_batch(args)
+        exit(0 if all(result["status"] == "ok" for result in results) else 1)
+
+    if args.command == "watch":
+        exit(0 if run_watch(args) else 1)
+
     print(return_logo())
     print("Welcome to the Gmail Cleaner CLI")
     print("*******************************")
 
     creds = get_credentials()
+    user = os.getenv("GMAIL_USER", creds.get("email"))
     gmail = SMPTClient(
         server="imap.gmail.com",
         port=993,
-        user=os.getenv("GMAIL_USER", creds.get("email")),
+        user=user,
         password=os.getenv("GMAIL_PASSWORD", creds.get("password")),
+        profiler=CommandProfiler() if args.profile else None,
+        compress=args.compress,
+        search_cache=SearchCache(path=search_cache_path(user)) if args.search_cache else None,
     )
     gmail.connect()
 
-    get_general_stats(gmail)
+    if args.index:
+        sync_header_index(gmail)
 
-    filter_date = get_date_input()
-    filters, search_string = get_commands_choices()
-
-    responses = {
-        "date_until": filter_date,
-        "delete_immediately": get_delete_input(),
-        "included_filters": filters,
-        "search_string": search_string,
-    }
-    msg_ids = gmail.get_msg_ids(search_string, responses.get("date_until"))
-
-    get_response_summary(responses)
-    get_continue_confirmation("Would you like to continue")
-    handle_deletions(gmail, msg_ids, responses, search_string)
+    if args.command == "top-senders":
+        run_top_senders_workflow(gmail, args)
+    elif args.command == "explore":
+        run_explore_workflow(gmail, args)
+    elif args.command == "senders":
+        run_senders_workflow(gmail, args)
+    elif args.command == "largest":
+        run_largest_workflow(gmail, args)
+    elif args.command == "dedupe":
+        run_dedupe_workflow(gmail, args)
+    else:
+        run_filters_workflow(gmail, args)
 
     gmail.close()
+    gmail.search_cache.close()
+
+    if args.profile:
+        write_profile(gmail.profiler, args.profile)
 
     print("Thank you for using the Gmail Cleaner CLI. Goodbye!")
 
@@ -1,5 +1,26 @@
 from .commands import *
+from .query import *
 from .formatting import *
 from .smpt import *
 from .cli import *
+from .sequence import *
+from .pool import *
+from .protocol import *
+from .async_smpt import *
+from .index import *
+from .heavy_hitters import *
+from .reports import *
+from .rules import *
+from .profiling import *
+from .compression import *
+from .journal import *
+from .pipeline import *
+from .scheduler import *
+from .explore import *
+from .archive import *
+from .threads import *
+from .dedupe import *
+from .watch import *
+from .search_cache import *
+from .fakegmail import FakeGmail, FakeGmailServer, compile_gm_raw
 
@@ -0,0 +1,286 @@
+import datetime
+import gzip
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import zlib
+
+from ..utils import scheduler
+from ..utils import sequence
+from ..utils.smpt import FETCH_CHUNK_SIZE
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for zstd archives
+    zstandard = None
+
+logger = logging.getLogger()
+
+# upper bound of message bytes held by one fetched batch, at most three batches are in memory
+ARCHIVE_BATCH_BYTES = int(os.getenv("ARCHIVE_BATCH_BYTES", 16 * 1024 * 1024))
+
+ARCHIVE_ITEMS = "(UID INTERNALDATE BODY.PEEK[])"
+
+COMPRESSIONS = (None, "gzip", "zstd")
+
+# lines that mboxrd quotes with an extra ">" so they are not taken for message separators
+MBOX_FROM_PATTERN = re.compile(rb"(?m)^(>*From )")
+
+
+def _open_compressed(path, compression):
+    """
+    Open `path` for appending, returning (stream, raw file, sync) where sync() flushes
+    the compressor to a decodable point without ending the stream
+    """
+    raw = open(path, "ab")
+    if compression is None:
+        return raw, raw, raw.flush
+    if compression == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="ab")
+        return stream, raw, lambda: (stream.flush(zlib.Z_SYNC_FLUSH), raw.flush())
+    if compression == "zstd":
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError("zstd archives require the zstandard package")
+        stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return stream, raw, lambda: (stream.flush(zstandard.FLUSH_FRAME), raw.flush())
+    raw.close()
+    raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+
+
+class MboxArchive:
+    """
+    Append-only mboxrd file, optionally gzip or zstd compressed
+
+    Messages are written as slices of the fetched bytes, only the separator
+    lines that need ">From " quoting are written separately.
+    """
+
+    def __init__(self, path, compression=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.compression = compression
+        self._stream, self._raw, self._sync = _open_compressed(path, compression)
+
+    def add(self, raw, date=None):
+        """
+        Append one RFC 822 message
+        """
+        date = date or datetime.datetime.now(datetime.timezone.utc)
+        self._stream.write(f"From MAILER-DAEMON {date.strftime('%a %b %d %H:%M:%S %Y')}\n".encode())
+        view = memoryview(raw)
+        start = 0
+        for match in MBOX_FROM_PATTERN.finditer(raw):
+            self._stream.write(view[start:match.start()])
+            self._stream.write(b">")
+            start = match.start()
+        self._stream.write(view[start:])
+        self._stream.write(b"\n" if raw.endswith(b"\n") else b"\n\n")
+
+    def commit(self):
+        """
+        Make every added message durable
+        """
+        self._sync()
+        os.fsync(self._raw.fileno())
+
+    def close(self):
+        self._stream.close()
+        if self._raw is not self._stream:
+            self._raw.close()
+
+
+class MaildirArchive:
+    """
+    Maildir directory, each message optionally gzip or zstd compressed
+
+    Messages are written to tmp/ and moved to new/ on `commit` after being
+    fsynced, so a crash never leaves a partial message in new/.
+    """
+
+    def __init__(self, path, compression=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd archives require the zstandard package")
+        self.path = path
+        self.compression = compression
+        for sub in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+        self._pending = []
+        self._counter = 0
+
+    def add(self, raw, date=None):
+        """
+        Write one RFC 822 message to tmp/
+        """
+        self._counter += 1
+        name = f"{time.time_ns()}.P{os.getpid()}Q{self._counter}.{socket.gethostname()}"
+        tmp_path = os.path.join(self.path, "tmp", name)
+        with open(tmp_path, "wb") as f:
+            if self.compression == "gzip":
+                with gzip.GzipFile(fileobj=f, mode="wb") as stream:
+                    stream.write(raw)
+            elif self.compression == "zstd":
+                with zstandard.ZstdCompressor().stream_writer(f, closefd=False) as stream:
+                    stream.write(raw)
+            else:
+                f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        if date is not None:
+            timestamp = date.timestamp()
+            os.utime(tmp_path, (timestamp, timestamp))
+        self._pending.append(name)
+
+    def commit(self):
+        """
+        Move every added message to new/ and make the directory entries durable
+        """
+        for name in self._pending:
+            os.rename(os.path.join(self.path, "tmp", name), os.path.join(self.path, "new", name))
+        self._pending = []
+        fd = os.open(os.path.join(self.path, "new"), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        pass
+
+
+def open_archive(path, archive_format="mbox", compression=None):
+    """
+    Open an MboxArchive or MaildirArchive
+    """
+    if archive_format == "mbox":
+        return MboxArchive(path, compression)
+    if archive_format == "maildir":
+        return MaildirArchive(path, compression)
+    raise ValueError(f"Unknown archive format {archive_format}, expected mbox or maildir")
+
+
+def parse_internaldate(value):
+    """
+    Parse an INTERNALDATE such as "17-Jul-1996 02:44:25 -0700"
+    """
+    try:
+        return datetime.datetime.strptime(str(value), "%d-%b-%Y %H:%M:%S %z")
+    except ValueError:
+        return None
+
+
+def size_batches(sizes, batch_bytes=ARCHIVE_BATCH_BYTES, batch_size=FETCH_CHUNK_SIZE):
+    """
+    Split {uid: size}, or (uid, size) pairs sorted by uid, into uid sets holding
+    at most `batch_bytes` bytes or `batch_size` messages
+
+    A message larger than `batch_bytes` gets a batch of its own.
+    """
+    pairs = sorted(sizes.items()) if isinstance(sizes, dict) else sizes
+    batch, total = [], 0
+    for uid, size in pairs:
+        if batch and (total + size > batch_bytes or len(batch) >= batch_size):
+            yield sequence.MsgIdSet(batch)
+            batch, total = [], 0
+        batch.append(uid)
+        total += size
+    if batch:
+        yield sequence.MsgIdSet(batch)
+
+
+class ArchiveError(RuntimeError):
+    """
+    Writing the archive failed, a local error that retrying the IMAP command does not fix
+    """
+
+
+class Archiver:
+    """
+    Copies messages to an archive before they are deleted
+
+    Full messages are fetched in batches bounded by ARCHIVE_BATCH_BYTES while a
+    writer thread stores the previous batch, so network and disk overlap and
+    memory stays bounded by a few batches whatever the mailbox size.
+    """
+
+    def __init__(self, archive, batch_bytes=ARCHIVE_BATCH_BYTES, batch_size=FETCH_CHUNK_SIZE):
+        self.archive = archive
+        self.batch_bytes = batch_bytes
+        self.batch_size = batch_size
+        self.archived = sequence.MsgIdSet()
+        self.messages = 0
+        self.bytes = 0
+
+    def _write(self, batches, errors, written):
+        while True:
+            items = batches.get()
+            if items is None:
+                return
+            if errors:
+                continue  # keep draining so the fetching side never blocks
+            try:
+                for item in items:
+                    body = item.get("BODY[]")
+                    if body is None:
+                        raise RuntimeError(f"No body returned for uid {item.get('UID')}")
+                    self.archive.add(body, parse_internaldate(item.get("INTERNALDATE")))
+                    self.messages += 1
+                    self.bytes += len(body)
+                    written.append(item["UID"])
+            except Exception as e:
+                errors.append(e)
+
+    def _commit(self, uids):
+        try:
+            self.archive.commit()
+        except OSError as e:
+            # e.g. a full disk, not to be retried like a dropped connection
+            raise ArchiveError(f"Error occurred while writing the archive: {e}")
+        self.archived = self.archived | sequence.MsgIdSet(uids)
+
+    def archive_chunk(self, client, chunk):
+        """
+        Archive a sequence-set of uids and return once every message is durably on disk
+
+        Messages already archived are skipped until `forget` is called for them,
+        so a chunk retried after its move failed is not archived twice.
+        """
+        msg_ids = sequence.MsgIdSet.from_string(chunk) - self.archived
+        if not msg_ids:
+            logger.debug(f"Already archived: {chunk}")
+            return
+        sizes = {item["UID"]: item.get("RFC822.SIZE", 0) for item in client.fetch(msg_ids, "(UID RFC822.SIZE)")}
+        batches, errors, written = queue.Queue(maxsize=1), [], []
+        writer = threading.Thread(target=self._write, args=(batches, errors, written), daemon=True)
+        writer.start()
+        try:
+            for batch in size_batches(sizes, self.batch_bytes, self.batch_size):
+                batches.put(list(client.fetch(batch, ARCHIVE_ITEMS, self.batch_size)))
+                if errors:
+                    break
+        except scheduler.TRANSIENT_ERRORS:
+            batches.put(None)
+            writer.join()
+            if not errors:
+                # keep what was written before the connection dropped, the retry resumes after it
+                self._commit(written)
+            raise
+        batches.put(None)
+        writer.join()
+        if errors:
+            raise ArchiveError(f"Error occurred while writing the archive: {errors[0]}")
+        self._commit(written)
+
+    def forget(self, chunk):
+        """
+        Drop the uids of a chunk once it has moved to Trash, they will not be seen again
+        """
+        self.archived = self.archived - sequence.MsgIdSet.from_string(chunk)
@@ -0,0 +1,280 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import ssl
+
+from ..utils import formatting
+from ..utils import sequence
+from ..utils.pipeline import PIPELINE_WINDOW
+from ..utils.protocol import ResponseParser, format_command, quote
+from ..utils.smpt import MAIN_FOLDER, TRASH_FOLDER, SEARCH_GROUP_SIZE, GM_MSGID_PATTERN
+
+logger = logging.getLogger()
+
+
+class AsyncIMAPConnection:
+    """
+    Non-blocking IMAP connection that pipelines tagged commands
+
+    Commands are written as soon as they are issued, up to `window` in flight,
+    and a single reader task matches tagged completions back to their
+    commands. Untagged data is attributed to the oldest outstanding command,
+    which matches servers such as Gmail that answer pipelined commands in order.
+    """
+
+    def __init__(self, server, port, use_ssl=True, window=PIPELINE_WINDOW):
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.capabilities = ()
+        self._window = asyncio.Semaphore(window)
+        self._tags = (f"A{i:04d}" for i in itertools.count(1))
+        self._pending = {}
+        self._parser = ResponseParser()
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._greeting = None
+        self._error = None  # why the reader stopped, every later command fails with it
+
+    async def open(self):
+        """
+        Open the connection, wait for the server greeting and read its capabilities
+        """
+        context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.open_connection(
+            self.server, self.port, ssl=context
+        )
+        self._greeting = asyncio.get_running_loop().create_future()
+        self._reader_task = asyncio.create_task(self._read_loop())
+        await self._greeting
+        await self.read_capabilities()
+
+    async def read_capabilities(self):
+        """
+        Read the server capabilities, which servers such as Gmail extend once authenticated
+        """
+        for response in await self.command("CAPABILITY"):
+            name, data = response.split()
+            if name == "CAPABILITY":
+                self.capabilities = tuple(data.decode().upper().split())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self._reader.read(65536)
+                if not data:
+                    raise ConnectionError("Connection closed by server")
+                for response in self._parser.feed(data):
+                    self._dispatch(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+            if not self._greeting.done():
+                self._greeting.set_exception(e)
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self._pending.clear()
+
+    def _dispatch(self, response):
+        if not self._greeting.done():
+            self._greeting.set_result(response)
+        elif response.tag == "*":
+            if self._pending:
+                next(iter(self._pending.values()))[1].append(response)
+            else:
+                logger.debug(f"Unsolicited response: {response}")
+        elif response.tag == "+":
+            logger.debug(f"Ignoring continuation request: {response}")
+        elif response.tag in self._pending:
+            future, untagged = self._pending.pop(response.tag)
+            if response.status == "OK":
+                future.set_result(untagged)
+            else:
+                future.set_exception(
+                    RuntimeError(f"{response.status} {response.text.decode(errors='replace')}")
+                )
+
+    async def command(self, name, *args) -> list:
+        """
+        Send a tagged command and return its untagged responses once it completes
+        """
+        async with self._window:
+            if self._error is not None:
+                raise self._error
+            tag = next(self._tags)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[tag] = (future, [])
+            logger.debug(f"{tag} {name} {' '.join(str(arg) for arg in args)[:200]}")
+            try:
+                self._writer.write(format_command(tag, name, *args))
+                await self._writer.drain()
+            except Exception:
+                self._pending.pop(tag, None)
+                raise
+            if self._error is not None and not future.done():
+                # the reader stopped while the command was written, nothing will complete it
+                self._pending.pop(tag, None)
+                future.set_exception(self._error)
+            return await future
+
+    async def close(self):
+        """
+        Close the socket and stop the reader task
+        """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+
+
+class AsyncSMPTClient:
+    """
+    asyncio counterpart of `SMPTClient` exposing the same operations as coroutines
+    """
+
+    def __init__(self, server, port, user, password, use_ssl=True, window=PIPELINE_WINDOW):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.window = window
+        self.imap = None
+
+    async def connect(self, FOLDER=MAIN_FOLDER):
+        """
+        Connect to a server and folder
+        """
+        try:
+            self.imap = AsyncIMAPConnection(self.server, self.port, self.use_ssl, self.window)
+            await self.imap.open()
+            await self.imap.command("LOGIN", quote(self.user), quote(self.password))
+            await self.imap.read_capabilities()
+            logger.info(f"Connected to {self.server} as {self.user}")
+            await self.imap.command("SELECT", FOLDER)
+        except Exception as e:
+            raise ConnectionError(f"Could not connect to server: {e}")
+
+    async def close(self):
+        """
+        Close the connection
+        """
+        try:
+            if self.imap is None:
+                logger.info("No open connection")
+            else:
+                await self.imap.command("CLOSE")
+                await self.imap.command("LOGOUT")
+                await self.imap.close()
+                logger.info("Connection closed")
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while closing the connection: {e}")
+
+    async def get_msg_ids(self, method, date_until=None) -> sequence.MsgIdSet:
+        """
+        Gets the set of message uids based on method and date
+        """
+        try:
+            date_until = date_until or datetime.datetime.now().strftime("%Y-%m-%d")
+            search = quote(f"{method} before:{formatting.get_unix_timestamp(date_until)}")
+            logger.debug(f"Search string: {search}")
+            return await self._uid_search("X-GM-RAW", search)
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while getting message ids: {e}")
+
+    async def _uid_search(self, *keys) -> sequence.MsgIdSet:
+        uids = sequence.MsgIdSet()
+        for response in await self.imap.command("UID", "SEARCH", *keys):
+            name, data = response.split()
+            if name == "SEARCH":
+                uids = uids | sequence.MsgIdSet.from_search(data)
+        return uids
+
+    def count_msgs(self, msg_ids) -> int:
+        """
+        Return the number of emails in a message id set or a string of ids split by a comma
+        """
+        if isinstance(msg_ids, str):
+            msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+        return len(msg_ids)
+
+    async def move_to_trash(self, chunk, targeted=False) -> list:
+        """
+        Label a sequence-set of uids as Trash, see `SMPTClient.move_to_trash`
+        """
+        gm_msgids = []
+        if targeted:
+            for response in await self.imap.command("UID", "FETCH", chunk, "(X-GM-MSGID)"):
+                match = GM_MSGID_PATTERN.search(response.text)
+                if match:
+                    gm_msgids.append(int(match.group(1)))
+        await self.imap.command("UID", "STORE", chunk, "+X-GM-LABELS.SILENT", "\\Trash")
+        return gm_msgids
+
+    async def search_gm_msgids(self, gm_msgids, group_size=SEARCH_GROUP_SIZE) -> sequence.MsgIdSet:
+        """
+        Find the uids of messages in the selected folder by their X-GM-MSGID, one pipelined search per group
+        """
+        searches = []
+        for i in range(0, len(gm_msgids), group_size):
+            group = gm_msgids[i:i + group_size]
+            keys = ["OR"] * (len(group) - 1)
+            for gm_msgid in group:
+                keys += ["X-GM-MSGID", str(gm_msgid)]
+            searches.append(self._uid_search(*keys))
+        uids = sequence.MsgIdSet()
+        for found in await asyncio.gather(*searches):
+            uids = uids | found
+        return uids
+
+    async def expunge_uids(self, msg_ids, chunk_size=sequence.CHUNK_SIZE):
+        """
+        Permanently delete only the given uids in the selected folder using UIDPLUS `UID EXPUNGE`
+        """
+        if "UIDPLUS" not in self.imap.capabilities:
+            raise RuntimeError("Server does not support UIDPLUS, cannot expunge targeted messages")
+        commands = []
+        for chunk, count in msg_ids.chunks(chunk_size):
+            commands.append(self.imap.command("UID", "STORE", chunk, "+FLAGS.SILENT", "\\Deleted"))
+            commands.append(self.imap.command("UID", "EXPUNGE", chunk))
+        await asyncio.gather(*commands)
+
+    async def delete_msgs(self, msg_ids, chunk_size=sequence.CHUNK_SIZE, targeted=False):
+        """
+        Delete emails based on method and date, see `SMPTClient.delete_msgs`
+
+        Every chunk is issued at once so the commands are pipelined on the connection
+        """
+        try:
+            if isinstance(msg_ids, str):
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+            if targeted and "UIDPLUS" not in self.imap.capabilities:
+                # checked before anything moves, the selection would otherwise be left in Trash
+                raise RuntimeError("Server does not support UIDPLUS, cannot expunge targeted messages")
+            if not msg_ids:
+                logger.info("No emails matching search criteria")
+                return
+            logger.info(f"Moving {len(msg_ids)} to Trash")
+            results = await asyncio.gather(
+                *[self.move_to_trash(chunk, targeted) for chunk, count in msg_ids.chunks(chunk_size)]
+            )
+            await self.imap.command("SELECT", TRASH_FOLDER)
+            if targeted:
+                gm_msgids = [gm_msgid for result in results for gm_msgid in result]
+                trash_ids = await self.search_gm_msgids(gm_msgids)
+                logger.info(f"Emptying {len(trash_ids)} moved messages from Trash")
+                await self.expunge_uids(trash_ids, chunk_size)
+            else:
+                logger.info("Emptying Trash")
+                await self.imap.command("STORE", "1:*", "+FLAGS.SILENT", "\\Deleted")
+                await self.imap.command("EXPUNGE")
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while deleting messages: {e}")
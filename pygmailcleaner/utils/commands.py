@@ -1,34 +1,36 @@
+from ..utils.query import Category, Unread, Important, Attachment, Not
+
 METHODS = [
     {
         "description": "Only include promotions",
-        "y_search_term": "category:promotions",
-        "n_search_term": "",
+        "y_query": Category("promotions"),
+        "n_query": None,
         "risk": "low",
         "default": "y",
         "response": "y"
     },
     {
         "description": "Only include unread",
-        "y_search_term": "in:unread",
-        "n_search_term": "",
+        "y_query": Unread(),
+        "n_query": None,
         "risk": "high",
         "default": "n",
         "response": "n"
     },
     {
         "description": "Exclude important",
-        "y_search_term": "NOT is: important",
-        "n_search_term": "",
+        "y_query": Not(Important()),
+        "n_query": None,
         "risk": "high",
         "default": "y",
         "response": "y"
     },
     {
         "description": "Exclude attachments",
-        "y_search_term": "NOT has:attachment",
-        "n_search_term": "",
+        "y_query": Not(Attachment()),
+        "n_query": None,
         "risk": "high",
         "default": "y",
         "response": "y"
     },
-]
\ No newline at end of file
+]
@@ -0,0 +1,152 @@
+import imaplib
+import logging
+import os
+import zlib
+
+logger = logging.getLogger()
+
+# zlib compression level of outgoing data, commands are small so speed matters more than ratio
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+
+READ_SIZE = 1 << 16
+
+
+class DeflateStream:
+    """
+    Both directions of an RFC 4978 COMPRESS=DEFLATE connection
+
+    Data is raw DEFLATE (RFC 1951) without zlib headers. Outgoing data is
+    flushed with Z_SYNC_FLUSH so every command reaches the peer immediately.
+    Incoming data is read with `read_raw(size)`, which returns whatever
+    compressed bytes are available, and exposes `read`/`readline` like a file.
+    """
+
+    def __init__(self, read_raw, level=COMPRESS_LEVEL):
+        self._read_raw = read_raw
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        self._buffer = bytearray()
+        self._position = 0
+        self.bytes_in = 0  # decompressed bytes received
+        self.wire_bytes_in = 0  # compressed bytes received
+        self.bytes_out = 0  # bytes sent before compression
+        self.wire_bytes_out = 0  # compressed bytes sent
+
+    def compress(self, data) -> bytes:
+        """
+        Compress outgoing data, which is only guaranteed to be emitted by `flush`
+        """
+        self.bytes_out += len(data)
+        compressed = self._compressor.compress(data)
+        self.wire_bytes_out += len(compressed)
+        return compressed
+
+    def flush(self) -> bytes:
+        """
+        Return the remaining compressed output, ending on a byte boundary
+        """
+        compressed = self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.wire_bytes_out += len(compressed)
+        return compressed
+
+    def _fill(self) -> bool:
+        data = self._read_raw(READ_SIZE)
+        if not data:
+            return False
+        self.wire_bytes_in += len(data)
+        decompressed = self._decompressor.decompress(data)
+        self.bytes_in += len(decompressed)
+        if self._position:
+            # drop consumed bytes only when refilling, not on every line
+            del self._buffer[:self._position]
+            self._position = 0
+        self._buffer += decompressed
+        return True
+
+    def _take(self, end) -> bytes:
+        data = bytes(self._buffer[self._position:end])
+        self._position = min(end, len(self._buffer))
+        return data
+
+    def pending(self) -> int:
+        """
+        Number of decompressed bytes buffered but not read yet
+        """
+        return len(self._buffer) - self._position
+
+    def read(self, size) -> bytes:
+        """
+        Read exactly `size` decompressed bytes, or fewer at end of stream
+        """
+        while len(self._buffer) - self._position < size and self._fill():
+            pass
+        return self._take(self._position + size)
+
+    def readline(self) -> bytes:
+        """
+        Read up to and including the next LF, or the rest of the stream
+        """
+        start = self._position
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end >= 0:
+                return self._take(end + 1)
+            start = len(self._buffer) - self._position
+            if not self._fill():
+                return self._take(len(self._buffer))
+            start += self._position
+
+
+class DeflateIMAPMixin:
+    """
+    Mixin for `imaplib.IMAP4` classes adding COMPRESS=DEFLATE, see `enable_compression`
+
+    Only the transport changes, every existing command method keeps working.
+    """
+
+    deflate = None
+
+    def enable_compression(self, level=COMPRESS_LEVEL) -> bool:
+        """
+        Negotiate COMPRESS=DEFLATE if the server supports it
+
+        Returns:
+            bool: True if the connection is now compressed.
+        """
+        if self.deflate is not None:
+            return True
+        if "COMPRESS=DEFLATE" not in self.capabilities:
+            logger.info("Server does not support COMPRESS=DEFLATE")
+            return False
+        typ, data = self.xatom("COMPRESS", "DEFLATE")
+        if typ != "OK":
+            logger.warning(f"Could not enable compression: {data}")
+            return False
+        # read1 returns bytes already buffered by the file before waiting on the socket
+        self.deflate = DeflateStream(self.file.read1, level)
+        return True
+
+    def send(self, data):
+        if self.deflate is None:
+            return super().send(data)
+        return super().send(self.deflate.compress(data) + self.deflate.flush())
+
+    def read(self, size):
+        if self.deflate is None:
+            return super().read(size)
+        return self.deflate.read(size)
+
+    def readline(self):
+        if self.deflate is None:
+            return super().readline()
+        line = self.deflate.readline()
+        if len(line) > imaplib._MAXLINE:
+            raise self.error(f"got more than {imaplib._MAXLINE} bytes")
+        return line
+
+
+def compressed(imap_class):
+    """
+    Return a subclass of an `imaplib` class supporting COMPRESS=DEFLATE
+    """
+    return type(f"Deflate{imap_class.__name__}", (DeflateIMAPMixin, imap_class), {})
@@ -0,0 +1,159 @@
+import hashlib
+import itertools
+import logging
+import re
+import sqlite3
+
+from ..utils import sequence
+from ..utils.archive import ARCHIVE_BATCH_BYTES, size_batches
+from ..utils.index import header_block
+from ..utils.smpt import FETCH_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+DEDUPE_HEADER_FIELDS = "MESSAGE-ID FROM TO CC SUBJECT DATE"
+DEDUPE_HEADER_ITEMS = f"(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({DEDUPE_HEADER_FIELDS})])"
+DEDUPE_BODY_ITEMS = "(UID BODY.PEEK[TEXT])"
+
+WHITESPACE_PATTERN = re.compile(rb"\s+")
+
+DEDUPE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    uid INTEGER PRIMARY KEY,
+    header_key BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS headers_key ON headers (header_key);
+CREATE TABLE IF NOT EXISTS digests (
+    uid INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS digests_digest ON digests (digest);
+"""
+
+
+def header_key(raw, size) -> bytes:
+    """
+    Digest of the normalized header fields and size of a message
+
+    Folded lines are unfolded, field names lower-cased, whitespace collapsed
+    and fields sorted, so copies differing only in header formatting collide.
+    """
+    fields = []
+    for line in re.split(rb"\r?\n(?![ \t])", raw or b""):
+        name, sep, value = line.partition(b":")
+        if sep:
+            fields.append(name.strip().lower() + b":" + WHITESPACE_PATTERN.sub(b" ", value).strip())
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+    for field in sorted(fields):
+        digest.update(field + b"\n")
+    return digest.digest()
+
+
+def body_digest(key, body) -> bytes:
+    """
+    Digest of a header key and a body with normalized line endings and trailing whitespace
+    """
+    digest = hashlib.blake2b(key, digest_size=16)
+    digest.update(body.replace(b"\r\n", b"\n").rstrip())
+    return digest.digest()
+
+
+class DuplicateIndex:
+    """
+    SQLite index of message digests used to find exact duplicates
+
+    Headers of every message are streamed first and only messages whose
+    normalized headers and size collide have their bodies fetched and hashed,
+    in batches bounded by ARCHIVE_BATCH_BYTES. Digests live in SQLite, an
+    unnamed temporary database spilling to disk by default, so neither bodies
+    nor the index need to fit in memory.
+    """
+
+    def __init__(self, path=""):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(DEDUPE_SCHEMA)
+
+    def close(self):
+        """
+        Close the index database
+        """
+        self.db.close()
+
+    @classmethod
+    def build(cls, client, msg_ids, path="", batch_size=FETCH_CHUNK_SIZE, batch_bytes=ARCHIVE_BATCH_BYTES):
+        """
+        Hash the headers of `msg_ids` and the bodies of those whose headers collide
+
+        Args:
+            client (SMPTClient): A connected client with the folder selected.
+            msg_ids (MsgIdSet): The message uids searched for duplicates.
+            path (str): SQLite database file, default a temporary database.
+            batch_size (int): Number of messages per FETCH.
+            batch_bytes (int): Upper bound of body bytes per FETCH.
+        """
+        try:
+            index = cls(path)
+            # a reused database file describes an earlier state of the folder
+            index.db.executescript("DELETE FROM headers; DELETE FROM digests;")
+            # one pipelined fetch for all chunks, stored a chunk at a time
+            items = client.fetch(msg_ids, DEDUPE_HEADER_ITEMS, batch_size)
+            for batch in iter(lambda: list(itertools.islice(items, batch_size)), []):
+                rows = []
+                for item in batch:
+                    size = item.get("RFC822.SIZE", 0)
+                    rows.append((item["UID"], header_key(header_block(item), size), size))
+                index.db.executemany("INSERT OR REPLACE INTO headers (uid, header_key, size) VALUES (?, ?, ?)", rows)
+            candidates = index.db.execute(
+                "SELECT uid, size, header_key FROM headers WHERE header_key IN "
+                "(SELECT header_key FROM headers GROUP BY header_key HAVING COUNT(*) > 1) ORDER BY uid"
+            )
+            # header keys of the candidates read so far but not hashed yet
+            keys = {}
+
+            def pairs():
+                for uid, size, key in candidates:
+                    keys[uid] = key
+                    yield uid, size
+
+            for batch in size_batches(pairs(), batch_bytes, batch_size):
+                index.db.executemany(
+                    "INSERT OR REPLACE INTO digests (uid, digest) VALUES (?, ?)",
+                    [
+                        (item["UID"], body_digest(keys[item["UID"]], item.get("BODY[TEXT]") or b""))
+                        for item in client.fetch(batch, DEDUPE_BODY_ITEMS, batch_size)
+                    ],
+                )
+                for uid in batch:
+                    keys.pop(uid, None)
+            index.db.commit()
+            return index
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while searching for duplicates: {e}")
+
+    def redundant(self) -> sequence.MsgIdSet:
+        """
+        Return the uids of every copy but the oldest (lowest uid) of each duplicate
+        """
+        rows = self.db.execute(
+            "SELECT uid FROM digests WHERE uid NOT IN (SELECT MIN(uid) FROM digests GROUP BY digest)"
+        )
+        return sequence.MsgIdSet(uid for uid, in rows)
+
+    def stats(self) -> dict:
+        """
+        Return the number of "scanned" messages, hashed "candidates", duplicate "groups",
+        "redundant" copies and the "bytes" they take up
+        """
+        scanned, = self.db.execute("SELECT COUNT(*) FROM headers").fetchone()
+        candidates, = self.db.execute("SELECT COUNT(*) FROM digests").fetchone()
+        groups, = self.db.execute(
+            "SELECT COUNT(*) FROM (SELECT digest FROM digests GROUP BY digest HAVING COUNT(*) > 1)"
+        ).fetchone()
+        redundant, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM headers JOIN digests USING (uid) "
+            "WHERE uid NOT IN (SELECT MIN(uid) FROM digests GROUP BY digest)"
+        ).fetchone()
+        return {"scanned": scanned, "candidates": candidates, "groups": groups, "redundant": redundant, "bytes": size}
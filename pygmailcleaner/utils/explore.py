@@ -0,0 +1,113 @@
+import logging
+
+from ..utils import sequence
+from ..utils.query import And, Or, Not
+
+logger = logging.getLogger()
+
+
+class TermSets:
+    """
+    Uid sets of atomic query terms, combined locally with set algebra
+
+    One UID SEARCH per atomic term is enough to evaluate any query built from
+    those terms: And intersects, Or unites and Not subtracts from the universe,
+    the set of every message up to the date. Sets are kept as int bitmaps so
+    every combination costs a few C-level bitwise operations.
+    """
+
+    def __init__(self, universe, sets):
+        self.universe = universe.to_bitmap()
+        self.sets = {term: msg_ids.to_bitmap() for term, msg_ids in sets.items()}
+
+    @classmethod
+    def search(cls, client, terms, date_until):
+        """
+        Run one search for the universe and one per distinct atomic term
+
+        Args:
+            client (SMPTClient): A connected client.
+            terms (list): Queries whose atomic terms are searched, see `Query.terms`.
+            date_until (str): Only messages before this date are considered.
+        """
+        try:
+            universe = client.get_msg_ids("", date_until)
+            atoms = list(dict.fromkeys(atom for term in terms for atom in term.terms()))
+            sets = {}
+            for atom in atoms:
+                logger.debug(f"Searching term: {atom}")
+                sets[atom] = client.get_msg_ids(atom, date_until) & universe
+            return cls(universe, sets)
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while searching filter terms: {e}")
+
+    def _bitmap(self, query) -> int:
+        if query is None:
+            return self.universe
+        if isinstance(query, And):
+            result = self.universe
+            for part in query.queries:
+                result &= self._bitmap(part)
+            return result
+        if isinstance(query, Or):
+            result = 0
+            for part in query.queries:
+                result |= self._bitmap(part)
+            return result
+        if isinstance(query, Not):
+            return self.universe & ~self._bitmap(query.query)
+        if query not in self.sets:
+            raise KeyError(f"Term {query} was not searched")
+        return self.sets[query]
+
+    def evaluate(self, query) -> sequence.MsgIdSet:
+        """
+        Return the uids matching a query built from the searched terms, None matches everything
+        """
+        return sequence.MsgIdSet.from_bitmap(self._bitmap(query))
+
+    def count(self, query) -> int:
+        """
+        Return the number of messages matching a query built from the searched terms
+        """
+        return sequence.bitmap_count(self._bitmap(query))
+
+    def overlaps(self) -> dict:
+        """
+        Return the number of messages matching each pair of atomic terms, keyed by (term, term)
+        """
+        atoms = list(self.sets)
+        return {
+            (a, b): sequence.bitmap_count(self.sets[a] & self.sets[b])
+            for i, a in enumerate(atoms)
+            for b in atoms[i:]
+        }
+
+    def count_matrix(self, methods) -> list:
+        """
+        Count the messages matched by every one of the 2^N y/n choices of `methods`
+
+        Choices are expanded depth first so the intersection of a common prefix
+        of choices is computed once.
+
+        Returns:
+            list: dicts with the "responses" of every method description and the "count".
+        """
+        options = [
+            (method["description"], [("y", self._bitmap(method["y_query"])), ("n", self._bitmap(method["n_query"]))])
+            for method in methods
+        ]
+        rows = []
+
+        def expand(i, responses, bitmap):
+            if i == len(options):
+                rows.append({"responses": dict(responses), "count": sequence.bitmap_count(bitmap)})
+                return
+            description, choices = options[i]
+            for response, choice in choices:
+                responses.append((description, response))
+                expand(i + 1, responses, bitmap & choice)
+                responses.pop()
+
+        expand(0, [], self.universe)
+        return rows
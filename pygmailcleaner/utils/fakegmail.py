@@ -0,0 +1,1102 @@
+import bisect
+import calendar
+import datetime
+import email.utils
+import logging
+import queue
+import random
+import re
+import select
+import socketserver
+import threading
+import time
+
+from ..utils.protocol import CRLF, _tokenize, quote
+from ..utils.compression import DeflateStream
+
+logger = logging.getLogger()
+
+CAPABILITIES = (
+    "IMAP4rev1 UNSELECT IDLE NAMESPACE QUOTA ID XLIST CHILDREN X-GM-EXT-1 "
+    "UIDPLUS COMPRESS=DEFLATE ENABLE MOVE CONDSTORE ESEARCH LITERAL- SPECIAL-USE"
+)
+
+# advertised only once the session is authenticated, as Gmail does
+AUTHENTICATED_CAPABILITIES = ("UIDPLUS", "COMPRESS=DEFLATE", "ENABLE", "MOVE", "CONDSTORE", "ESEARCH")
+
+ALL_MAIL = "[Google Mail]/All Mail"
+TRASH = "[Google Mail]/Trash"
+SPAM = "[Google Mail]/Spam"
+FOLDER_ALIASES = {
+    "[gmail]/all mail": ALL_MAIL,
+    "[gmail]/trash": TRASH,
+    "[gmail]/bin": TRASH,
+    "[gmail]/spam": SPAM,
+    "inbox": "INBOX",
+}
+
+# seconds between checks for new messages while a session idles
+IDLE_POLL_SECONDS = 0.05
+
+CATEGORIES = ["primary", "promotions", "social", "updates", "forums"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 * 1024}
+
+ATTACHMENT_HEAD = (
+    b"--b1\r\nContent-Type: text/plain; charset=utf-8\r\n\r\nSee attached.\r\n"
+    b"--b1\r\nContent-Type: application/pdf; name=\"file.pdf\"\r\n"
+    b"Content-Disposition: attachment; filename=\"file.pdf\"\r\n"
+    b"Content-Transfer-Encoding: base64\r\n\r\n"
+)
+ATTACHMENT_TAIL = b"\r\n--b1--\r\n"
+
+
+def _filler(size, seed) -> bytes:
+    """
+    Deterministic printable body text of exactly `size` bytes in 78 byte lines
+    """
+    line = (f"{seed:016x}" * 5)[:76].encode() + CRLF
+    lines, rest = divmod(size, len(line))
+    return line * lines + line[:rest]
+
+
+class FakeMessage:
+    """
+    A message of the fake mailbox, its raw RFC 822 form is rendered on demand
+    """
+
+    def __init__(self, gm_msgid, thrid, sender, subject, date, body_size, labels=(), flags=(),
+                 category="primary", attachment=False, message_id=None, body_seed=None):
+        self.gm_msgid = gm_msgid
+        self.thrid = thrid or gm_msgid
+        self.sender = sender
+        self.subject = subject
+        self.date = date
+        self.body_size = body_size
+        self.labels = set(labels)
+        self.flags = set(flags)
+        self.category = category
+        self.attachment = attachment
+        self.message_id = message_id or f"<{gm_msgid}@fake.gmail>"
+        self.body_seed = gm_msgid if body_seed is None else body_seed
+        self.modseq = 1
+        self.deleted = False
+        self.uids = {}
+        self.header = self._render_header()
+        body_overhead = len(ATTACHMENT_HEAD) + len(ATTACHMENT_TAIL) if attachment else 0
+        self.size = len(self.header) + body_overhead + body_size
+
+    def _render_header(self) -> bytes:
+        content_type = (
+            'multipart/mixed; boundary="b1"' if self.attachment else "text/plain; charset=utf-8"
+        )
+        return (
+            f"From: {self.sender}\r\n"
+            f"To: me@gmail.com\r\n"
+            f"Subject: {self.subject}\r\n"
+            f"Date: {email.utils.formatdate(self.date)}\r\n"
+            f"Message-ID: {self.message_id}\r\n"
+            f"MIME-Version: 1.0\r\n"
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+
+    def body(self) -> bytes:
+        filler = _filler(self.body_size, self.body_seed)
+        if self.attachment:
+            return ATTACHMENT_HEAD + filler + ATTACHMENT_TAIL
+        return filler
+
+    def raw(self) -> bytes:
+        return self.header + self.body()
+
+    def header_fields(self, names) -> bytes:
+        names = {name.upper() for name in names}
+        lines = [
+            line for line in self.header.split(CRLF)
+            if line and line.split(b":", 1)[0].decode().upper() in names
+        ]
+        return CRLF.join(lines) + CRLF + CRLF
+
+    def bodystructure(self) -> str:
+        text = f'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" {self.body_size} {self.body_size // 78 + 1} NIL NIL NIL NIL)'
+        if not self.attachment:
+            return text
+        attachment = (
+            f'("APPLICATION" "PDF" ("NAME" "file.pdf") NIL NIL "BASE64" {self.body_size} NIL '
+            f'("ATTACHMENT" ("FILENAME" "file.pdf")) NIL NIL)'
+        )
+        return f'({text}{attachment} "MIXED" ("BOUNDARY" "b1") NIL NIL NIL)'
+
+    def display_labels(self) -> list:
+        return sorted(label for label in self.labels if label != "\\Trash")
+
+
+class FakeFolder:
+    """
+    A folder of the fake mailbox with its own uid space
+    """
+
+    def __init__(self, name, uidvalidity):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.uids = []
+        self.by_uid = {}
+        self.version = 0
+
+    def add(self, msg):
+        uid = self.uidnext
+        self.uidnext += 1
+        self.uids.append(uid)
+        self.by_uid[uid] = msg
+        msg.uids[self.name] = uid
+        self.version += 1
+
+    def remove(self, uids):
+        if not uids:
+            return
+        self.uids = [uid for uid in self.uids if uid not in uids]
+        for uid in uids:
+            msg = self.by_uid.pop(uid)
+            msg.uids.pop(self.name, None)
+        self.version += 1
+
+
+class FakeGmail:
+    """
+    In-memory Gmail account emulating the folders and extensions the client relies on
+
+    Messages live once and appear in folders by label: All Mail holds every
+    message that is not in Trash or Spam, Trash holds messages labelled
+    `\\Trash` and any other label is a folder of its own.
+    """
+
+    def __init__(self, user="me@gmail.com", password="password", uidvalidity=1):
+        self.user = user
+        self.password = password
+        self.uidvalidity = uidvalidity
+        self.lock = threading.RLock()
+        self.messages = {}
+        self.folders = {}
+        self.highestmodseq = 1
+        self._next_gm_msgid = 1000000000000000000
+        for name in (ALL_MAIL, TRASH, SPAM, "INBOX"):
+            self.folder(name)
+
+    def folder(self, name, create=True):
+        name = FOLDER_ALIASES.get(name.lower(), name)
+        if name not in self.folders and create:
+            self.folders[name] = FakeFolder(name, self.uidvalidity)
+        return self.folders.get(name)
+
+    def _folders_of(self, msg) -> list:
+        if msg.deleted:
+            return []
+        if "\\Trash" in msg.labels:
+            return [TRASH]
+        if "\\Spam" in msg.labels:
+            return [SPAM]
+        folders = [ALL_MAIL]
+        for label in msg.labels:
+            if label == "\\Inbox":
+                folders.append("INBOX")
+            elif not label.startswith("\\"):
+                folders.append(label)
+        return folders
+
+    def _place(self, msgs):
+        """
+        Move messages between folders after their labels changed
+        """
+        removals = {}
+        for msg in msgs:
+            wanted = set(self._folders_of(msg))
+            for name in list(msg.uids):
+                if name not in wanted:
+                    removals.setdefault(name, set()).add(msg.uids[name])
+            for name in sorted(wanted):
+                if name not in msg.uids:
+                    self.folder(name).add(msg)
+        for name, uids in removals.items():
+            self.folders[name].remove(uids)
+
+    def touch(self, msg):
+        self.highestmodseq += 1
+        msg.modseq = self.highestmodseq
+
+    def add_message(self, sender="sender@example.com", subject="Hello", date=None, body_size=1000,
+                    labels=("\\Inbox",), flags=(), category="primary", attachment=False,
+                    thrid=None, message_id=None, body_seed=None) -> FakeMessage:
+        """
+        Add a message and return it
+        """
+        with self.lock:
+            self._next_gm_msgid += 1
+            msg = FakeMessage(
+                self._next_gm_msgid, thrid, sender, subject,
+                date if date is not None else time.time(), body_size, labels, flags,
+                category, attachment, message_id, body_seed,
+            )
+            self.messages[msg.gm_msgid] = msg
+            self.touch(msg)
+            self._place([msg])
+            return msg
+
+    def populate(self, count, seed=0, senders=200, start=None, end=None):
+        """
+        Add `count` random messages with a skewed sender distribution, categories,
+        unread/important/attachment mixes, threads and sizes between 1 KB and 5 MB
+        """
+        rng = random.Random(seed)
+        end = end if end is not None else time.time()
+        start = start if start is not None else end - 3 * 365 * 86400
+        domains = ["shop.com", "news.org", "social.net", "bank.com", "friends.io"]
+        pool = [f"sender{i}@{domains[i % len(domains)]}" for i in range(senders)]
+        weights = [1 / (i + 1) for i in range(senders)]
+        recent = []
+        with self.lock:
+            for i in range(count):
+                category = rng.choices(CATEGORIES, weights=[4, 3, 2, 2, 1])[0]
+                labels = {"\\Inbox"} if rng.random() < 0.6 else set()
+                if rng.random() < 0.15:
+                    labels.add("\\Important")
+                flags = set() if rng.random() < 0.25 else {"\\Seen"}
+                size = int(min(5 * 1024 * 1024, rng.lognormvariate(8.5, 1.5)))
+                thrid, subject = None, f"Message {i} about {category}"
+                if recent and rng.random() < 0.3:
+                    parent = rng.choice(recent)
+                    thrid, subject = parent.thrid, "Re: " + parent.subject.replace("Re: ", "")
+                msg = self.add_message(
+                    sender=rng.choices(pool, weights=weights)[0],
+                    subject=subject,
+                    date=start + (end - start) * i / max(count, 1),
+                    body_size=size,
+                    labels=labels,
+                    flags=flags,
+                    category=category,
+                    attachment=rng.random() < 0.1,
+                    thrid=thrid,
+                )
+                recent = (recent + [msg])[-50:]
+        return self
+
+
+# ---------------------------------------------------------------- search
+
+def _parse_size(value) -> int:
+    match = re.match(r"^(\d+)([KM]?)B?$", value.upper())
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)] if match else 0
+
+
+def _parse_gm_date(value) -> float:
+    if value.isdigit():
+        return int(value)
+    return calendar.timegm(datetime.datetime.strptime(value.replace("-", "/"), "%Y/%m/%d").timetuple())
+
+
+def _parse_imap_date(value) -> float:
+    return calendar.timegm(datetime.datetime.strptime(value, "%d-%b-%Y").timetuple())
+
+
+def _gm_term(operator, value):
+    operator, value = operator.lower(), value.lower().strip('"')
+    if operator in ("in", "is", "label"):
+        if value in ("unread",):
+            return lambda msg: "\\Seen" not in msg.flags
+        if value in ("read",):
+            return lambda msg: "\\Seen" in msg.flags
+        if value == "important":
+            return lambda msg: "\\Important" in msg.labels
+        if value == "starred":
+            return lambda msg: "\\Flagged" in msg.flags
+        if value == "inbox":
+            return lambda msg: "\\Inbox" in msg.labels
+        if value == "trash":
+            return lambda msg: "\\Trash" in msg.labels
+        if value == "anywhere":
+            return lambda msg: True
+        return lambda msg: value in {label.lower() for label in msg.labels}
+    if operator == "category":
+        return lambda msg: msg.category == value
+    if operator == "has":
+        if value == "attachment":
+            return lambda msg: msg.attachment
+        return lambda msg: False
+    if operator == "from":
+        return lambda msg: value in msg.sender.lower()
+    if operator == "subject":
+        return lambda msg: value in msg.subject.lower()
+    if operator in ("before", "older"):
+        timestamp = _parse_gm_date(value)
+        return lambda msg: msg.date < timestamp
+    if operator in ("after", "newer"):
+        timestamp = _parse_gm_date(value)
+        return lambda msg: msg.date >= timestamp
+    if operator in ("larger", "size"):
+        size = _parse_size(value)
+        return lambda msg: msg.size > size
+    if operator == "smaller":
+        size = _parse_size(value)
+        return lambda msg: msg.size < size
+    if operator == "rfc822msgid":
+        return lambda msg: msg.message_id.strip("<>").lower() == value.strip("<>")
+    raise ValueError(f"Unsupported X-GM-RAW operator: {operator}")
+
+
+def compile_gm_raw(query):
+    """
+    Compile the supported subset of Gmail search syntax into a predicate on FakeMessage
+
+    Supports AND by juxtaposition, OR, {a b} groups, (a b) groups, NOT/- negation,
+    in:/is:/label:/category:/has:/from:/subject:/before:/after:/older:/newer:/
+    larger:/smaller:/rfc822msgid: operators and bare words matching subject or sender.
+    """
+    tokens = re.findall(r'[{}()]|-?[\w.\-]+:"[^"]*"|"[^"]*"|[^\s{}()]+', query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_sequence(closing=None, any_of=False):
+        terms = []
+        while peek() is not None and peek() != closing:
+            term = parse_or()
+            if term is not None:
+                terms.append(term)
+        if closing is not None and peek() == closing:
+            take()
+        if any_of:
+            return lambda msg: any(term(msg) for term in terms)
+        return lambda msg: all(term(msg) for term in terms)
+
+    def parse_or():
+        left = parse_unary()
+        while peek() == "OR":
+            take()
+            right = parse_unary()
+            left = (lambda a, b: lambda msg: a(msg) or b(msg))(left, right)
+        return left
+
+    def parse_unary():
+        token = take()
+        if token == "NOT":
+            inner = parse_unary()
+            return lambda msg: not inner(msg)
+        if token.startswith("-") and len(token) > 1:
+            tokens.insert(position, token[1:])
+            inner = parse_unary()
+            return lambda msg: not inner(msg)
+        if token == "{":
+            return parse_sequence("}", any_of=True)
+        if token == "(":
+            return parse_sequence(")")
+        if ":" in token and not token.startswith('"'):
+            operator, _, value = token.partition(":")
+            if value == "" and peek() not in (None, "}", ")"):
+                # tolerate a space after the operator, e.g. "is: important"
+                value = take()
+            return _gm_term(operator, value)
+        word = token.strip('"').lower()
+        return lambda msg: word in msg.subject.lower() or word in msg.sender.lower()
+
+    return parse_sequence()
+
+
+# ---------------------------------------------------------------- sessions
+
+def _parse_set(text, maximum) -> list:
+    """
+    Parse a sequence-set such as "1:5,7,9:*" into inclusive (start, end) ranges
+    """
+    ranges = []
+    for part in str(text).split(","):
+        start, _, end = part.partition(":")
+        start = maximum if start == "*" else int(start)
+        end = start if end == "" else (maximum if end == "*" else int(end))
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+class SessionError(Exception):
+    pass
+
+
+class FakeGmailSession:
+    """
+    The protocol state of one client connection
+    """
+
+    def __init__(self, server, rfile, wfile, connection=None):
+        self.server = server
+        self.gmail = server.gmail
+        self.connection = connection
+        self.rfile = rfile
+        self.wfile = wfile
+        self.reader = rfile
+        self.deflate = None
+        self._start_compression = False
+        self.authenticated = False
+        self.folder = None
+        self.view = []
+        self.view_version = None
+        self.view_modseq = 0
+        self.condstore = False
+        self._current_tag = None
+
+    # ------------------------------------------------------------ I/O
+
+    def write(self, data):
+        if self.deflate is not None:
+            data = self.deflate.compress(data)
+        self.wfile.write(data)
+
+    def flush(self):
+        if self.deflate is not None:
+            self.wfile.write(self.deflate.flush())
+        self.wfile.flush()
+
+    def untagged(self, text):
+        self.write(b"* " + (text.encode() if isinstance(text, str) else text) + CRLF)
+
+    def read_command(self):
+        """
+        Read a command line, returning its text with literal placeholders and the literals
+        """
+        line = self.reader.readline()
+        if not line:
+            return None, []
+        text, literals = b"", []
+        while True:
+            match = re.search(rb"\{(\d+)(\+?)\}\r\n$", line)
+            if not match:
+                text += line[:-2]
+                return text, literals
+            if not match.group(2):
+                self.write(b"+ go ahead\r\n")
+                self.flush()
+            text += line[:match.start()] + b"{" + match.group(1) + b"}"
+            literals.append(self.reader.read(int(match.group(1))))
+            line = self.reader.readline()
+
+    def run(self):
+        self.untagged("OK Gimap ready for requests from 127.0.0.1")
+        self.flush()
+        while True:
+            line, literals = self.read_command()
+            if line is None:
+                return
+            if not line.strip():
+                continue
+            tag, _, rest = line.partition(b" ")
+            tag = self._current_tag = tag.decode()
+            name, _, arguments = rest.partition(b" ")
+            name = name.decode().upper()
+            try:
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                if name == "IDLE":
+                    # waits without holding the account lock so other sessions can add mail
+                    if self.idle() is None:
+                        return
+                    status = "OK IDLE terminated (Success)"
+                else:
+                    with self.gmail.lock:
+                        status = self.dispatch(name, arguments, literals)
+                        self.sync_view(report_flags=name == "NOOP")
+                self.write(f"{tag} {status or 'OK ' + name + ' completed'}\r\n".encode())
+            except SessionError as e:
+                self.write(f"{tag} {e}\r\n".encode())
+            except Exception as e:
+                logger.debug(f"Fake Gmail error on {line[:100]!r}: {e}")
+                self.write(f"{tag} BAD {e}\r\n".encode())
+            self.flush()
+            if self._start_compression:
+                # everything after the tagged OK of COMPRESS is compressed in both directions
+                self._start_compression = False
+                self.deflate = DeflateStream(self.rfile.read1)
+                self.reader = self.deflate
+            if name == "LOGOUT":
+                return
+
+    def _readable(self, timeout) -> bool:
+        if self.deflate is not None and self.deflate.pending():
+            return True
+        if self.connection is None:
+            return True
+        return bool(select.select([self.connection], [], [], timeout)[0])
+
+    def idle(self):
+        """
+        Report changes of the selected folder as they happen until the client sends DONE
+
+        Returns:
+            bool: True once DONE is read, None if the client disconnected.
+        """
+        if "IDLE" not in self.server.capabilities:
+            raise SessionError("BAD Unknown command IDLE")
+        if not self.authenticated:
+            raise SessionError("BAD Not authenticated")
+        self.write(b"+ idling\r\n")
+        self.flush()
+        while True:
+            with self.gmail.lock:
+                self.sync_view(report_flags=True)
+            self.flush()
+            if self._readable(IDLE_POLL_SECONDS):
+                line = self.reader.readline()
+                if not line:
+                    return None
+                if line.strip().upper() != b"DONE":
+                    raise SessionError("BAD Expected DONE")
+                return True
+
+    def dispatch(self, name, arguments, literals):
+        args = _tokenize(arguments, literals) if arguments else []
+        if name == "UID":
+            name, args = f"UID {str(args[0]).upper()}", args[1:]
+        handler = {
+            "CAPABILITY": self.do_capability,
+            "NOOP": self.do_noop,
+            "LOGIN": self.do_login,
+            "LOGOUT": self.do_logout,
+            "ENABLE": self.do_enable,
+            "COMPRESS": self.do_compress,
+            "ID": self.do_noop,
+            "SELECT": self.do_select,
+            "EXAMINE": self.do_select,
+            "STATUS": self.do_status,
+            "CLOSE": self.do_close,
+            "UNSELECT": self.do_close,
+            "SEARCH": self.do_search,
+            "UID SEARCH": self.do_search,
+            "FETCH": self.do_fetch,
+            "UID FETCH": self.do_fetch,
+            "STORE": self.do_store,
+            "UID STORE": self.do_store,
+            "EXPUNGE": self.do_expunge,
+            "UID EXPUNGE": self.do_expunge,
+        }.get(name)
+        if handler is None:
+            raise SessionError(f"BAD Unknown command {name}")
+        if name not in ("CAPABILITY", "NOOP", "LOGIN", "LOGOUT", "ID") and not self.authenticated:
+            raise SessionError("BAD Not authenticated")
+        return handler(name.startswith("UID "), args)
+
+    # ------------------------------------------------------------ folder view
+
+    def sync_view(self, report_flags=False):
+        """
+        Report messages added or removed since the last command as EXISTS/EXPUNGE
+
+        With `report_flags`, as on NOOP and IDLE, flag changes since the last
+        report are sent as FETCH, carrying a MODSEQ once CONDSTORE is enabled.
+        """
+        if self.folder is None:
+            return
+        if self.folder.version != self.view_version:
+            live = set(self.folder.uids)
+            removed = [seq for seq, uid in enumerate(self.view, start=1) if uid not in live]
+            for seq in reversed(removed):
+                self.untagged(f"{seq} EXPUNGE")
+            known = set(self.view)
+            added = [uid for uid in self.folder.uids if uid not in known]
+            self.view = [uid for uid in self.view if uid in live] + added
+            if added:
+                self.untagged(f"{len(self.view)} EXISTS")
+            self.view_version = self.folder.version
+        if report_flags and self.view_modseq != self.gmail.highestmodseq:
+            for seq, uid in enumerate(self.view, start=1):
+                msg = self.folder.by_uid.get(uid)
+                if msg is not None and msg.modseq > self.view_modseq:
+                    items = [f"UID {uid}", f"FLAGS ({' '.join(sorted(msg.flags))})"]
+                    if self.condstore:
+                        items.append(f"MODSEQ ({msg.modseq})")
+                    self.untagged(f"{seq} FETCH ({' '.join(items)})")
+            self.view_modseq = self.gmail.highestmodseq
+
+    def resolve(self, uid_mode, text) -> list:
+        """
+        Return the (seq, uid, msg) of every message in a sequence or uid set
+        """
+        if not self.view:
+            return []
+        result = []
+        if uid_mode:
+            for start, end in _parse_set(text, self.view[-1]):
+                low = bisect.bisect_left(self.view, start)
+                high = bisect.bisect_right(self.view, end)
+                result += [(i + 1, self.view[i]) for i in range(low, high)]
+        else:
+            for start, end in _parse_set(text, len(self.view)):
+                result += [(i, self.view[i - 1]) for i in range(max(start, 1), min(end, len(self.view)) + 1)]
+        seen, messages = set(), []
+        for seq, uid in sorted(result):
+            if uid not in seen and uid in self.folder.by_uid:
+                seen.add(uid)
+                messages.append((seq, uid, self.folder.by_uid[uid]))
+        return messages
+
+    # ------------------------------------------------------------ commands
+
+    def do_capability(self, uid_mode, args):
+        capabilities = self.server.capabilities.split()
+        if not self.authenticated:
+            capabilities = [name for name in capabilities if name not in AUTHENTICATED_CAPABILITIES]
+        self.untagged(f"CAPABILITY {' '.join(capabilities)}")
+
+    def do_noop(self, uid_mode, args):
+        pass
+
+    def do_enable(self, uid_mode, args):
+        enabled = [str(arg).upper() for arg in args]
+        enabled = [name for name in enabled if name == "CONDSTORE" and name in self.server.capabilities.split()]
+        if enabled:
+            self.condstore = True
+        self.untagged(" ".join(["ENABLED"] + enabled))
+
+    def do_compress(self, uid_mode, args):
+        if "COMPRESS=DEFLATE" not in self.server.capabilities or str(args[0]).upper() != "DEFLATE":
+            raise SessionError("BAD Unsupported compression")
+        if self.deflate is not None:
+            raise SessionError("NO [COMPRESSIONACTIVE] DEFLATE active via COMPRESS")
+        self._start_compression = True
+        return "OK DEFLATE active"
+
+    def do_login(self, uid_mode, args):
+        user, password = str(args[0]), str(args[1])
+        if user != self.gmail.user or password != self.gmail.password:
+            raise SessionError("NO [AUTHENTICATIONFAILED] Invalid credentials (Failure)")
+        self.authenticated = True
+        return f"OK {user} authenticated (Success)"
+
+    def do_logout(self, uid_mode, args):
+        self.untagged("BYE LOGOUT Requested")
+
+    def do_select(self, uid_mode, args):
+        folder = self.gmail.folder(str(args[0]), create=False)
+        if folder is None:
+            raise SessionError("NO [NONEXISTENT] Unknown Mailbox")
+        self.folder = folder
+        self.view = list(folder.uids)
+        self.view_version = folder.version
+        self.view_modseq = self.gmail.highestmodseq
+        if len(args) > 1 and "CONDSTORE" in [str(arg).upper() for arg in args[1]]:
+            self.condstore = True
+        self.untagged("FLAGS (\\Answered \\Flagged \\Draft \\Deleted \\Seen)")
+        self.untagged("OK [PERMANENTFLAGS (\\Answered \\Flagged \\Draft \\Deleted \\Seen \\*)] Flags permitted.")
+        self.untagged(f"OK [UIDVALIDITY {folder.uidvalidity}] UIDs valid.")
+        self.untagged(f"{len(self.view)} EXISTS")
+        self.untagged("0 RECENT")
+        self.untagged(f"OK [UIDNEXT {folder.uidnext}] Predicted next UID.")
+        if self.condstore:
+            self.untagged(f"OK [HIGHESTMODSEQ {self.gmail.highestmodseq}]")
+        return "OK [READ-WRITE] " + str(args[0]) + " selected. (Success)"
+
+    def do_status(self, uid_mode, args):
+        folder = self.gmail.folder(str(args[0]), create=False)
+        if folder is None:
+            raise SessionError("NO [NONEXISTENT] Unknown Mailbox")
+        messages = [folder.by_uid[uid] for uid in folder.uids]
+        values = {
+            "MESSAGES": len(messages),
+            "RECENT": 0,
+            "UIDNEXT": folder.uidnext,
+            "UIDVALIDITY": folder.uidvalidity,
+            "UNSEEN": sum(1 for msg in messages if "\\Seen" not in msg.flags),
+            "HIGHESTMODSEQ": self.gmail.highestmodseq,
+        }
+        items = " ".join(f"{item.upper()} {values[item.upper()]}" for item in args[1])
+        self.untagged(f"STATUS {quote(folder.name)} ({items})")
+
+    def do_close(self, uid_mode, args):
+        if self.folder is not None:
+            self._expunge([uid for uid in self.folder.uids if "\\Deleted" in self.folder.by_uid[uid].flags])
+        self.folder = None
+        self.view = []
+
+    def _require_folder(self):
+        if self.folder is None:
+            raise SessionError("BAD No mailbox selected")
+
+    def _compile_keys(self, keys, uid_mode):
+        """
+        Compile RFC 3501 search keys into a predicate on (seq, uid, msg)
+        """
+        keys = list(keys)
+
+        def by_gm_msgid(values):
+            predicate = lambda s, u, m: m.gm_msgid in values
+            predicate.gm_msgids = values
+            return predicate
+
+        def parse_one():
+            key = keys.pop(0)
+            if isinstance(key, list):
+                terms = parse_all(key)
+                return lambda s, u, m: all(t(s, u, m) for t in terms)
+            name = str(key).upper()
+            if name == "ALL":
+                return lambda s, u, m: True
+            if name == "OR":
+                a, b = parse_one(), parse_one()
+                if hasattr(a, "gm_msgids") and hasattr(b, "gm_msgids"):
+                    # OR-chains of X-GM-MSGID become one set lookup
+                    return by_gm_msgid(a.gm_msgids | b.gm_msgids)
+                return lambda s, u, m: a(s, u, m) or b(s, u, m)
+            if name == "NOT":
+                a = parse_one()
+                return lambda s, u, m: not a(s, u, m)
+            if name == "UID":
+                ranges = _parse_set(keys.pop(0), self.view[-1] if self.view else 0)
+                return lambda s, u, m: any(low <= u <= high for low, high in ranges)
+            if name == "X-GM-RAW":
+                predicate = compile_gm_raw(str(keys.pop(0)))
+                return lambda s, u, m: predicate(m)
+            if name == "X-GM-MSGID":
+                return by_gm_msgid({int(keys.pop(0))})
+            if name == "X-GM-THRID":
+                value = int(keys.pop(0))
+                return lambda s, u, m: m.thrid == value
+            if name in ("SEEN", "UNSEEN", "FLAGGED", "UNFLAGGED", "DELETED", "UNDELETED", "ANSWERED", "UNANSWERED"):
+                negate = name.startswith("UN")
+                flag = "\\" + (name[2:] if negate else name).capitalize()
+                return lambda s, u, m: (flag in m.flags) != negate
+            if name in ("FROM", "SUBJECT"):
+                value = str(keys.pop(0)).lower()
+                field = "sender" if name == "FROM" else "subject"
+                return lambda s, u, m: value in getattr(m, field).lower()
+            if name == "HEADER":
+                header, value = str(keys.pop(0)).upper(), str(keys.pop(0)).lower()
+                if header == "MESSAGE-ID":
+                    return lambda s, u, m: value in m.message_id.lower()
+                return lambda s, u, m: value in m.header_fields([header]).decode().lower()
+            if name in ("LARGER", "SMALLER"):
+                value = int(keys.pop(0))
+                if name == "LARGER":
+                    return lambda s, u, m: m.size > value
+                return lambda s, u, m: m.size < value
+            if name in ("BEFORE", "SENTBEFORE", "SINCE", "SENTSINCE"):
+                value = _parse_imap_date(str(keys.pop(0)))
+                if name.endswith("BEFORE"):
+                    return lambda s, u, m: m.date < value
+                return lambda s, u, m: m.date >= value
+            if name == "MODSEQ":
+                value = int(keys.pop(0))
+                return lambda s, u, m: m.modseq >= value
+            if name == "X-GM-LABELS":
+                value = str(keys.pop(0)).lower()
+                return lambda s, u, m: value in {label.lower() for label in m.labels}
+            if name == "KEYWORD":
+                # Gmail exposes no keywords, match flags and labels by name, e.g. $Important
+                value = str(keys.pop(0)).lower().lstrip("$\\")
+                return lambda s, u, m: value in {flag.lower().lstrip("$\\") for flag in m.labels | m.flags}
+            if re.match(r"^[\d:*,]+$", name):
+                ranges = _parse_set(name, len(self.view))
+                return lambda s, u, m: any(low <= s <= high for low, high in ranges)
+            raise SessionError(f"BAD Unsupported search key {name}")
+
+        def parse_all(items):
+            nonlocal keys
+            saved, keys = keys, list(items)
+            terms = []
+            while keys:
+                terms.append(parse_one())
+            keys = saved
+            return terms
+
+        return parse_all(keys)
+
+    def do_search(self, uid_mode, args):
+        self._require_folder()
+        returns = None
+        if args and str(args[0]).upper() == "RETURN":
+            returns = [str(item).upper() for item in args[1]] or ["ALL"]
+            args = args[2:]
+        if args and str(args[0]).upper() == "CHARSET":
+            args = args[2:]
+        terms = self._compile_keys(args, uid_mode)
+        found = []
+        for seq, uid in enumerate(self.view, start=1):
+            msg = self.folder.by_uid[uid]
+            if all(term(seq, uid, msg) for term in terms):
+                found.append(uid if uid_mode else seq)
+        if returns is None:
+            self.untagged("SEARCH" + "".join(f" {i}" for i in found))
+            return
+        data = []
+        if "MIN" in returns and found:
+            data.append(f"MIN {found[0]}")
+        if "MAX" in returns and found:
+            data.append(f"MAX {found[-1]}")
+        if "COUNT" in returns:
+            data.append(f"COUNT {len(found)}")
+        if "ALL" in returns and found:
+            ranges = []
+            for i in found:
+                if ranges and i == ranges[-1][1] + 1:
+                    ranges[-1][1] = i
+                else:
+                    ranges.append([i, i])
+            data.append("ALL " + ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges))
+        tag_uid = " UID" if uid_mode else ""
+        self.untagged(f"ESEARCH (TAG \"{self._current_tag}\"){tag_uid}" + "".join(" " + d for d in data))
+
+    def _fetch_items(self, items):
+        if not isinstance(items, list):
+            items = [items]
+        expanded = []
+        for item in items:
+            name = str(item).upper()
+            if name == "ALL":
+                expanded += ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]
+            elif name == "FAST":
+                expanded += ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]
+            elif name == "FULL":
+                expanded += ["FLAGS", "INTERNALDATE", "RFC822.SIZE", "BODYSTRUCTURE"]
+            else:
+                expanded.append(str(item))
+        return expanded
+
+    def _fetch_item(self, item, uid, msg):
+        """
+        Return the (response bytes, sets_seen) of a single FETCH data item
+        """
+        name = item.upper()
+        if name == "UID":
+            return f"UID {uid}".encode(), False
+        if name == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(msg.flags))})".encode(), False
+        if name == "RFC822.SIZE":
+            return f"RFC822.SIZE {msg.size}".encode(), False
+        if name == "X-GM-MSGID":
+            return f"X-GM-MSGID {msg.gm_msgid}".encode(), False
+        if name == "X-GM-THRID":
+            return f"X-GM-THRID {msg.thrid}".encode(), False
+        if name == "X-GM-LABELS":
+            labels = " ".join(quote(label) for label in msg.display_labels())
+            return f"X-GM-LABELS ({labels})".encode(), False
+        if name == "MODSEQ":
+            return f"MODSEQ ({msg.modseq})".encode(), False
+        if name == "INTERNALDATE":
+            date = datetime.datetime.fromtimestamp(msg.date, datetime.timezone.utc)
+            value = f"{date.day:02d}-{MONTHS[date.month - 1]}-{date.year} {date:%H:%M:%S} +0000"
+            return f'INTERNALDATE "{value}"'.encode(), False
+        if name in ("BODYSTRUCTURE", "BODY"):
+            return f"{name} {msg.bodystructure()}".encode(), False
+        if name in ("RFC822", "RFC822.HEADER", "RFC822.TEXT"):
+            content = {"RFC822": msg.raw, "RFC822.HEADER": lambda: msg.header, "RFC822.TEXT": msg.body}[name]()
+            return f"{name} {{{len(content)}}}".encode() + CRLF + content, name != "RFC822.HEADER"
+        match = re.match(r"^BODY(\.PEEK)?\[(.*)\](<\d+\.\d+>)?$", item, re.IGNORECASE)
+        if match:
+            section = match.group(2)
+            upper = section.upper()
+            if upper == "":
+                content = msg.raw()
+            elif upper == "HEADER":
+                content = msg.header
+            elif upper == "TEXT":
+                content = msg.body()
+            elif upper.startswith("HEADER.FIELDS"):
+                names = re.findall(r"[\w-]+", section[len("HEADER.FIELDS"):])
+                content = msg.header_fields(names)
+            else:
+                raise SessionError(f"BAD Unsupported section {section}")
+            partial = match.group(3)
+            key = f"BODY[{section}]"
+            if partial:
+                start, length = map(int, partial[1:-1].split("."))
+                content = content[start:start + length]
+                key += f"<{start}>"
+            return f"{key} {{{len(content)}}}".encode() + CRLF + content, match.group(1) is None
+        raise SessionError(f"BAD Unsupported fetch item {item}")
+
+    def do_fetch(self, uid_mode, args):
+        self._require_folder()
+        items = self._fetch_items(args[1])
+        changedsince = None
+        if len(args) > 2 and isinstance(args[2], list):
+            modifiers = [str(value).upper() for value in args[2]]
+            if "CHANGEDSINCE" in modifiers:
+                changedsince = int(args[2][modifiers.index("CHANGEDSINCE") + 1])
+                if "MODSEQ" not in [item.upper() for item in items]:
+                    items.append("MODSEQ")
+        if uid_mode and "UID" not in [item.upper() for item in items]:
+            items.insert(0, "UID")
+        for seq, uid, msg in self.resolve(uid_mode, args[0]):
+            if changedsince is not None and msg.modseq <= changedsince:
+                continue
+            parts, seen = [], False
+            for item in items:
+                data, sets_seen = self._fetch_item(item, uid, msg)
+                parts.append(data)
+                seen = seen or sets_seen
+            if seen and "\\Seen" not in msg.flags:
+                msg.flags.add("\\Seen")
+                self.gmail.touch(msg)
+            self.write(f"* {seq} FETCH (".encode() + b" ".join(parts) + b")" + CRLF)
+
+    def do_store(self, uid_mode, args):
+        self._require_folder()
+        target, action, values = args[0], str(args[1]).upper(), args[2]
+        values = [str(value) for value in (values if isinstance(values, list) else [values])]
+        silent = action.endswith(".SILENT")
+        action = action.replace(".SILENT", "")
+        mode, attribute = ("", action) if action[0] not in "+-" else (action[0], action[1:])
+        messages = self.resolve(uid_mode, target)
+        changed = []
+        for seq, uid, msg in messages:
+            current = msg.flags if attribute == "FLAGS" else msg.labels
+            if attribute == "X-GM-LABELS":
+                values = ["\\Inbox" if value.lower() == "\\inbox" else value for value in values]
+            before = set(current)
+            if mode == "+":
+                current.update(values)
+            elif mode == "-":
+                current.difference_update(values)
+            else:
+                current.clear()
+                current.update(values)
+            if current != before:
+                self.gmail.touch(msg)
+                changed.append(msg)
+            if not silent:
+                items = [f"UID {uid}"] if uid_mode else []
+                if attribute == "FLAGS":
+                    items.append(f"FLAGS ({' '.join(sorted(msg.flags))})")
+                else:
+                    items.append(f"X-GM-LABELS ({' '.join(quote(label) for label in msg.display_labels())})")
+                items.append(f"MODSEQ ({msg.modseq})")
+                self.untagged(f"{seq} FETCH ({' '.join(items)})")
+        if attribute == "X-GM-LABELS":
+            self.gmail._place(changed)
+
+    def _expunge(self, uids):
+        messages = [self.folder.by_uid[uid] for uid in uids]
+        for msg in messages:
+            if self.folder.name in (ALL_MAIL, TRASH, SPAM):
+                msg.deleted = True
+                self.gmail.messages.pop(msg.gm_msgid, None)
+            else:
+                # expunging from a label folder only removes that label
+                msg.labels.discard("\\Inbox" if self.folder.name == "INBOX" else self.folder.name)
+                msg.flags.discard("\\Deleted")
+                self.gmail.touch(msg)
+        self.gmail._place(messages)
+
+    def do_expunge(self, uid_mode, args):
+        self._require_folder()
+        candidates = self.resolve(True, args[0]) if uid_mode else self.resolve(False, "1:*")
+        self._expunge([uid for seq, uid, msg in candidates if "\\Deleted" in msg.flags])
+
+
+class _DelayedWriter:
+    """
+    Writer delivering every flushed block `delay` seconds later without blocking the session
+
+    Emulates the round trip of a network link: the server keeps answering
+    pipelined commands while earlier responses are still in flight.
+    """
+
+    def __init__(self, wfile, delay):
+        self.wfile = wfile
+        self.delay = delay
+        self._buffer = bytearray()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        self._buffer += data
+
+    def flush(self):
+        if self._buffer:
+            self._queue.put((time.monotonic() + self.delay, bytes(self._buffer)))
+            self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        self._queue.put((None, None))
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            due, data = self._queue.get()
+            if data is None:
+                return
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                return
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    wbufsize = 1 << 16
+
+    def handle(self):
+        rtt = self.server.fake.rtt
+        wfile = _DelayedWriter(self.wfile, rtt) if rtt else self.wfile
+        session = FakeGmailSession(self.server.fake, self.rfile, wfile, self.connection)
+        self.server.fake.sessions.add(session)
+        try:
+            session.run()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.fake.sessions.discard(session)
+            if rtt:
+                wfile.close()
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeGmailServer:
+    """
+    Local plain-text IMAP server backed by a FakeGmail account
+
+    Usage:
+        with FakeGmailServer(FakeGmail().populate(1000), latency=0.01) as server:
+            client = SMPTClient(server.host, server.port, "me@gmail.com", "password", use_ssl=False)
+
+    `latency` adds a fixed delay in seconds before every command is answered,
+    emulating a slow server. `rtt` delivers every response that many seconds
+    after it is written while the server keeps reading commands, emulating the
+    round trip of a network link that pipelined commands can overlap.
+    """
+
+    def __init__(self, gmail=None, host="127.0.0.1", port=0, latency=0.0, capabilities=CAPABILITIES, rtt=0.0):
+        self.gmail = gmail or FakeGmail()
+        self.latency = latency
+        self.rtt = rtt
+        self.capabilities = capabilities
+        self.sessions = set()
+        self._server = _ThreadingServer((host, port), _RequestHandler)
+        self._server.fake = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -13,4 +13,10 @@ def return_logo():
     ||__|||__|||__|||__|||__|||__|||__|||_______|||__|||__|||__|||__|||__|||__|||__||
     |/__\|/__\|/__\|/__\|/__\|/__\|/__\|/_______\|/__\|/__\|/__\|/__\|/__\|/__\|/__\| 
             
-    """
\ No newline at end of file
+    """
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,69 @@
+import heapq
+
+
+class SpaceSaving:
+    """
+    Bounded-memory heavy-hitters counter using the Space-Saving algorithm
+
+    At most `capacity` keys are tracked. When a new key arrives while full, the
+    key with the smallest count is evicted and the newcomer inherits its count
+    as an over-estimation error. Any key whose true count exceeds
+    total / capacity is guaranteed to be tracked.
+
+    Each key also accumulates a secondary weight, which restarts from 0 when
+    a key is evicted and tracked again and so carries no error bound. To rank
+    by a weight such as message bytes with the same guarantee, add it as the
+    `count` of a separate instance.
+    """
+
+    def __init__(self, capacity=1000):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.total = 0
+        self._counters = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, weight=0, count=1):
+        """
+        Count an occurrence of `key` carrying `weight`, `count` may be any non-negative amount
+        """
+        self.total += count
+        counter = self._counters.get(key)
+        if counter is None:
+            error = 0
+            if len(self._counters) >= self.capacity:
+                error, evicted = self._pop_min()
+                del self._counters[evicted]
+            counter = self._counters[key] = [error, error, 0]
+        counter[0] += count
+        counter[2] += weight
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c[0], k) for k, c in self._counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        # heap entries are lazily invalidated, skip those that no longer match a live count
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self._counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def top(self, k=10, by="count") -> list:
+        """
+        Return the k heaviest keys sorted by "count" or "weight"
+
+        Returns:
+            list: dicts with key, count, error and weight. The true count lies in [count - error, count].
+        """
+        index = 0 if by == "count" else 2
+        items = heapq.nlargest(k, self._counters.items(), key=lambda item: item[1][index])
+        return [
+            {"key": key, "count": counter[0], "error": counter[1], "weight": counter[2]}
+            for key, counter in items
+        ]
@@ -0,0 +1,298 @@
+import email.parser
+import email.policy
+import email.utils
+import itertools
+import json
+import logging
+import os
+import sqlite3
+
+from ..utils import sequence
+from ..utils import protocol
+from ..utils.archive import parse_internaldate
+from ..utils.smpt import MAIN_FOLDER, FETCH_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+# directory holding the local per-account header indexes
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.path.expanduser("~"), ".pygmailcleaner"))
+
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID CONTENT-TYPE"
+SYNC_ITEMS = f"(UID X-GM-MSGID INTERNALDATE RFC822.SIZE X-GM-LABELS FLAGS BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    folder TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    gm_msgid INTEGER,
+    message_id TEXT,
+    sender TEXT,
+    sender_address TEXT,
+    subject TEXT,
+    date INTEGER,
+    size INTEGER,
+    labels TEXT,
+    flags TEXT,
+    content_type TEXT,
+    received INTEGER,
+    PRIMARY KEY (folder, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (folder, sender_address);
+CREATE TABLE IF NOT EXISTS state (
+    folder TEXT PRIMARY KEY,
+    uidvalidity INTEGER,
+    uidnext INTEGER,
+    highestmodseq INTEGER
+);
+"""
+
+HEADER_PARSER = email.parser.BytesHeaderParser(policy=email.policy.default)
+
+
+def index_path(user) -> str:
+    """
+    Return the default index file for an account
+    """
+    return os.path.join(INDEX_DIR, f"{user}.sqlite")
+
+
+def parse_headers(raw) -> dict:
+    """
+    Parse the raw From/Subject/Date/Message-ID/Content-Type header block of a message
+    """
+    headers = {
+        "sender": None,
+        "sender_address": None,
+        "subject": None,
+        "date": None,
+        "message_id": None,
+        "content_type": None,
+    }
+    if not raw:
+        return headers
+    try:
+        msg = HEADER_PARSER.parsebytes(raw)
+        sender = msg.get("From")
+        if sender is not None:
+            headers["sender"] = str(sender)
+            headers["sender_address"] = email.utils.parseaddr(str(sender))[1].lower() or None
+        subject = msg.get("Subject")
+        headers["subject"] = str(subject) if subject is not None else None
+        message_id = msg.get("Message-ID")
+        headers["message_id"] = str(message_id).strip() if message_id is not None else None
+        if msg.get("Content-Type") is not None:
+            headers["content_type"] = msg.get_content_type()
+        if msg.get("Date") is not None:
+            headers["date"] = int(email.utils.parsedate_to_datetime(str(msg.get("Date"))).timestamp())
+    except Exception as e:
+        logger.debug(f"Could not parse headers {raw[:100]!r}: {e}")
+    return headers
+
+
+def header_block(item) -> bytes:
+    """
+    Return the BODY[HEADER.FIELDS ...] value of a parsed FETCH item
+    """
+    for key, value in item.items():
+        if key.startswith("BODY[HEADER"):
+            return value
+    return None
+
+
+class HeaderIndex:
+    """
+    On-disk SQLite index of per-message headers, labels and flags
+
+    `sync` keeps the index current incrementally: new messages are found from
+    UIDNEXT, flag and label changes from CONDSTORE HIGHESTMODSEQ, and the
+    whole folder is re-indexed only when UIDVALIDITY changes.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(messages)")}
+        if "content_type" not in columns:
+            # indexes created before content types were stored
+            self.db.execute("ALTER TABLE messages ADD COLUMN content_type TEXT")
+        if "received" not in columns:
+            # indexes created before received dates were stored are rebuilt on the next sync
+            self.db.execute("ALTER TABLE messages ADD COLUMN received INTEGER")
+            self.db.executescript("DELETE FROM messages; DELETE FROM state;")
+
+    def close(self):
+        """
+        Close the index file
+        """
+        self.db.close()
+
+    def get_state(self, folder=MAIN_FOLDER) -> dict:
+        """
+        Return the stored UIDVALIDITY/UIDNEXT/HIGHESTMODSEQ of a folder, or None if never synced
+        """
+        row = self.db.execute("SELECT * FROM state WHERE folder = ?", (folder,)).fetchone()
+        return dict(row) if row else None
+
+    def count(self, folder=MAIN_FOLDER) -> int:
+        """
+        Return the number of indexed messages in a folder
+        """
+        return self.db.execute("SELECT COUNT(*) FROM messages WHERE folder = ?", (folder,)).fetchone()[0]
+
+    def uids(self, folder=MAIN_FOLDER) -> sequence.MsgIdSet:
+        """
+        Return the set of indexed uids in a folder
+        """
+        rows = self.db.execute("SELECT uid FROM messages WHERE folder = ?", (folder,))
+        return sequence.MsgIdSet(row[0] for row in rows)
+
+    def rows(self, folder=MAIN_FOLDER):
+        """
+        Yield every indexed message of a folder as a dict, labels and flags decoded to lists
+        """
+        for row in self.db.execute("SELECT * FROM messages WHERE folder = ? ORDER BY uid", (folder,)):
+            row = dict(row)
+            row["labels"] = json.loads(row["labels"] or "[]")
+            row["flags"] = json.loads(row["flags"] or "[]")
+            yield row
+
+    def search(self, query, folder=MAIN_FOLDER, uids=None) -> sequence.MsgIdSet:
+        """
+        Evaluate a `query.Query` against the indexed messages without contacting the server
+
+        Args:
+            query (Query): The query, see `Query.matches`.
+            folder (str): The indexed folder.
+            uids (MsgIdSet): Optionally only consider these uids, e.g. to refine a server search.
+
+        Returns:
+            MsgIdSet: The uids of the matching messages.
+        """
+        return sequence.MsgIdSet(
+            row["uid"]
+            for row in self.rows(folder)
+            if (uids is None or row["uid"] in uids) and query.matches(row)
+        )
+
+    def clear(self, folder=MAIN_FOLDER):
+        """
+        Remove every message and the sync state of a folder
+        """
+        self.db.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+        self.db.execute("DELETE FROM state WHERE folder = ?", (folder,))
+        self.db.commit()
+
+    def _insert(self, folder, items):
+        rows = []
+        for item in items:
+            headers = parse_headers(header_block(item))
+            received = parse_internaldate(item.get("INTERNALDATE"))
+            rows.append((
+                folder,
+                item["UID"],
+                item.get("X-GM-MSGID"),
+                headers["message_id"],
+                headers["sender"],
+                headers["sender_address"],
+                headers["subject"],
+                headers["date"],
+                item.get("RFC822.SIZE"),
+                json.dumps(item.get("X-GM-LABELS") or []),
+                json.dumps(item.get("FLAGS") or []),
+                headers["content_type"],
+                int(received.timestamp()) if received is not None else None,
+            ))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.db.commit()
+        return len(rows)
+
+    def _update_flags(self, folder, items):
+        rows = [
+            (json.dumps(item.get("X-GM-LABELS") or []), json.dumps(item.get("FLAGS") or []), folder, item["UID"])
+            for item in items
+            if "UID" in item
+        ]
+        self.db.executemany("UPDATE messages SET labels = ?, flags = ? WHERE folder = ? AND uid = ?", rows)
+        self.db.commit()
+        return len(rows)
+
+    def _save_state(self, folder, status):
+        self.db.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)",
+            (folder, status.get("UIDVALIDITY"), status.get("UIDNEXT"), status.get("HIGHESTMODSEQ")),
+        )
+        self.db.commit()
+
+    def sync(self, client, folder=MAIN_FOLDER, batch_size=FETCH_CHUNK_SIZE) -> dict:
+        """
+        Bring the index of a folder up to date with the server
+
+        Args:
+            client (SMPTClient): A connected client.
+            folder (str): The folder to index, selected by this method.
+            batch_size (int): Number of messages per FETCH.
+
+        Returns:
+            dict: The number of "new", "updated" and "removed" messages.
+        """
+        try:
+            condstore = "CONDSTORE" in client.imap.capabilities
+            items = ["MESSAGES", "UIDVALIDITY", "UIDNEXT"] + (["HIGHESTMODSEQ"] if condstore else [])
+            status = client.get_status(folder, items)
+            client.imap.select(folder)
+
+            state = self.get_state(folder)
+            if state and state["uidvalidity"] != status["UIDVALIDITY"]:
+                logger.info(f"UIDVALIDITY of {folder} changed, rebuilding index")
+                self.clear(folder)
+                state = None
+            last_uidnext = state["uidnext"] if state else 1
+            summary = {"new": 0, "updated": 0, "removed": 0}
+
+            if status["UIDNEXT"] > last_uidnext:
+                typ, [found] = client.imap.uid("SEARCH", "UID", f"{last_uidnext}:*")
+                new_ids = sequence.MsgIdSet(
+                    uid for uid in sequence.MsgIdSet.from_search(found) if uid >= last_uidnext
+                )
+                logger.info(f"Indexing {len(new_ids)} new messages")
+                # one pipelined fetch for all chunks, stored a chunk at a time
+                items = client.fetch(new_ids, SYNC_ITEMS, batch_size)
+                for batch in iter(lambda: list(itertools.islice(items, batch_size)), []):
+                    summary["new"] += self._insert(folder, batch)
+
+            if (
+                state
+                and condstore
+                and state["highestmodseq"]
+                and status.get("HIGHESTMODSEQ") != state["highestmodseq"]
+                and last_uidnext > 1
+            ):
+                typ, data = client.imap.uid(
+                    "FETCH",
+                    f"1:{last_uidnext - 1}",
+                    "(UID FLAGS X-GM-LABELS)",
+                    f"(CHANGEDSINCE {state['highestmodseq']})",
+                )
+                summary["updated"] = self._update_flags(folder, protocol.iter_fetch(data))
+
+            if self.count(folder) != status["MESSAGES"]:
+                typ, [found] = client.imap.uid("SEARCH", "ALL")
+                removed = self.uids(folder) - sequence.MsgIdSet.from_search(found)
+                self.db.executemany(
+                    "DELETE FROM messages WHERE folder = ? AND uid = ?",
+                    [(folder, uid) for uid in removed],
+                )
+                summary["removed"] = len(removed)
+
+            self._save_state(folder, status)
+            logger.info(f"Index sync of {folder}: {summary}")
+            return summary
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while syncing the header index: {e}")
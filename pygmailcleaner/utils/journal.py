@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from ..utils import sequence
+from ..utils.index import INDEX_DIR
+
+logger = logging.getLogger()
+
+# directory holding the journals of interrupted deletions
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(INDEX_DIR, "journals"))
+
+
+def journal_key(user, folder, uidvalidity, search) -> str:
+    """
+    Return the journal file name of a deletion, unique per account, folder, UIDVALIDITY and search
+    """
+    key = "\0".join(str(part) for part in (user, folder, uidvalidity, search))
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class DeleteJournal:
+    """
+    Append-only record of the chunks of a deletion that are already moved to Trash
+
+    Every line is a JSON record flushed and fsynced before the next chunk is
+    sent, so an interrupted run can be resumed from the last completed chunk:
+
+        {"planned": "1:500"}                            uids matched when the deletion started
+        {"moved": "1:100", "gm_msgids": [...]}          a chunk labelled as Trash
+
+    The journal is removed once Trash has been emptied.
+
+    Uids are only stable within one UIDVALIDITY, which is part of the key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.planned = sequence.MsgIdSet()
+        self.moved = sequence.MsgIdSet()
+        self.gm_msgids = []
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def for_search(cls, client, search, directory=None):
+        """
+        Open the journal of deleting the results of `search` from the client's selected folder
+        """
+        uidvalidity = client.get_mailbox_state()[0]
+        name = journal_key(client.user, client.folder, uidvalidity, search)
+        return cls(os.path.join(directory or JOURNAL_DIR, f"{name}.jsonl"))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short by a crash, the chunk is then simply redone
+                    logger.debug(f"Ignoring incomplete journal record: {line!r}")
+                    continue
+                if "planned" in record:
+                    self.planned = self.planned | sequence.MsgIdSet.from_string(record["planned"])
+                if "moved" in record:
+                    self.moved = self.moved | sequence.MsgIdSet.from_string(record["moved"])
+                    self.gm_msgids += record.get("gm_msgids", [])
+
+    def _append(self, record):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start(self, msg_ids) -> sequence.MsgIdSet:
+        """
+        Record the uids to delete and return those not moved yet by a previous run
+        """
+        if isinstance(msg_ids, str):
+            msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+        new_ids = msg_ids - self.planned
+        if new_ids:
+            self._append({"planned": str(new_ids)})
+            self.planned = self.planned | new_ids
+        remaining = self.planned - self.moved
+        if self.moved:
+            print(f"Resuming interrupted deletion, {len(self.moved)} emails already moved to Trash")
+        return remaining
+
+    def record_moved(self, chunk, gm_msgids=()):
+        """
+        Record a sequence-set of uids as moved to Trash
+        """
+        self._append({"moved": chunk, "gm_msgids": list(gm_msgids)})
+        with self._lock:
+            self.moved = self.moved | sequence.MsgIdSet.from_string(chunk)
+            self.gm_msgids += gm_msgids
+
+    def finish(self):
+        """
+        Mark the deletion as complete by removing the journal
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
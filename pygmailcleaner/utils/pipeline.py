@@ -0,0 +1,64 @@
+import collections
+import imaplib
+import logging
+import os
+
+logger = logging.getLogger()
+
+# maximum number of tagged commands in flight on one connection
+PIPELINE_WINDOW = int(os.getenv("PIPELINE_WINDOW", 16))
+
+
+def _send_uid(imap, command, args) -> str:
+    command = command.upper()
+    if command not in imaplib.Commands:
+        raise imap.error(f"Unknown IMAP4 UID command: {command}")
+    if imap.state not in imaplib.Commands[command]:
+        raise imap.error(f"command {command} illegal in state {imap.state}")
+    return imap._command("UID", command, *args)
+
+
+def _complete_uid(imap, command, tag) -> tuple:
+    typ, data = imap._command_complete("UID", tag)
+    name = command.upper() if command.upper() in ("SEARCH", "SORT", "THREAD") else "FETCH"
+    return imap._untagged_response(typ, data, name)
+
+
+def uid_pipeline(imap, commands, window=PIPELINE_WINDOW):
+    """
+    Send `UID <command> <args>` for every (command, *args) tuple with up to `window` in flight
+
+    `imaplib` completes every command before sending the next, so a run of
+    chunked FETCH or STORE commands pays one round trip each. Here commands
+    are written on `imap`, an `imaplib.IMAP4` connection, as soon as the window
+    allows and completed in the order they were sent. Servers such as Gmail
+    answer in that order, so the untagged data read while completing a tag
+    belongs to that command. `commands` is consumed lazily and may be a generator.
+
+    Yields:
+        tuple: (typ, data) of every command in order, as `imaplib.IMAP4.uid` returns them.
+    """
+    window = max(1, window)
+    commands = iter(commands)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < window:
+                command = next(commands, None)
+                if command is None:
+                    break
+                pending.append((command[0], _send_uid(imap, command[0], command[1:])))
+            if not pending:
+                return
+            command, tag = pending.popleft()
+            yield _complete_uid(imap, command, tag)
+    finally:
+        # complete the commands still in flight so the connection stays in sync
+        while pending:
+            command, tag = pending.popleft()
+            try:
+                _complete_uid(imap, command, tag)
+            except imap.abort:
+                break
+            except Exception as e:
+                logger.debug(f"Discarding pipelined {command} {tag}: {e}")
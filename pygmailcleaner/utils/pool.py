@@ -0,0 +1,161 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utils import sequence
+from ..utils import scheduler
+from ..utils.smpt import SMPTClient, MAIN_FOLDER, TRASH_FOLDER, SEARCH_GROUP_SIZE
+
+logger = logging.getLogger()
+
+# Gmail allows at most 15 simultaneous IMAP connections per account
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 10))
+
+
+class SMPTClientPool:
+    """
+    Pool of authenticated SMPTClient sessions on the same folder
+
+    Bulk operations are split into disjoint uid chunks which are processed
+    concurrently, each chunk borrowing one connection from the pool.
+    """
+
+    def __init__(self, server, port, user, password, size=4, max_connections=MAX_CONNECTIONS, use_ssl=True, profiler=None, compress=False):
+        if size > max_connections:
+            logger.warning(f"Limiting pool to {max_connections} connections")
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.profiler = profiler
+        self.compress = compress
+        self.size = max(1, min(size, max_connections))
+        self.clients = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def connect(self, FOLDER=MAIN_FOLDER):
+        """
+        Open `size` connections to the server and select the folder on each
+        """
+        try:
+            self.clients = [
+                SMPTClient(
+                    self.server, self.port, self.user, self.password,
+                    use_ssl=self.use_ssl, profiler=self.profiler, compress=self.compress,
+                )
+                for _ in range(self.size)
+            ]
+            self._for_each_client(lambda client: client.connect(FOLDER))
+            for client in self.clients:
+                self._idle.put(client)
+        except Exception as e:
+            raise ConnectionError(f"Could not connect pool to server: {e}")
+
+    def close(self):
+        """
+        Close every connection in the pool
+        """
+        try:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+            self._idle = queue.Queue()
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while closing the pool: {e}")
+
+    def _for_each_client(self, fn) -> list:
+        with ThreadPoolExecutor(self.size) as executor:
+            return list(executor.map(fn, self.clients))
+
+    def map(self, fn, items) -> list:
+        """
+        Run `fn(client, item)` for every item concurrently, each call borrowing an idle connection
+        """
+        def run(item):
+            client = self._idle.get()
+            try:
+                return fn(client, item)
+            finally:
+                self._idle.put(client)
+
+        with ThreadPoolExecutor(self.size) as executor:
+            return list(executor.map(run, items))
+
+    def select(self, folder):
+        """
+        Select the folder on every connection
+        """
+        self._for_each_client(lambda client: client.imap.select(folder))
+
+    def count_msgs(self, msg_ids) -> int:
+        """
+        Return the number of emails in a message id set, see `SMPTClient.count_msgs`
+        """
+        return SMPTClient.count_msgs(self, msg_ids)
+
+    def delete_msgs(self, msg_ids, chunk_size=sequence.CHUNK_SIZE, targeted=False, journal=None):
+        """
+        Delete emails concurrently over the pool, see `SMPTClient.delete_msgs`
+        """
+        try:
+            if isinstance(msg_ids, str):
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+            if targeted and "UIDPLUS" not in self.clients[0].imap.capabilities:
+                # checked before anything moves, the selection would otherwise be left in Trash
+                raise RuntimeError("Server does not support UIDPLUS, cannot expunge targeted messages")
+            resumed_gm_msgids = []
+            if journal is not None:
+                msg_ids = journal.start(msg_ids)
+                resumed_gm_msgids = list(journal.gm_msgids)
+            number_of_msgs = len(msg_ids)
+            if not msg_ids and not (journal is not None and journal.moved):
+                print("No emails matching search criteria")
+                return
+
+            print(f"Moving {number_of_msgs} to Trash using {self.size} connections")
+            moved = 0
+
+            def trash(client, chunk):
+                nonlocal moved
+                chunk, count = chunk
+                # chunks are fixed across the pool, each one is still retried and reconnected on failure
+                gm_msgids = scheduler.ChunkScheduler(client, chunk_size).call(client.move_to_trash, chunk, targeted)
+                if journal is not None:
+                    journal.record_moved(chunk, gm_msgids)
+                with self._lock:
+                    moved += count
+                    print(f"Moved {moved}/{number_of_msgs} to Trash")
+                return gm_msgids
+
+            results = self.map(trash, list(msg_ids.chunks(chunk_size)))
+            self.select(TRASH_FOLDER)
+
+            if targeted:
+                gm_msgids = resumed_gm_msgids + [gm_msgid for result in results for gm_msgid in result]
+                groups = [
+                    gm_msgids[i:i + SEARCH_GROUP_SIZE]
+                    for i in range(0, len(gm_msgids), SEARCH_GROUP_SIZE)
+                ]
+                trash_ids = sequence.MsgIdSet()
+                for found in self.map(lambda client, group: client.search_gm_msgids(group), groups):
+                    trash_ids = trash_ids | found
+                print(f"Emptying {len(trash_ids)} moved messages from Trash")
+                self.map(
+                    lambda client, chunk: client.expunge_uids(
+                        sequence.MsgIdSet.from_string(chunk[0]), chunk_size
+                    ),
+                    list(trash_ids.chunks(chunk_size)),
+                )
+            else:
+                print("Emptying Trash")
+                client = self.clients[0]
+                client.imap.store("1:*", "+FLAGS", "\\Deleted")
+                client.imap.expunge()
+            if journal is not None:
+                journal.finish()
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while deleting messages: {e}")
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds of the command latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+METRIC_PREFIX = "pygmailcleaner_imap"
+
+
+class CommandProfiler:
+    """
+    Thread-safe collector of per-IMAP-command latency and wire bytes
+
+    One profiler can be shared by every connection of a client or pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+        self.started = time.time()
+
+    def record(self, command, seconds, bytes_sent, bytes_received):
+        """
+        Record one completed command
+        """
+        with self._lock:
+            stats = self.commands.setdefault(command, {
+                "count": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "bytes_sent": 0,
+                "bytes_received": 0,
+                "max_response_bytes": 0,
+                "buckets": [0] * len(LATENCY_BUCKETS),
+            })
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["max_response_bytes"] = max(stats["max_response_bytes"], bytes_received)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+
+    def report(self) -> dict:
+        """
+        Return the collected statistics, commands sorted by total time
+        """
+        with self._lock:
+            commands = sorted(self.commands.items(), key=lambda item: -item[1]["seconds"])
+            return {
+                "started": self.started,
+                "seconds": sum(stats["seconds"] for _, stats in commands),
+                "commands": [
+                    {
+                        "command": command,
+                        "count": stats["count"],
+                        "seconds": round(stats["seconds"], 6),
+                        "mean_seconds": round(stats["seconds"] / stats["count"], 6),
+                        "max_seconds": round(stats["max_seconds"], 6),
+                        "bytes_sent": stats["bytes_sent"],
+                        "bytes_received": stats["bytes_received"],
+                        "max_response_bytes": stats["max_response_bytes"],
+                    }
+                    for command, stats in commands
+                ],
+            }
+
+    def write_json(self, path):
+        """
+        Write the report as JSON
+        """
+        _write_atomic(path, json.dumps(self.report(), indent=2))
+
+    def prometheus(self) -> str:
+        """
+        Return the statistics in the Prometheus text exposition format
+        """
+        lines = [
+            f"# HELP {METRIC_PREFIX}_command_seconds Latency of IMAP commands.",
+            f"# TYPE {METRIC_PREFIX}_command_seconds histogram",
+        ]
+        with self._lock:
+            commands = sorted(self.commands.items())
+            for command, stats in commands:
+                label = f'command="{command}"'
+                for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                    lines.append(f'{METRIC_PREFIX}_command_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{METRIC_PREFIX}_command_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+                lines.append(f"{METRIC_PREFIX}_command_seconds_sum{{{label}}} {stats['seconds']:.6f}")
+                lines.append(f"{METRIC_PREFIX}_command_seconds_count{{{label}}} {stats['count']}")
+            for metric, key, help_text in (
+                ("bytes_sent_total", "bytes_sent", "Bytes sent to the server per IMAP command."),
+                ("bytes_received_total", "bytes_received", "Bytes received from the server per IMAP command."),
+            ):
+                lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+                lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+                for command, stats in commands:
+                    lines.append(f'{METRIC_PREFIX}_{metric}{{command="{command}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write the statistics as a Prometheus textfile
+        """
+        _write_atomic(path, self.prometheus())
+
+
+def _write_atomic(path, content):
+    # textfile collectors may read at any time, so never expose a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class ProfiledIMAPMixin:
+    """
+    Mixin for `imaplib.IMAP4` classes that reports every command to a CommandProfiler
+    """
+
+    profiler = None
+    _plain_bytes_sent = 0
+    _plain_bytes_received = 0
+    _in_flight = None
+
+    # with COMPRESS=DEFLATE active the wire bytes are counted by the deflate stream,
+    # the data passing through send/read/readline here is uncompressed
+
+    @property
+    def bytes_sent(self) -> int:
+        deflate = getattr(self, "deflate", None)
+        return self._plain_bytes_sent + (deflate.wire_bytes_out if deflate is not None else 0)
+
+    @property
+    def bytes_received(self) -> int:
+        deflate = getattr(self, "deflate", None)
+        return self._plain_bytes_received + (deflate.wire_bytes_in if deflate is not None else 0)
+
+    def send(self, data):
+        if getattr(self, "deflate", None) is None:
+            self._plain_bytes_sent += len(data)
+        return super().send(data)
+
+    def read(self, size):
+        data = super().read(size)
+        if getattr(self, "deflate", None) is None:
+            self._plain_bytes_received += len(data)
+        return data
+
+    def readline(self):
+        line = super().readline()
+        if getattr(self, "deflate", None) is None:
+            self._plain_bytes_received += len(line)
+        return line
+
+    def _command(self, name, *args):
+        # commands are timed from sending to completion so pipelined commands are profiled too
+        command = f"{name} {args[0]}".upper() if name == "UID" and args else name
+        sent, received, started = self.bytes_sent, self.bytes_received, time.perf_counter()
+        tag = super()._command(name, *args)
+        if self._in_flight is None:
+            self._in_flight = {}
+        self._in_flight[tag] = (command, started, self.bytes_sent - sent, self.bytes_received - received)
+        return tag
+
+    def _command_complete(self, name, tag):
+        received = self.bytes_received
+        try:
+            return super()._command_complete(name, tag)
+        finally:
+            command, started, sent, received_sending = self._in_flight.pop(tag)
+            if self.profiler is not None:
+                self.profiler.record(
+                    command,
+                    time.perf_counter() - started,
+                    sent,
+                    received_sending + self.bytes_received - received,
+                )
+
+
+def profiled(imap_class):
+    """
+    Return a subclass of an `imaplib` class that reports to a CommandProfiler
+    """
+    return type(f"Profiled{imap_class.__name__}", (ProfiledIMAPMixin, imap_class), {})
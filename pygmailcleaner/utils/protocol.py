@@ -0,0 +1,222 @@
+import re
+
+CRLF = b"\r\n"
+LITERAL_PATTERN = re.compile(rb"\{(\d+)\+?\}$")
+TAGGED_PATTERN = re.compile(rb"^(?P<tag>[A-Za-z0-9]+) (?P<status>OK|NO|BAD)\b ?(?P<text>.*)$", re.DOTALL)
+UNTAGGED_PATTERN = re.compile(rb"^\* (?P<text>.*)$", re.DOTALL)
+
+
+class Response:
+    """
+    A single complete IMAP server response
+
+    Attributes:
+        tag (str): The command tag, "*" for untagged data and "+" for continuation requests.
+        status (str): OK/NO/BAD for tagged responses, otherwise None.
+        text (bytes): The response line(s) with literals removed, e.g. b'1 FETCH (BODY[] {12}'.
+        literals (list): The literal strings in the order they appeared.
+    """
+
+    def __init__(self, tag, status, text, literals):
+        self.tag = tag
+        self.status = status
+        self.text = text
+        self.literals = literals
+
+    def __repr__(self):
+        return f"Response({self.tag!r}, {self.status!r}, {self.text!r}, {len(self.literals)} literals)"
+
+    def split(self):
+        """
+        Split untagged data into its response name and the remaining bytes,
+        e.g. b"12 FETCH (UID 5)" becomes ("FETCH", b"12 (UID 5)")
+        """
+        name, _, rest = self.text.partition(b" ")
+        if name.isdigit():
+            number = name
+            name, _, rest = rest.partition(b" ")
+            rest = number + (b" " + rest if rest else b"")
+        return name.decode().upper(), rest
+
+    def to_imaplib(self) -> list:
+        """
+        Convert untagged data into the shape returned by `imaplib`: either
+        bytes, or (header, literal) tuples followed by the trailing bytes
+        """
+        name, rest = self.split()
+        if not self.literals:
+            return [rest]
+        parts, data = rest.split(CRLF), []
+        for i, literal in enumerate(self.literals):
+            data.append((parts[i], literal))
+        data.append(CRLF.join(parts[len(self.literals):]))
+        return data
+
+
+class ResponseParser:
+    """
+    Incremental, sans-IO parser for IMAP server responses
+
+    Bytes read from the socket are passed to `feed` which returns every
+    response completed so far. Literals of the form `{N}` are consumed as
+    raw bytes so message bodies never have to be split into lines.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._lines = []
+        self._literals = []
+        self._literal_size = None
+
+    def feed(self, data) -> list:
+        """
+        Add received bytes and return the list of completed responses
+        """
+        self._buffer += data
+        responses = []
+        while True:
+            if self._literal_size is not None:
+                if len(self._buffer) < self._literal_size:
+                    break
+                self._literals.append(bytes(self._buffer[:self._literal_size]))
+                del self._buffer[:self._literal_size]
+                self._literal_size = None
+                continue
+            end = self._buffer.find(CRLF)
+            if end == -1:
+                break
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end + 2]
+            match = LITERAL_PATTERN.search(line)
+            self._lines.append(line)
+            if match:
+                self._literal_size = int(match.group(1))
+                continue
+            responses.append(self._build_response())
+        return responses
+
+    def _build_response(self):
+        text = CRLF.join(self._lines)
+        literals = self._literals
+        self._lines, self._literals = [], []
+        if text.startswith(b"+"):
+            return Response("+", None, text[2:], literals)
+        match = UNTAGGED_PATTERN.match(text)
+        if match:
+            return Response("*", None, match.group("text"), literals)
+        match = TAGGED_PATTERN.match(text)
+        if match:
+            return Response(
+                match.group("tag").decode(),
+                match.group("status").decode(),
+                match.group("text"),
+                literals,
+            )
+        raise ValueError(f"Unexpected server response: {text[:100]!r}")
+
+
+def quote(string) -> str:
+    """
+    Quote a string argument for an IMAP command
+    """
+    return '"' + string.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def format_command(tag, name, *args) -> bytes:
+    """
+    Format a tagged command line. Arguments are sent as-is in the same way `imaplib` does
+    """
+    return " ".join([tag, name, *[str(arg) for arg in args]]).encode() + CRLF
+
+
+FETCH_START_PATTERN = re.compile(rb"^(\d+) \(")
+
+
+def _tokenize(text, literals) -> list:
+    """
+    Parse a parenthesised IMAP data list into nested python lists
+
+    Atoms become str (int when numeric), quoted strings str, NIL None and
+    literals bytes. Section atoms such as `BODY[HEADER.FIELDS (FROM)]` are
+    kept whole.
+    """
+    literals = iter(literals)
+    stack = [[]]
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i:i + 1]
+        if char in (b" ", b"\r", b"\n"):
+            i += 1
+        elif char == b"(":
+            stack.append([])
+            i += 1
+        elif char == b")":
+            closed = stack.pop()
+            stack[-1].append(closed)
+            i += 1
+        elif char == b'"':
+            i += 1
+            value = bytearray()
+            while text[i:i + 1] != b'"':
+                if text[i:i + 1] == b"\\":
+                    i += 1
+                value += text[i:i + 1]
+                i += 1
+            stack[-1].append(value.decode(errors="replace"))
+            i += 1
+        elif char == b"{":
+            i = text.index(b"}", i) + 1
+            stack[-1].append(next(literals))
+        else:
+            start, depth = i, 0
+            while i < length:
+                char = text[i:i + 1]
+                if char == b"[":
+                    depth += 1
+                elif char == b"]":
+                    depth -= 1
+                elif depth == 0 and char in (b" ", b"(", b")", b"\r", b"\n"):
+                    break
+                i += 1
+            atom = text[start:i].decode(errors="replace")
+            if atom.upper() == "NIL":
+                stack[-1].append(None)
+            elif atom.isdigit():
+                stack[-1].append(int(atom))
+            else:
+                stack[-1].append(atom)
+    return stack[0]
+
+
+def parse_fetch(text, literals=()) -> dict:
+    """
+    Parse a single FETCH response, e.g. b'12 (UID 5 RFC822.SIZE 42)', into a
+    dict of upper-cased item names to values
+    """
+    match = FETCH_START_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Unexpected FETCH response: {text[:100]!r}")
+    tokens = _tokenize(text[match.end() - 1:], literals)
+    items = tokens[0] if tokens else []
+    return {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+
+def iter_fetch(data):
+    """
+    Yield a parsed dict for every message in the data returned by `imaplib` FETCH
+    """
+    text, literals = b"", []
+    for item in data:
+        if item is None:
+            continue
+        part = item[0] if isinstance(item, tuple) else item
+        if FETCH_START_PATTERN.match(part) and text:
+            yield parse_fetch(text, literals)
+            text, literals = b"", []
+        if isinstance(item, tuple):
+            text += item[0] + CRLF
+            literals.append(item[1])
+        else:
+            text += item
+    if text:
+        yield parse_fetch(text, literals)
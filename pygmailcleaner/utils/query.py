@@ -0,0 +1,355 @@
+import datetime
+import os
+import re
+
+from ..utils import formatting
+from ..utils.protocol import quote
+
+IMAP_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# values that can be sent to Gmail without quotes
+GM_ATOM_PATTERN = re.compile(r"^[\w.@+\-]+$")
+
+# maximum characters of one X-GM-RAW query packed from many terms, see `pack_or`
+MAX_QUERY_LENGTH = int(os.getenv("MAX_QUERY_LENGTH", 2000))
+
+
+class QueryError(ValueError):
+    """
+    A query cannot be compiled to the requested form
+    """
+
+
+class Query:
+    """
+    Node of a typed search query
+
+    Every query compiles to a Gmail X-GM-RAW string (`to_gm_raw`), to RFC 3501
+    SEARCH keys for other servers (`to_imap`) and to a predicate evaluated
+    locally against an indexed message dict such as `HeaderIndex.rows` yields
+    (`matches`). Queries combine with `&`, `|` and `~`.
+    """
+
+    def to_gm_raw(self) -> str:
+        raise NotImplementedError
+
+    def to_imap(self) -> list:
+        raise NotImplementedError
+
+    def matches(self, message) -> bool:
+        raise NotImplementedError
+
+    def terms(self) -> list:
+        """
+        Return the distinct atomic terms of the query in order of appearance
+        """
+        return [self]
+
+    def _key(self):
+        return (type(self).__name__,) + tuple(vars(self).values())
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(repr(value) for value in vars(self).values())})"
+
+    def __str__(self):
+        return self.to_gm_raw()
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+def _gm_value(value) -> str:
+    value = str(value)
+    return value if GM_ATOM_PATTERN.match(value) else quote(value)
+
+
+def _imap_key(query) -> list:
+    # several ANDed keys must be parenthesised to act as one operand of OR/NOT
+    keys = query.to_imap()
+    if isinstance(query, And) and len(query.queries) > 1:
+        return [f"({' '.join(keys)})"]
+    return keys
+
+
+class Category(Query):
+    """
+    Gmail inbox category such as "promotions" or "social"
+    """
+
+    def __init__(self, name):
+        self.name = name.lower()
+
+    def to_gm_raw(self):
+        return f"category:{self.name}"
+
+    def to_imap(self):
+        raise QueryError(f"category:{self.name} has no standard IMAP SEARCH equivalent")
+
+    def matches(self, message):
+        if "category" not in message:
+            raise QueryError(f"category:{self.name} cannot be evaluated locally, categories are not indexed")
+        return message["category"] == self.name
+
+
+class Unread(Query):
+    """
+    Messages without the \\Seen flag
+    """
+
+    def to_gm_raw(self):
+        return "is:unread"
+
+    def to_imap(self):
+        return ["UNSEEN"]
+
+    def matches(self, message):
+        return "\\Seen" not in (message.get("flags") or [])
+
+
+class Important(Query):
+    """
+    Messages Gmail marked as important
+    """
+
+    def to_gm_raw(self):
+        return "is:important"
+
+    def to_imap(self):
+        return ["KEYWORD", "$Important"]
+
+    def matches(self, message):
+        return "\\Important" in (message.get("labels") or [])
+
+
+class Attachment(Query):
+    """
+    Messages with an attachment, approximated as multipart/mixed outside of Gmail
+    """
+
+    def to_gm_raw(self):
+        return "has:attachment"
+
+    def to_imap(self):
+        return ["HEADER", "Content-Type", "multipart/mixed"]
+
+    def matches(self, message):
+        # a top-level multipart/mixed misses single-part and multipart/related attachments
+        raise QueryError("has:attachment cannot be evaluated locally, attachments are not indexed")
+
+
+class From(Query):
+    """
+    Messages whose sender contains `address`
+    """
+
+    def __init__(self, address):
+        self.address = address
+
+    def to_gm_raw(self):
+        return f"from:{_gm_value(self.address)}"
+
+    def to_imap(self):
+        return ["FROM", quote(self.address)]
+
+    def matches(self, message):
+        return self.address.lower() in (message.get("sender") or "").lower()
+
+
+class Subject(Query):
+    """
+    Messages whose subject contains `text`
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_gm_raw(self):
+        return f"subject:{_gm_value(self.text)}"
+
+    def to_imap(self):
+        return ["SUBJECT", quote(self.text)]
+
+    def matches(self, message):
+        return self.text.lower() in (message.get("subject") or "").lower()
+
+
+class Before(Query):
+    """
+    Messages received before a date in the format "YYYY-MM-DD"
+    """
+
+    def __init__(self, date):
+        self.date = date
+
+    def to_gm_raw(self):
+        return f"before:{formatting.get_unix_timestamp(self.date)}"
+
+    def to_imap(self):
+        date = datetime.datetime.strptime(self.date, "%Y-%m-%d")
+        return ["BEFORE", f"{date.day}-{IMAP_MONTHS[date.month - 1]}-{date.year}"]
+
+    def matches(self, message):
+        # Gmail compares the date the message was received, not its Date header
+        if message.get("received") is None:
+            raise QueryError(f"before:{self.date} cannot be evaluated locally, the received date is not indexed")
+        return message["received"] < formatting.get_unix_timestamp(self.date)
+
+
+class Larger(Query):
+    """
+    Messages larger than `size` bytes
+    """
+
+    def __init__(self, size):
+        self.size = int(size)
+
+    def to_gm_raw(self):
+        return f"larger:{self.size}"
+
+    def to_imap(self):
+        return ["LARGER", str(self.size)]
+
+    def matches(self, message):
+        return (message.get("size") or 0) > self.size
+
+
+class And(Query):
+    """
+    Messages matching every query, an empty And matches everything
+    """
+
+    def __init__(self, *queries):
+        flattened = []
+        for query in queries:
+            flattened += query.queries if isinstance(query, And) else [query]
+        self.queries = tuple(flattened)
+
+    def _key(self):
+        return ("And", self.queries)
+
+    def __repr__(self):
+        return f"And({', '.join(repr(query) for query in self.queries)})"
+
+    def to_gm_raw(self):
+        return " ".join(query.to_gm_raw() for query in self.queries)
+
+    def to_imap(self):
+        keys = [key for query in self.queries for key in query.to_imap()]
+        return keys or ["ALL"]
+
+    def matches(self, message):
+        return all(query.matches(message) for query in self.queries)
+
+    def terms(self):
+        return list(dict.fromkeys(term for query in self.queries for term in query.terms()))
+
+
+class Or(Query):
+    """
+    Messages matching any of the queries
+    """
+
+    def __init__(self, *queries):
+        if not queries:
+            raise QueryError("Or needs at least one query")
+        flattened = []
+        for query in queries:
+            flattened += query.queries if isinstance(query, Or) else [query]
+        self.queries = tuple(flattened)
+
+    def _key(self):
+        return ("Or", self.queries)
+
+    def __repr__(self):
+        return f"Or({', '.join(repr(query) for query in self.queries)})"
+
+    def to_gm_raw(self):
+        if len(self.queries) == 1:
+            return self.queries[0].to_gm_raw()
+        parts = [
+            f"({query.to_gm_raw()})" if isinstance(query, And) else query.to_gm_raw()
+            for query in self.queries
+        ]
+        return "{" + " ".join(parts) + "}"
+
+    def to_imap(self):
+        # OR takes exactly two keys, chain them as OR a OR b c
+        keys = _imap_key(self.queries[-1])
+        for query in reversed(self.queries[:-1]):
+            keys = ["OR"] + _imap_key(query) + keys
+        return keys
+
+    def matches(self, message):
+        return any(query.matches(message) for query in self.queries)
+
+    def terms(self):
+        return list(dict.fromkeys(term for query in self.queries for term in query.terms()))
+
+
+class Not(Query):
+    """
+    Messages not matching the query
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def to_gm_raw(self):
+        inner = self.query.to_gm_raw()
+        if isinstance(self.query, And) and len(self.query.queries) > 1:
+            inner = f"({inner})"
+        return f"NOT {inner}"
+
+    def to_imap(self):
+        return ["NOT"] + _imap_key(self.query)
+
+    def matches(self, message):
+        return not self.query.matches(message)
+
+    def terms(self):
+        return self.query.terms()
+
+
+def sender_query(sender) -> From:
+    """
+    Return a From query for an address, or for a whole domain given as
+    "example.com", "@example.com" or "*@example.com"
+    """
+    sender = sender.strip().lower()
+    if sender.startswith("*@"):
+        sender = sender[1:]
+    elif "@" not in sender:
+        sender = "@" + sender
+    return From(sender)
+
+
+def pack_or(queries, max_length=MAX_QUERY_LENGTH) -> list:
+    """
+    Pack queries into as few Or queries as possible, each compiling to at most
+    `max_length` characters of X-GM-RAW, dropping duplicates
+
+    A query longer than `max_length` on its own gets an Or of its own.
+    """
+    groups, group, length = [], [], 2  # the braces of the group
+    for query in dict.fromkeys(queries):
+        term = len(query.to_gm_raw()) + 1
+        if group and length + term > max_length:
+            groups.append(Or(*group))
+            group, length = [], 2
+        group.append(query)
+        length += term
+    if group:
+        groups.append(Or(*group))
+    return groups
@@ -0,0 +1,189 @@
+import bisect
+import heapq
+import logging
+import os
+
+from ..utils import sequence
+from ..utils.formatting import format_size
+from ..utils.heavy_hitters import SpaceSaving
+from ..utils.index import parse_headers, header_block
+from ..utils.smpt import FETCH_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+# number of distinct senders tracked while streaming, bounds memory regardless of mailbox size
+TOP_SENDERS_CAPACITY = int(os.getenv("TOP_SENDERS_CAPACITY", 5000))
+
+# number of messages per FETCH when only small metadata items are requested
+METADATA_CHUNK_SIZE = int(os.getenv("METADATA_CHUNK_SIZE", 5000))
+
+SENDER_ITEMS = "(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (FROM)])"
+IMPACT_ITEMS = "(UID RFC822.SIZE X-GM-LABELS)"
+SIZE_ITEMS = "(UID RFC822.SIZE)"
+DETAIL_ITEMS = "(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])"
+
+# upper bounds of the size histogram buckets in bytes, the last bucket is open ended
+SIZE_BUCKETS = [10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+def top_senders(client, msg_ids, k=20, capacity=TOP_SENDERS_CAPACITY, by="count", chunk_size=FETCH_CHUNK_SIZE) -> list:
+    """
+    Stream the From header and size of every message and rank senders
+
+    Ranking by bytes uses a Space-Saving counter weighted by message size, so
+    the byte totals carry the error bound and "count" is then the number of
+    messages seen since the sender was last tracked, a lower bound.
+
+    Args:
+        client (SMPTClient): A connected client.
+        msg_ids (MsgIdSet): The uids to scan.
+        k (int): Number of senders to return.
+        capacity (int): Number of distinct senders tracked, see `SpaceSaving`.
+        by (str): Rank by "count" or "bytes".
+        chunk_size (int): Number of messages per FETCH.
+
+    Returns:
+        list: dicts with sender, count, bytes and error, the over-estimation of the ranked value.
+    """
+    try:
+        counter = SpaceSaving(capacity)
+        scanned = 0
+        for item in client.fetch(msg_ids, SENDER_ITEMS, chunk_size):
+            scanned += 1
+            sender = parse_headers(header_block(item))["sender_address"] or "(unknown)"
+            size = item.get("RFC822.SIZE") or 0
+            if by == "bytes":
+                counter.add(sender, weight=1, count=size)
+            else:
+                counter.add(sender, weight=size)
+        logger.info(f"Scanned {scanned} messages, tracking {len(counter)} senders")
+        if by == "bytes":
+            return [
+                {"sender": top["key"], "count": top["weight"], "error": top["error"], "bytes": top["count"]}
+                for top in counter.top(k)
+            ]
+        return [
+            {"sender": top["key"], "count": top["count"], "error": top["error"], "bytes": top["weight"]}
+            for top in counter.top(k)
+        ]
+    except Exception as e:
+        raise RuntimeError(f"Error occurred while ranking senders: {e}")
+
+
+def has_attachment(structure) -> bool:
+    """
+    Return whether a parsed BODYSTRUCTURE has a part with an attachment disposition
+    or a named non-text part
+    """
+    if not isinstance(structure, list) or not structure:
+        return False
+    if isinstance(structure[0], list):
+        # multipart: the parts come first, then the subtype and extension data
+        return any(has_attachment(part) for part in structure if isinstance(part, list))
+    if any(
+        isinstance(field, list) and field and str(field[0]).upper() == "ATTACHMENT"
+        for field in structure[7:]
+    ):
+        return True
+    params = structure[2] if len(structure) > 2 and isinstance(structure[2], list) else []
+    named = any(str(name).upper() == "NAME" for name in params[::2])
+    return named and str(structure[0]).upper() not in ("TEXT", "MULTIPART")
+
+
+def largest_messages(client, msg_ids, k=50, chunk_size=METADATA_CHUNK_SIZE) -> list:
+    """
+    Find the k largest messages with a bounded min-heap
+
+    Only RFC822.SIZE is streamed for every message, the sender, subject and
+    BODYSTRUCTURE are fetched for the k winners alone, so memory is O(k).
+
+    Args:
+        client (SMPTClient): A connected client.
+        msg_ids (MsgIdSet): The uids to scan.
+        k (int): Number of messages to return.
+        chunk_size (int): Number of messages per FETCH.
+
+    Returns:
+        list: dicts with uid, bytes, sender, subject and attachment, largest first.
+    """
+    try:
+        heap = []
+        scanned = 0
+        for item in client.fetch(msg_ids, SIZE_ITEMS, chunk_size):
+            scanned += 1
+            entry = (item.get("RFC822.SIZE") or 0, item["UID"])
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        logger.info(f"Scanned {scanned} messages for the {k} largest")
+        largest = sorted(heap, reverse=True)
+        details = {}
+        if largest:
+            uids = sequence.MsgIdSet(uid for size, uid in largest)
+            details = {item["UID"]: item for item in client.fetch(uids, DETAIL_ITEMS, chunk_size)}
+        messages = []
+        for size, uid in largest:
+            item = details.get(uid, {})
+            headers = parse_headers(header_block(item))
+            messages.append({
+                "uid": uid,
+                "bytes": size,
+                "sender": headers["sender_address"] or "(unknown)",
+                "subject": headers["subject"] or "",
+                "attachment": has_attachment(item.get("BODYSTRUCTURE")),
+            })
+        return messages
+    except Exception as e:
+        raise RuntimeError(f"Error occurred while finding the largest messages: {e}")
+
+
+def size_bucket_labels(buckets=SIZE_BUCKETS) -> list:
+    """
+    Return human readable labels for the size histogram buckets, e.g. "10 KB - 100 KB"
+    """
+    bounds = [0] + buckets
+    labels = [f"{format_size(low)} - {format_size(high)}" for low, high in zip(bounds, bounds[1:])]
+    labels.append(f"> {format_size(buckets[-1])}")
+    return labels
+
+
+def impact_report(client, msg_ids, filters=None, date_until=None, chunk_size=METADATA_CHUNK_SIZE) -> dict:
+    """
+    Estimate what deleting a set of messages reclaims without downloading bodies
+
+    Streams RFC822.SIZE and X-GM-LABELS for the uids in batches.
+
+    Args:
+        client (SMPTClient): A connected client.
+        msg_ids (MsgIdSet): The uids that would be deleted.
+        filters (dict): Optional filter descriptions mapped to their search term.
+            Each is searched up to `date_until` and counted within `msg_ids`.
+        date_until (str): The date the filters are counted up to.
+        chunk_size (int): Number of messages per FETCH.
+
+    Returns:
+        dict: "messages", "bytes", "histogram" (count and bytes per size bucket),
+        "labels" (count and bytes per Gmail label) and "filters" (count per filter).
+    """
+    try:
+        labels = size_bucket_labels()
+        histogram = [{"bucket": label, "count": 0, "bytes": 0} for label in labels]
+        by_label = {}
+        report = {"messages": 0, "bytes": 0, "histogram": histogram, "labels": by_label, "filters": {}}
+        for item in client.fetch(msg_ids, IMPACT_ITEMS, chunk_size):
+            size = item.get("RFC822.SIZE") or 0
+            report["messages"] += 1
+            report["bytes"] += size
+            bucket = histogram[bisect.bisect_right(SIZE_BUCKETS, size)]
+            bucket["count"] += 1
+            bucket["bytes"] += size
+            for label in item.get("X-GM-LABELS") or ["(no label)"]:
+                stats = by_label.setdefault(str(label), {"count": 0, "bytes": 0})
+                stats["count"] += 1
+                stats["bytes"] += size
+        for description, term in (filters or {}).items():
+            report["filters"][description] = len(client.get_msg_ids(term, date_until) & msg_ids)
+        return report
+    except Exception as e:
+        raise RuntimeError(f"Error occurred while estimating deletion impact: {e}")
@@ -0,0 +1,159 @@
+import copy
+import datetime
+import json
+import logging
+import os
+import time
+
+from ..utils.commands import METHODS
+from ..utils import sequence
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+logger = logging.getLogger()
+
+# maximum number of IMAP commands per second sent to one host across all batch processes
+HOST_RATE_LIMIT = float(os.getenv("HOST_RATE_LIMIT", 10))
+
+DEFAULT_RULE = {
+    "server": "imap.gmail.com",
+    "port": 993,
+    "date_until": None,
+    "older_than_days": None,
+    "filters": {},
+    "targeted_expunge": False,
+    "dry_run": False,
+    "compress": False,
+    "search_cache": False,
+    "threads": "messages",
+    "archive": None,
+    "archive_format": "mbox",
+    "archive_compression": None,
+    "chunk_size": sequence.CHUNK_SIZE,
+}
+
+
+def read_rules_file(path) -> dict:
+    """
+    Read a rules file in TOML (.toml) or JSON format
+    """
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise RuntimeError("Reading TOML rules requires python 3.11+ or the tomli package")
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def resolve_methods(filters) -> list:
+    """
+    Return a copy of METHODS with each response taken from `filters`
+
+    `filters` maps a method description, e.g. "Exclude important", to "y"/"n"
+    or a bool. Methods not mentioned use their "default" response.
+    """
+    descriptions = {method["description"] for method in METHODS}
+    unknown = set(filters) - descriptions
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    methods = copy.deepcopy(METHODS)
+    for method in methods:
+        response = filters.get(method["description"], method["default"])
+        if isinstance(response, bool):
+            response = "y" if response else "n"
+        if response not in ("y", "n"):
+            raise ValueError(f"Filter '{method['description']}' must be 'y', 'n' or a bool")
+        method["response"] = response
+    return methods
+
+
+def resolve_date_until(rule, today=None) -> str:
+    """
+    Return the date to clean up until from `date_until` or `older_than_days`
+    """
+    if rule.get("date_until"):
+        return rule["date_until"]
+    today = today or datetime.date.today()
+    days = rule.get("older_than_days") or 0
+    return (today - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def load_rules(path) -> list:
+    """
+    Load a rules file into a list of per-account rules
+
+    Expected format (TOML shown, JSON uses the same structure):
+
+        [defaults]
+        older_than_days = 30
+        filters = { "Only include promotions" = "y", "Exclude important" = "y" }
+
+        [[accounts]]
+        email = "me@gmail.com"
+        password_env = "ME_GMAIL_PASSWORD"
+
+    Account keys override `defaults`. The password is read from the
+    environment variable named by `password_env`, or `password` if given.
+
+    Returns:
+        list: dicts with the account settings plus resolved "methods" and "date_until".
+    """
+    try:
+        config = read_rules_file(path)
+        defaults = {**DEFAULT_RULE, **config.get("defaults", {})}
+        rules = []
+        for account in config.get("accounts", []):
+            rule = {**defaults, **account}
+            rule["filters"] = {**defaults.get("filters", {}), **account.get("filters", {})}
+            if not rule.get("email"):
+                raise ValueError("Every account needs an email")
+            if not rule.get("password"):
+                rule["password"] = os.getenv(rule.get("password_env") or "GMAIL_PASSWORD")
+            if not rule.get("password"):
+                raise ValueError(f"No password for {rule['email']}")
+            rule["methods"] = resolve_methods(rule["filters"])
+            rule["date_until"] = resolve_date_until(rule)
+            rules.append(rule)
+        return rules
+    except Exception as e:
+        raise ValueError(f"Error occurred while loading rules from {path}: {e}")
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of operations per second sent to each host
+
+    The state lives in a `multiprocessing.Manager` so one limiter can be shared
+    by every process of a batch run.
+    """
+
+    def __init__(self, manager, rate=HOST_RATE_LIMIT, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._lock = manager.Lock()
+        self._buckets = manager.dict()
+
+    def acquire(self, host):
+        """
+        Block until an operation against `host` is allowed
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
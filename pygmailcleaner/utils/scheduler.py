@@ -0,0 +1,201 @@
+import imaplib
+import logging
+import os
+import random
+import time
+
+from ..utils import sequence
+
+logger = logging.getLogger()
+
+# smallest chunk the scheduler shrinks to when the server throttles or slows down
+MIN_CHUNK_SIZE = int(os.getenv("MIN_CHUNK_SIZE", 50))
+
+# bulk commands slower than this shrink the chunk size, faster ones grow it again
+TARGET_COMMAND_SECONDS = float(os.getenv("TARGET_COMMAND_SECONDS", 10))
+
+# attempts per command before giving up, and the bounds of the exponential backoff
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 6))
+BACKOFF_SECONDS = float(os.getenv("BACKOFF_SECONDS", 1))
+MAX_BACKOFF_SECONDS = float(os.getenv("MAX_BACKOFF_SECONDS", 60))
+
+
+class ThrottledError(RuntimeError):
+    """
+    The server rejected a command with a [THROTTLED] response
+    """
+
+
+# errors after which a command is retried, `imaplib.IMAP4.abort` covers dropped sockets
+TRANSIENT_ERRORS = (ThrottledError, imaplib.IMAP4.abort, OSError)
+
+
+def check_response(typ, data):
+    """
+    Return the data of an OK response, raise ThrottledError or RuntimeError otherwise
+    """
+    if typ == "OK":
+        return data
+    text = b" ".join(item for item in data if isinstance(item, bytes)).decode(errors="replace")
+    if "THROTTLED" in text.upper():
+        raise ThrottledError(text)
+    raise RuntimeError(f"{typ} {text}")
+
+
+class ChunkScheduler:
+    """
+    Runs bulk commands of a SMPTClient in chunks sized by additive-increase/multiplicative-decrease
+
+    After every command the chunk size grows by `increase` messages while
+    commands finish within `target_seconds`, and is multiplied by `decrease`
+    when they are slower, throttled or the connection drops. `chunk_size` is the
+    upper bound. Failed commands are retried after a full-jitter exponential
+    backoff, reconnecting and reselecting the folder when the connection was lost.
+    """
+
+    def __init__(
+        self,
+        client,
+        chunk_size=sequence.CHUNK_SIZE,
+        min_chunk_size=MIN_CHUNK_SIZE,
+        target_seconds=TARGET_COMMAND_SECONDS,
+        increase=None,
+        decrease=0.5,
+        max_retries=MAX_RETRIES,
+        backoff=BACKOFF_SECONDS,
+        max_backoff=MAX_BACKOFF_SECONDS,
+        sleep=time.sleep,
+    ):
+        self.client = client
+        self.max_chunk_size = chunk_size
+        self.min_chunk_size = max(1, min(min_chunk_size, chunk_size))
+        self.size = chunk_size
+        self.target_seconds = target_seconds
+        self.increase = increase or max(1, chunk_size // 10)
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    def observe(self, seconds):
+        """
+        Adjust the chunk size after a successful command that took `seconds`
+        """
+        if seconds > self.target_seconds:
+            self.shrink()
+        else:
+            self.size = min(self.max_chunk_size, self.size + self.increase)
+
+    def shrink(self):
+        """
+        Multiplicatively decrease the chunk size
+        """
+        self.size = max(self.min_chunk_size, int(self.size * self.decrease))
+
+    def backoff_delay(self, attempt) -> float:
+        """
+        Return a random delay in [0, min(max_backoff, backoff * 2^attempt)]
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _timed(self, operation, *args):
+        started = time.monotonic()
+        result = operation(*args)
+        self.observe(time.monotonic() - started)
+        return result
+
+    def _recover(self, error, attempt, folder) -> int:
+        if attempt >= self.max_retries:
+            raise error
+        self.shrink()
+        delay = self.backoff_delay(attempt)
+        logger.warning(f"{error!r}, retrying in {delay:.1f}s with chunks of {self.size}")
+        self.sleep(delay)
+        if not isinstance(error, ThrottledError):
+            try:
+                self.client.reconnect(folder)
+            except Exception as e:
+                # the next attempt fails on the dead connection and reconnects again
+                logger.warning(f"Reconnect failed: {e}")
+        return attempt + 1
+
+    def call(self, operation, *args, folder=None):
+        """
+        Run `operation(*args)` retrying transient failures, reconnecting to `folder` if needed
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._timed(operation, *args)
+            except TRANSIENT_ERRORS as e:
+                attempt = self._recover(e, attempt, folder)
+
+    def run(self, msg_ids, operation, folder=None, prepare=None):
+        """
+        Run `operation(sequence_set)` over every uid of `msg_ids` in adaptively sized chunks
+
+        `prepare(sequence_set)`, e.g. archiving the chunk, runs before every
+        attempt of `operation` and is retried with it but not timed, so only
+        the command itself adjusts the chunk size.
+
+        Yields:
+            tuple: (sequence_set, number_of_msgs, result) for every completed chunk
+        """
+        remaining = msg_ids
+        attempt = 0
+        while remaining:
+            chunk, count = next(remaining[:self.size].chunks(self.size))
+            try:
+                if prepare is not None:
+                    prepare(chunk)
+                result = self._timed(operation, chunk)
+            except TRANSIENT_ERRORS as e:
+                attempt = self._recover(e, attempt, folder)
+                continue
+            attempt = 0
+            remaining = remaining[count:]
+            yield chunk, count, result
+
+    def run_pipelined(self, msg_ids, operation, window, folder=None, prepare=None):
+        """
+        Run `operation(sequence_sets)` over every uid of `msg_ids`, `window` chunks at a time
+
+        `operation` pipelines the commands of all chunks it is given and
+        yields one result per chunk, in order. Each result is timed from the
+        moment it is waited for, so the chunk size follows the server's time
+        per chunk rather than the round trip the pipeline hides. After a
+        transient failure the chunks without a result are sent again.
+        `prepare(sequence_set)` runs for every chunk before the commands are
+        sent, untimed, as for `run`.
+
+        Yields:
+            tuple: (sequence_set, number_of_msgs, result) for every completed chunk
+        """
+        remaining = msg_ids
+        attempt = 0
+        while remaining:
+            batch, rest = [], remaining
+            while rest and len(batch) < max(1, window):
+                chunk, count = next(rest[:self.size].chunks(self.size))
+                batch.append((chunk, count))
+                rest = rest[count:]
+            results = None
+            try:
+                if prepare is not None:
+                    for chunk, count in batch:
+                        prepare(chunk)
+                results = operation([chunk for chunk, count in batch])
+                for chunk, count in batch:
+                    result = self._timed(next, results)
+                    attempt = 0
+                    remaining = remaining[count:]
+                    yield chunk, count, result
+            except TRANSIENT_ERRORS as e:
+                if results is not None:
+                    # settle the commands in flight before the connection is replaced
+                    results.close()
+                attempt = self._recover(e, attempt, folder)
+            finally:
+                if results is not None:
+                    results.close()
@@ -0,0 +1,217 @@
+import collections
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from ..utils import sequence
+
+logger = logging.getLogger()
+
+# number of search results kept per client, 0 disables the cache
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 64))
+
+# directory holding the on-disk search caches, next to the header indexes by default
+SEARCH_CACHE_DIR = os.getenv(
+    "SEARCH_CACHE_DIR", os.getenv("INDEX_DIR", os.path.join(os.path.expanduser("~"), ".pygmailcleaner"))
+)
+
+MODSEQ_PATTERN = re.compile(rb"MODSEQ \((\d+)\)")
+
+SEARCH_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    key TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    msg_ids TEXT NOT NULL,
+    used REAL NOT NULL
+);
+"""
+
+
+def search_cache_path(user) -> str:
+    """
+    Return the default on-disk search cache of an account
+    """
+    return os.path.join(SEARCH_CACHE_DIR, f"{user}.searches.sqlite")
+
+
+def search_key(*parts) -> str:
+    """
+    Return the cache key of a search, e.g. of the account, folder and SEARCH arguments
+    """
+    return json.dumps([str(part) for part in parts])
+
+
+class MailboxStateMixin:
+    """
+    Mixin for `imaplib.IMAP4` classes tracking the name and state of the selected mailbox
+
+    The state starts from the UIDVALIDITY, UIDNEXT, EXISTS and HIGHESTMODSEQ
+    of the SELECT response and follows the untagged responses the server sends
+    while the mailbox stays selected: EXISTS when mail arrives, EXPUNGE when
+    mail is removed and FETCH with a MODSEQ when flags or labels change. RFC
+    3501 advises against STATUS on the selected mailbox, this needs no command.
+    The server only sends MODSEQ with flag changes once CONDSTORE is enabled,
+    see `enable_condstore`.
+    """
+
+    selected = None  # name of the selected mailbox, None when no mailbox is selected
+    condstore = False  # True once ENABLE CONDSTORE succeeded
+    _mailbox = None
+
+    def enable_condstore(self) -> bool:
+        """
+        Enable CONDSTORE (RFC 7162) if the server supports it, must run before SELECT
+
+        Returns:
+            bool: True if flag changes are now reported with their MODSEQ.
+        """
+        if self.condstore:
+            return True
+        if "CONDSTORE" not in self.capabilities or "ENABLE" not in self.capabilities:
+            logger.info("Server does not support ENABLE CONDSTORE")
+            return False
+        try:
+            typ, data = self.enable("CONDSTORE")
+        except self.error as e:
+            logger.info(f"Could not enable CONDSTORE: {e}")
+            return False
+        self.condstore = typ == "OK"
+        return self.condstore
+
+    def select(self, mailbox="INBOX", readonly=False):
+        self.selected = None
+        self._mailbox = {"EXPUNGE": 0}
+        typ, data = super().select(mailbox, readonly)
+        if typ == "OK":
+            self.selected = mailbox
+        return typ, data
+
+    def close(self):
+        self.selected = None
+        self._mailbox = None
+        return super().close()
+
+    def _append_untagged(self, typ, dat):
+        super()._append_untagged(typ, dat)
+        mailbox = self._mailbox
+        if mailbox is None:
+            return
+        if isinstance(dat, tuple):
+            dat = dat[0]
+        if typ in ("UIDVALIDITY", "UIDNEXT", "HIGHESTMODSEQ", "EXISTS") and dat and dat.split()[0].isdigit():
+            mailbox[typ] = int(dat.split()[0])
+        elif typ == "EXPUNGE":
+            mailbox["EXPUNGE"] += 1
+        elif typ == "FETCH" and dat:
+            match = MODSEQ_PATTERN.search(dat)
+            if match:
+                mailbox["HIGHESTMODSEQ"] = max(mailbox.get("HIGHESTMODSEQ") or 0, int(match.group(1)))
+
+    def mailbox_state(self):
+        """
+        Return (UIDVALIDITY, UIDNEXT, EXISTS, EXPUNGE, HIGHESTMODSEQ) of the selected mailbox,
+        EXPUNGE counting the expunges since SELECT, or None if the server did not report them all
+        """
+        mailbox = self._mailbox
+        if self.selected is None or mailbox is None:
+            return None
+        state = tuple(mailbox.get(item) for item in ("UIDVALIDITY", "UIDNEXT", "EXISTS", "EXPUNGE", "HIGHESTMODSEQ"))
+        return state if None not in state else None
+
+
+def tracked(imap_class):
+    """
+    Return a subclass of an `imaplib` class that tracks its selected mailbox, see MailboxStateMixin
+    """
+    return type(f"Tracked{imap_class.__name__}", (MailboxStateMixin, imap_class), {})
+
+
+class SearchCache:
+    """
+    LRU cache of search results, each valid for one state of its folder
+
+    A result is stored with the state of the selected mailbox, see
+    `MailboxStateMixin`, when the search ran and is returned only while the
+    mailbox is still in that state. EXISTS and the expunge count change when
+    mail arrives or is removed and HIGHESTMODSEQ when flags or labels change,
+    so an equal state proves the search would return the same uids. UIDNEXT
+    is only read on SELECT, so a state without changes since SELECT carries
+    over to later sessions.
+
+    With a `path` the entries are also kept in SQLite, so a later run against
+    an unchanged mailbox skips the search entirely.
+    """
+
+    def __init__(self, capacity=SEARCH_CACHE_SIZE, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = collections.OrderedDict()  # key -> (state, msg_ids), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(SEARCH_CACHE_SCHEMA)
+            rows = self.db.execute("SELECT key, state, msg_ids FROM searches ORDER BY used")
+            for key, state, msg_ids in rows:
+                self.entries[key] = (tuple(json.loads(state)), msg_ids)
+            self._evict()
+
+    def close(self):
+        """
+        Close the cache database, if any
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def get(self, key, state):
+        """
+        Return the cached uids of `key` if they were stored for `state`, None otherwise
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != tuple(state):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if self.db is not None:
+                self.db.execute("UPDATE searches SET used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+            msg_ids = entry[1]
+            if isinstance(msg_ids, str):
+                # entries loaded from disk are parsed on first use
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+                self.entries[key] = (entry[0], msg_ids)
+            return msg_ids
+
+    def put(self, key, state, msg_ids):
+        """
+        Store the uids found by the search `key` in folder state `state`
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self.entries[key] = (tuple(state), msg_ids)
+            self.entries.move_to_end(key)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO searches (key, state, msg_ids, used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(list(state)), str(msg_ids), time.time()),
+                )
+            self._evict()
+            if self.db is not None:
+                self.db.commit()
+
+    def _evict(self):
+        while len(self.entries) > max(self.capacity, 0):
+            key, _ = self.entries.popitem(last=False)
+            if self.db is not None:
+                self.db.execute("DELETE FROM searches WHERE key = ?", (key,))
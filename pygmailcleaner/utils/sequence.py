@@ -0,0 +1,227 @@
+import os
+from array import array
+from bisect import bisect_left
+
+# maximum number of messages and characters sent in a single sequence-set
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 5000))
+MAX_SEQUENCE_SET_LENGTH = int(os.getenv("MAX_SEQUENCE_SET_LENGTH", 8000))
+
+
+def parse_msg_ids(msg_ids) -> list:
+    """
+    Parse message ids in the format "1,2,3" or "1:3,5" into a sorted list of unique ints
+    """
+    ids = set()
+    for part in msg_ids.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if ":" in part:
+            start, end = part.split(":")
+            start, end = int(start), int(end)
+            ids.update(range(min(start, end), max(start, end) + 1))
+        else:
+            ids.add(int(part))
+    return sorted(ids)
+
+
+def to_ranges(ids) -> list:
+    """
+    Compress a sorted list of ints into a list of inclusive (start, end) ranges
+    """
+    ranges = []
+    for i in ids:
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        elif not ranges or i > ranges[-1][1]:
+            ranges.append([i, i])
+    return [(start, end) for start, end in ranges]
+
+
+def format_range(start, end) -> str:
+    """
+    Format a single inclusive range as an IMAP sequence-set element
+    """
+    return str(start) if start == end else f"{start}:{end}"
+
+
+def format_sequence_set(ranges) -> str:
+    """
+    Format a list of inclusive ranges as an IMAP sequence-set in the format "1:5000,5002:9000"
+    """
+    return ",".join(format_range(start, end) for start, end in ranges)
+
+
+def chunk_ranges(ranges, chunk_size=CHUNK_SIZE, max_length=MAX_SEQUENCE_SET_LENGTH):
+    """
+    Split ranges into sequence-sets holding at most `chunk_size` messages and
+    at most `max_length` characters each
+
+    Yields:
+        tuple: (sequence_set, number_of_msgs) for every chunk
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    chunk, count, length = [], 0, 0
+    for start, end in ranges:
+        while start <= end:
+            take = min(end - start + 1, chunk_size - count)
+            element = format_range(start, start + take - 1)
+            extra = len(element) + (1 if chunk else 0)
+            if chunk and length + extra > max_length:
+                yield ",".join(chunk), count
+                chunk, count, length = [], 0, 0
+                continue
+            chunk.append(element)
+            count += take
+            length += extra
+            start += take
+            if count == chunk_size:
+                yield ",".join(chunk), count
+                chunk, count, length = [], 0, 0
+    if chunk:
+        yield ",".join(chunk), count
+
+
+def bitmap_count(bitmap) -> int:
+    """
+    Return the number of set bits of an int bitmap
+    """
+    if hasattr(bitmap, "bit_count"):  # python 3.10+
+        return bitmap.bit_count()
+    return bin(bitmap).count("1")
+
+
+class MsgIdSet:
+    """
+    Sorted set of unique message uids backed by a compact `array('I')`
+
+    Supports O(1) length, membership by bisection, linear-time set algebra and
+    encoding as IMAP sequence-set ranges.
+    """
+
+    def __init__(self, ids=()):
+        if isinstance(ids, MsgIdSet):
+            self._ids = array("I", ids._ids)
+        else:
+            self._ids = array("I", sorted(set(ids)))
+
+    @classmethod
+    def _from_sorted(cls, ids):
+        msg_id_set = cls.__new__(cls)
+        msg_id_set._ids = ids
+        return msg_id_set
+
+    @classmethod
+    def from_search(cls, data):
+        """
+        Build a set from a SEARCH response in the format b"1 2 3"
+        """
+        if isinstance(data, bytes):
+            data = data.decode()
+        return cls(int(i) for i in (data or "").split())
+
+    @classmethod
+    def from_string(cls, msg_ids):
+        """
+        Build a set from message ids in the format "1,2,3" or "1:3,5"
+        """
+        return cls._from_sorted(array("I", parse_msg_ids(msg_ids)))
+
+    @classmethod
+    def from_bitmap(cls, bitmap):
+        """
+        Build a set from an int bitmap where bit `uid` is set for every member
+        """
+        ids = array("I")
+        for i, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+            if byte:
+                base = i * 8
+                ids.extend(base + bit for bit in range(8) if byte >> bit & 1)
+        return cls._from_sorted(ids)
+
+    def to_bitmap(self) -> int:
+        """
+        Return the set as an int bitmap, whose &, |, ~ run in C at uid_max / 8 bytes of memory
+        """
+        if not self._ids:
+            return 0
+        bits = bytearray(self._ids[-1] // 8 + 1)
+        for uid in self._ids:
+            bits[uid >> 3] |= 1 << (uid & 7)
+        return int.from_bytes(bits, "little")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return MsgIdSet._from_sorted(self._ids[key])
+        return self._ids[key]
+
+    def __contains__(self, uid):
+        i = bisect_left(self._ids, uid)
+        return i < len(self._ids) and self._ids[i] == uid
+
+    def __eq__(self, other):
+        if isinstance(other, MsgIdSet):
+            return self._ids == other._ids
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MsgIdSet({str(self)!r})"
+
+    def __str__(self):
+        return format_sequence_set(self.ranges())
+
+    def _merge(self, other, keep_left, keep_both, keep_right):
+        a, b = self._ids, MsgIdSet(other)._ids
+        result = array("I")
+        i = j = 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                if keep_left:
+                    result.append(a[i])
+                i += 1
+            elif a[i] > b[j]:
+                if keep_right:
+                    result.append(b[j])
+                j += 1
+            else:
+                if keep_both:
+                    result.append(a[i])
+                i += 1
+                j += 1
+        if keep_left:
+            result.extend(a[i:])
+        if keep_right:
+            result.extend(b[j:])
+        return MsgIdSet._from_sorted(result)
+
+    def __and__(self, other):
+        return self._merge(other, False, True, False)
+
+    def __or__(self, other):
+        return self._merge(other, True, True, True)
+
+    def __sub__(self, other):
+        return self._merge(other, True, False, False)
+
+    def __xor__(self, other):
+        return self._merge(other, True, False, True)
+
+    def ranges(self) -> list:
+        """
+        Return the set as a list of inclusive (start, end) ranges
+        """
+        return to_ranges(self._ids)
+
+    def chunks(self, chunk_size=CHUNK_SIZE, max_length=MAX_SEQUENCE_SET_LENGTH):
+        """
+        Split the set into bounded sequence-sets, see `chunk_ranges`
+        """
+        return chunk_ranges(self.ranges(), chunk_size, max_length)
@@ -2,8 +2,17 @@ import imaplib
 import logging
 import os
 import datetime 
+import re
 
 from ..utils import formatting
+from ..utils import sequence
+from ..utils import protocol
+from ..utils import profiling
+from ..utils import pipeline
+from ..utils import compression
+from ..utils import scheduler
+from ..utils import query
+from ..utils import search_cache as search_cache_module
 
 logger = logging.getLogger()
 
@@ -14,26 +23,102 @@ TODAY = datetime.datetime.now().strftime("%Y-%m-%d")
 MAIN_FOLDER = os.getenv("FOLDER_TO_DELETE_FROM", '"[Google Mail]/All Mail"')
 TRASH_FOLDER = os.getenv("TRASH_FOLDER", '"[Google Mail]/Trash"')
 
+# number of X-GM-MSGID keys OR-ed together in a single Trash search
+SEARCH_GROUP_SIZE = int(os.getenv("SEARCH_GROUP_SIZE", 100))
+
+# number of messages requested in a single FETCH
+FETCH_CHUNK_SIZE = int(os.getenv("FETCH_CHUNK_SIZE", 500))
+
+GM_MSGID_PATTERN = re.compile(rb"X-GM-MSGID (\d+)")
+STATUS_ITEM_PATTERN = re.compile(rb"([A-Z-]+) (\d+)")
+ESEARCH_COUNT_PATTERN = re.compile(rb"COUNT (\d+)")
+
 class SMPTClient:
-    def __init__(self, server, port, user, password):
+    def __init__(self, server, port, user, password, rate_limiter=None, use_ssl=True, profiler=None, compress=False,
+                 window=pipeline.PIPELINE_WINDOW, search_cache=None):
         self.server = server
         self.port = port
         self.user = user
         self.password = password
+        self.use_ssl = use_ssl
+        self.profiler = profiler  # optional profiling.CommandProfiler recording every command
+        self.compress = compress  # negotiate COMPRESS=DEFLATE after login when the server supports it
+        self.window = window  # tagged commands in flight for chunked commands, 1 disables pipelining
         self.imap = None  # Initialize imap variable
+        self.folder = MAIN_FOLDER
+        # results of get_msg_ids per folder state, in memory unless a cache with a path is given
+        self.search_cache = search_cache if search_cache is not None else search_cache_module.SearchCache()
+        self.rate_limiter = rate_limiter  # optional limiter shared between clients, see rules.RateLimiter
     
     def connect(self, FOLDER=MAIN_FOLDER):
         """
         Connect to a server and folder
         """
         try:
-            self.imap = imaplib.IMAP4_SSL(self.server, self.port)
+            self._throttle()
+            imap_class = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+            if self.compress:
+                imap_class = compression.compressed(imap_class)
+            if self.profiler is not None:
+                imap_class = profiling.profiled(imap_class)
+                imap_class.profiler = self.profiler
+            if isinstance(imap_class, type):
+                # the search cache keys on the selected mailbox and its state, unless imaplib is mocked
+                imap_class = search_cache_module.tracked(imap_class)
+            self.imap = imap_class(self.server, self.port)
             self.imap.login(self.user, self.password)
+            # servers such as Gmail only advertise extensions like UIDPLUS once authenticated
+            self.imap._get_capabilities()
+            if self.compress:
+                self.imap.enable_compression()
+            if isinstance(self.imap, search_cache_module.MailboxStateMixin):
+                # flag changes by other clients only carry a MODSEQ once CONDSTORE is enabled
+                self.imap.enable_condstore()
             print("Connected to gmail")
             self.imap.select(FOLDER)
+            self.folder = FOLDER
         except Exception as e:
             raise ConnectionError(f"Could not connect to server: {e}")
     
+    def reconnect(self, folder=None):
+        """
+        Replace a broken connection with a new one and select `folder`, by default the client's folder
+        """
+        try:
+            self.imap.shutdown()
+        except Exception:
+            pass
+        self.connect(self.folder)
+        if folder is not None and folder != self.folder:
+            self.imap.select(folder)
+
+    def _uid_pipeline(self, commands):
+        """
+        Run (command, *args) UID commands, pipelined when the connection supports it
+
+        Yields:
+            tuple: (typ, data) of every command in order
+        """
+        def throttled():
+            for command in commands:
+                self._throttle()
+                yield command
+
+        if isinstance(self.imap, imaplib.IMAP4):
+            # flag changes reported on NOOP or IDLE would be taken for the results of a FETCH
+            self.imap.untagged_responses.pop("FETCH", None)
+            yield from pipeline.uid_pipeline(self.imap, throttled(), self.window)
+        else:
+            for command in throttled():
+                yield self.imap.uid(*command)
+
+    def _throttle(self):
+        """
+        Wait for the rate limiter, if any, before sending a command
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.server)
+
     def close(self,):
         """
         Close the connection
@@ -48,47 +133,373 @@ class SMPTClient:
         except Exception as e:
             raise RuntimeError(f"Error occurred while closing the connection: {e}")
     
-    def get_msg_ids(self, method, date_until=datetime.datetime.now().strftime("%Y-%m-%d")) -> str:
+    def get_msg_ids(self, method, date_until=datetime.datetime.now().strftime("%Y-%m-%d"),
+                    within=None) -> sequence.MsgIdSet:
         """
-        Gets a list of message ids based on method and date in the format "1,2,3,4"
+        Gets the set of message uids based on method and date
+
+        UIDs are used rather than sequence numbers so ids stay stable while
+        messages are expunged. `method` is a Gmail search string or a
+        `query.Query`, which is sent as standard SEARCH keys to servers
+        without the Gmail X-GM-EXT-1 extension. With `within`, a MsgIdSet,
+        only those uids are searched.
+
+        Results are kept in `search_cache` and repeated searches are answered
+        from it while the folder state proves the mailbox unchanged, see
+        `search_cache.SearchCache`.
         """
         try:
-            search = f'"{method} before:{formatting.get_unix_timestamp(date_until)}"'
-            logger.debug(f"Search string: {search}")
-            typ, [msg_ids] = self.imap.search(None, "X-GM-RAW", search)
-            if isinstance(msg_ids, bytes):
-                msg_ids = msg_ids.decode()
-                msg_ids = ",".join(msg_ids.split(" "))
+            if isinstance(method, str):
+                method = " ".join(method.split())
+            command = self._search_command(method, date_until, within)
+            state = self._search_state() if within is None else None
+            if state is not None:
+                # delete_msgs and the index leave other folders selected than `self.folder`
+                key = search_cache_module.search_key(self.server, self.user, self.imap.selected, *command)
+                cached = self.search_cache.get(key, state)
+                if cached is not None:
+                    logger.info(f"Using cached search results for: {command[-1]}")
+                    return cached
+            self._throttle()
+            typ, [msg_ids] = self.imap.uid(*command)
+            msg_ids = sequence.MsgIdSet.from_search(msg_ids)
+            if state is not None and typ == "OK":
+                self.search_cache.put(key, state, msg_ids)
             return msg_ids
+        except query.QueryError:
+            # the search cannot be expressed for this server, retrying will not help
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while getting message ids: {e}")
+
+    def _search_state(self):
+        """
+        Return the folder state search results are cached for, None when a change could go unnoticed
+        """
+        if self.search_cache.capacity <= 0 or not isinstance(self.imap, search_cache_module.MailboxStateMixin):
+            return None
+        # without CONDSTORE enabled flag and label changes leave the state untouched
+        if not self.imap.condstore:
+            return None
+        try:
+            # collects the EXISTS, EXPUNGE and FETCH updates the server holds for the selected mailbox
+            self._throttle()
+            self.imap.noop()
+        except Exception as e:
+            logger.debug(f"Not caching search: {e}")
+            return None
+        return self.imap.mailbox_state()
+
+    def _search_command(self, method, date_until, within=None) -> tuple:
+        # a UID key restricts the search to known uids, the other keys are AND-ed with it
+        scope = ("UID", str(within)) if within is not None else ()
+        if isinstance(method, query.Query) and "X-GM-EXT-1" not in self.imap.capabilities:
+            try:
+                keys = query.And(method, query.Before(date_until)).to_imap()
+            except query.QueryError as e:
+                raise query.QueryError(f"{self.server} does not support Gmail search, {e}")
+            logger.debug(f"Search keys: {keys}")
+            return ("SEARCH", *scope, *keys)
+        search = protocol.quote(f"{method} before:{formatting.get_unix_timestamp(date_until)}")
+        logger.debug(f"Search string: {search}")
+        return ("SEARCH", *scope, "X-GM-RAW", search)
+
+    def get_msg_ids_any(self, queries, date_until=datetime.datetime.now().strftime("%Y-%m-%d"),
+                        max_length=query.MAX_QUERY_LENGTH) -> sequence.MsgIdSet:
+        """
+        Gets the set of message uids matching any of many queries, such as one From per sender
+
+        Queries are packed into a few OR groups of bounded length, see
+        `query.pack_or`, whose searches are pipelined and merged into one set.
+        """
+        try:
+            groups = query.pack_or(queries, max_length)
+            logger.info(f"Searching {len(groups)} groups of queries")
+            msg_ids = sequence.MsgIdSet()
+            for typ, [found] in self._uid_pipeline(self._search_command(group, date_until) for group in groups):
+                if typ != "OK":
+                    raise RuntimeError(found)
+                msg_ids = msg_ids | sequence.MsgIdSet.from_search(found)
+            return msg_ids
+        except query.QueryError:
+            raise
         except Exception as e:
             raise RuntimeError(f"Error occurred while getting message ids: {e}")
     
     def count_msgs(self, msg_ids) -> int:
         """
-        Parse the string message ids split by a comma and return the number of emails
+        Return the number of emails in a message id set or a string of ids split by a comma
         """
         try:
-            if msg_ids == "":
-                return 0
-            else:
-                return len(msg_ids.split(","))
+            if isinstance(msg_ids, str):
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+            return len(msg_ids)
         except Exception as e:
             raise RuntimeError(f"Error occurred while counting messages: {e}")
 
-    def delete_msgs(self, msg_ids):
+    def get_status(self, folder=MAIN_FOLDER, items=("MESSAGES", "UIDVALIDITY", "UIDNEXT")) -> dict:
+        """
+        Get folder counters computed by the server with STATUS, e.g. {"MESSAGES": 10, "UIDNEXT": 11}
+        """
+        try:
+            typ, data = self.imap.status(folder, f"({' '.join(items)})")
+            if typ != "OK":
+                raise RuntimeError(data)
+            status = data[0].rsplit(b"(", 1)[-1]
+            return {
+                name.decode(): int(value)
+                for name, value in STATUS_ITEM_PATTERN.findall(status)
+            }
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while getting folder status: {e}")
+
+    def get_mailbox_state(self, folder=None) -> tuple:
+        """
+        Get (UIDVALIDITY, UIDNEXT, MESSAGES, HIGHESTMODSEQ) of a folder, which
+        changes whenever messages are added, removed or modified
+        """
+        items = ["UIDVALIDITY", "UIDNEXT", "MESSAGES"]
+        if "CONDSTORE" in self.imap.capabilities:
+            items.append("HIGHESTMODSEQ")
+        status = self.get_status(folder or self.folder, items)
+        return tuple(status.get(item) for item in ("UIDVALIDITY", "UIDNEXT", "MESSAGES", "HIGHESTMODSEQ"))
+
+    def count_search(self, method, date_until=datetime.datetime.now().strftime("%Y-%m-%d")) -> int:
+        """
+        Count the messages matching method and date without transferring their ids
+
+        Uses ESEARCH `RETURN (COUNT)` when available, otherwise counts the
+        uids of `get_msg_ids`, whose results are cached.
+        """
+        try:
+            if "ESEARCH" not in self.imap.capabilities:
+                return len(self.get_msg_ids(method, date_until))
+            search = protocol.quote(f"{method} before:{formatting.get_unix_timestamp(date_until)}")
+            self._throttle()
+            self.imap.uid("SEARCH", "RETURN", "(COUNT)", "X-GM-RAW", search)
+            typ, data = self.imap.response("ESEARCH")
+            match = ESEARCH_COUNT_PATTERN.search(data[-1] or b"")
+            return int(match.group(1)) if match else 0
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while counting search results: {e}")
+
+    def fetch(self, msg_ids, items, chunk_size=FETCH_CHUNK_SIZE):
+        """
+        Fetch data items such as "(UID RFC822.SIZE)" for a set of uids in chunks
+
+        Yields:
+            dict: The parsed data items of every message, see `protocol.parse_fetch`
+        """
+        try:
+            if isinstance(msg_ids, str):
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+            commands = (("FETCH", chunk, items) for chunk, count in msg_ids.chunks(chunk_size))
+            for typ, data in self._uid_pipeline(commands):
+                if typ != "OK":
+                    raise RuntimeError(data)
+                yield from protocol.iter_fetch(data)
+        except scheduler.TRANSIENT_ERRORS:
+            # left unwrapped so a `scheduler.ChunkScheduler` reconnects and retries
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while fetching messages: {e}")
+
+    def get_gm_msgids(self, chunk) -> list:
+        """
+        Fetch the Gmail X-GM-MSGID of every message uid in a sequence-set
+        """
+        return self._parse_gm_msgids(self.imap.uid("FETCH", chunk, "(X-GM-MSGID)")[1])
+
+    def _parse_gm_msgids(self, data) -> list:
+        gm_msgids = []
+        for item in data:
+            if isinstance(item, tuple):
+                item = item[0]
+            match = GM_MSGID_PATTERN.search(item or b"")
+            if match:
+                gm_msgids.append(int(match.group(1)))
+        return gm_msgids
+
+    def search_gm_msgids(self, gm_msgids, group_size=SEARCH_GROUP_SIZE) -> sequence.MsgIdSet:
+        """
+        Find the uids of messages in the selected folder by their X-GM-MSGID
+
+        Ids are OR-ed together in groups of `group_size` so the number of
+        searches depends on the number of ids rather than the folder size
+        """
+        return self._search_any("X-GM-MSGID", gm_msgids, group_size)
+
+    def search_gm_thrids(self, gm_thrids, group_size=SEARCH_GROUP_SIZE) -> sequence.MsgIdSet:
+        """
+        Find the uids of every message of the given Gmail conversations (X-GM-THRID) in the selected folder
+        """
+        return self._search_any("X-GM-THRID", gm_thrids, group_size)
+
+    def _search_any(self, key, values, group_size) -> sequence.MsgIdSet:
+        def searches():
+            for i in range(0, len(values), group_size):
+                group = values[i:i + group_size]
+                keys = ["OR"] * (len(group) - 1)
+                for value in group:
+                    keys += [key, str(value)]
+                yield ("SEARCH", *keys)
+
+        uids = sequence.MsgIdSet()
+        for typ, [found] in self._uid_pipeline(searches()):
+            uids = uids | sequence.MsgIdSet.from_search(found)
+        return uids
+
+    def expunge_uids(self, msg_ids, chunk_size=sequence.CHUNK_SIZE, chunk_scheduler=None, folder=TRASH_FOLDER):
+        """
+        Permanently delete only the given uids in the selected folder using UIDPLUS `UID EXPUNGE`
+        """
+        if "UIDPLUS" not in self.imap.capabilities:
+            raise RuntimeError("Server does not support UIDPLUS, cannot expunge targeted messages")
+        chunk_scheduler = chunk_scheduler or scheduler.ChunkScheduler(self, chunk_size)
+        for chunk, count, _ in chunk_scheduler.run_pipelined(msg_ids, self.expunge_chunks, self.window, folder):
+            logger.debug(f"Expunged {count} messages")
+
+    def expunge_chunk(self, chunk):
+        """
+        Permanently delete a sequence-set of uids in the selected folder
+        """
+        list(self.expunge_chunks([chunk]))
+
+    def expunge_chunks(self, chunks):
+        """
+        Permanently delete every sequence-set of `chunks` in the selected folder, pipelining all commands
+
+        Yields:
+            None: Once per expunged chunk, in order.
+        """
+        def commands():
+            for chunk in chunks:
+                logger.debug(f"Expunging: {chunk}")
+                # the server runs them in order and EXPUNGE only removes messages flagged \Deleted,
+                # so both are sent in one round trip
+                yield ("STORE", chunk, "+FLAGS", "\\Deleted")
+                yield ("EXPUNGE", chunk)
+
+        responses = self._uid_pipeline(commands())
+        try:
+            for chunk in chunks:
+                scheduler.check_response(*next(responses))
+                scheduler.check_response(*next(responses))
+                yield None
+        finally:
+            # completes the commands still in flight
+            responses.close()
+
+    def move_to_trash(self, chunk, targeted=False) -> list:
+        """
+        Label a sequence-set of uids as Trash
+
+        Returns the X-GM-MSGIDs of the moved messages when `targeted`, otherwise an empty list
+        """
+        return list(self.move_chunks_to_trash([chunk], targeted))[0]
+
+    def move_chunks_to_trash(self, chunks, targeted=False):
+        """
+        Label every sequence-set of `chunks` as Trash, pipelining the commands of all chunks
+
+        Yields:
+            list: The X-GM-MSGIDs of each chunk's messages when `targeted`, otherwise an empty list, in order.
+        """
+        def commands():
+            for chunk in chunks:
+                logger.debug(f"Storing Trash label on: {chunk}")
+                if targeted:
+                    # the ids are fetched in the same round trip, before the messages leave the folder
+                    yield ("FETCH", chunk, "(X-GM-MSGID)")
+                yield ("STORE", chunk, "+X-GM-LABELS", "\\Trash")
+
+        responses = self._uid_pipeline(commands())
+        try:
+            for chunk in chunks:
+                gm_msgids = []
+                if targeted:
+                    gm_msgids = self._parse_gm_msgids(scheduler.check_response(*next(responses)))
+                scheduler.check_response(*next(responses))
+                yield gm_msgids
+        finally:
+            # completes the commands still in flight
+            responses.close()
+
+    def empty_trash(self):
+        """
+        Permanently delete every message of the selected folder
+        """
+        self.imap.store("1:*", "+FLAGS", "\\Deleted")
+        self.imap.expunge()
+
+    def delete_msgs(self, msg_ids, chunk_size=sequence.CHUNK_SIZE, targeted=False, journal=None, archiver=None,
+                    chunk_scheduler=None):
         """
         Delete emails based on method and date
+
+        Message uids are compressed into sequence-set ranges and labelled as Trash
+        in chunks of at most `chunk_size` messages so every command stays bounded.
+        The commands of up to `window` chunks are pipelined in one round trip.
+        A `scheduler.ChunkScheduler` shrinks the chunks when the server slows down
+        or throttles, and reconnects with backoff when the connection drops.
+
+        By default the whole Trash folder is emptied afterwards. With `targeted`
+        the moved messages are tracked by X-GM-MSGID and only those are expunged
+        from Trash, leaving unrelated trashed mail untouched.
+
+        With a `journal.DeleteJournal` every completed chunk is recorded, chunks
+        moved by an interrupted run are skipped and the journal is removed once
+        Trash is emptied.
+
+        With an `archive.Archiver` every chunk is copied to the archive and
+        synced to disk before it is moved to Trash.
+
+        `chunk_scheduler` replaces the default `scheduler.ChunkScheduler`, e.g.
+        to change its retries or backoff.
         """
         try:
+            if isinstance(msg_ids, str):
+                msg_ids = sequence.MsgIdSet.from_string(msg_ids)
+            if targeted and "UIDPLUS" not in self.imap.capabilities:
+                # checked before anything moves, the selection would otherwise be left in Trash
+                raise RuntimeError("Server does not support UIDPLUS, cannot expunge targeted messages")
+            gm_msgids = []
+            if journal is not None:
+                msg_ids = journal.start(msg_ids)
+                gm_msgids = list(journal.gm_msgids)
             number_of_msgs = self.count_msgs(msg_ids)
-            if msg_ids == "":
+            if not msg_ids and not (journal is not None and journal.moved):
                 print("No emails matching search criteria")
             else:
                 print(f"Moving {number_of_msgs} to Trash")
-                self.imap.store(msg_ids, "+X-GM-LABELS", "\\Trash")
-                print("Emptying Trash")
-                self.imap.select(TRASH_FOLDER)
-                self.imap.store("1:*", "+FLAGS", "\\Deleted")
-                self.imap.expunge()
+                if chunk_scheduler is None:
+                    chunk_scheduler = scheduler.ChunkScheduler(self, chunk_size)
+                moved = 0
+                def trash(chunks):
+                    return self.move_chunks_to_trash(chunks, targeted)
+
+                def archive(chunk):
+                    archiver.archive_chunk(self, chunk)
+
+                prepare = archive if archiver is not None else None
+                chunks = chunk_scheduler.run_pipelined(msg_ids, trash, self.window, prepare=prepare)
+                for chunk, count, chunk_gm_msgids in chunks:
+                    if journal is not None:
+                        journal.record_moved(chunk, chunk_gm_msgids)
+                    if archiver is not None:
+                        archiver.forget(chunk)
+                    gm_msgids += chunk_gm_msgids
+                    moved += count
+                    print(f"Moved {moved}/{number_of_msgs} to Trash")
+                chunk_scheduler.call(lambda: self.imap.select(TRASH_FOLDER), folder=TRASH_FOLDER)
+                if targeted:
+                    trash_ids = chunk_scheduler.call(self.search_gm_msgids, gm_msgids, folder=TRASH_FOLDER)
+                    print(f"Emptying {len(trash_ids)} moved messages from Trash")
+                    self.expunge_uids(trash_ids, chunk_scheduler=chunk_scheduler)
+                else:
+                    print("Emptying Trash")
+                    chunk_scheduler.call(self.empty_trash, folder=TRASH_FOLDER)
+                if journal is not None:
+                    journal.finish()
         except Exception as e:
             raise RuntimeError(f"Error occurred while deleting messages: {e}")
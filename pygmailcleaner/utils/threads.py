@@ -0,0 +1,112 @@
+import logging
+from array import array
+
+from ..utils import sequence
+from ..utils.smpt import FETCH_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+# "messages" deletes matches only, "all" every message of a matched thread and
+# "complete" only threads whose every message matched
+THREAD_MODES = ("messages", "all", "complete")
+
+THREAD_ITEMS = "(UID X-GM-THRID)"
+
+
+class ThreadIndex:
+    """
+    Gmail conversation (X-GM-THRID) of every message of a folder
+
+    Only the threads of the matched messages are looked up: their thread ids
+    are fetched and the rest of those threads found with OR-packed searches,
+    so the cost follows the matches rather than the folder size. Each message costs a uid, a thread id and a matched flag in flat arrays,
+    so memory stays small on large folders.
+    """
+
+    def __init__(self):
+        self.uids = array("I")
+        self.thrids = array("Q")
+        self.matched = bytearray()
+
+    def __len__(self):
+        return len(self.uids)
+
+    def add(self, uid, thrid, matched):
+        """
+        Record that message `uid` belongs to thread `thrid`
+        """
+        self.uids.append(uid)
+        self.thrids.append(thrid)
+        self.matched.append(matched)
+
+    @classmethod
+    def build(cls, client, msg_ids, scope=None, batch_size=FETCH_CHUNK_SIZE):
+        """
+        Fetch the thread of every message in the threads of `msg_ids`, flagging those in `msg_ids`
+
+        Args:
+            client (SMPTClient): A connected client with the folder selected.
+            msg_ids (MsgIdSet): The matched message uids.
+            scope (MsgIdSet): Messages considered part of the threads, default every message
+                of the selected folder in a matched thread.
+            batch_size (int): Number of messages per FETCH.
+        """
+        try:
+            if "X-GM-EXT-1" not in client.imap.capabilities:
+                raise RuntimeError("the server does not support X-GM-THRID")
+            index = cls()
+            if scope is None:
+                for item in client.fetch(msg_ids, THREAD_ITEMS, batch_size):
+                    index.add(item["UID"], item["X-GM-THRID"], True)
+                others = client.search_gm_thrids(sorted(set(index.thrids))) - msg_ids
+            else:
+                others = scope | msg_ids
+            for item in client.fetch(others, THREAD_ITEMS, batch_size):
+                index.add(item["UID"], item["X-GM-THRID"], item["UID"] in msg_ids)
+            logger.debug(f"Indexed threads of {len(index)} messages")
+            return index
+        except Exception as e:
+            raise RuntimeError(f"Error occurred while grouping messages by thread: {e}")
+
+    def _threads(self):
+        matched, partial = set(), set()
+        for thrid, flag in zip(self.thrids, self.matched):
+            if flag:
+                matched.add(thrid)
+        for thrid, flag in zip(self.thrids, self.matched):
+            if not flag and thrid in matched:
+                partial.add(thrid)
+        return matched, partial
+
+    def select(self, mode="all") -> sequence.MsgIdSet:
+        """
+        Return the uids to delete for a thread mode, see THREAD_MODES
+        """
+        if mode not in THREAD_MODES:
+            raise ValueError(f"Unknown thread mode {mode}, expected one of {THREAD_MODES}")
+        if mode == "messages":
+            return sequence.MsgIdSet(uid for uid, flag in zip(self.uids, self.matched) if flag)
+        matched, partial = self._threads()
+        if mode == "all":
+            return sequence.MsgIdSet(uid for uid, thrid in zip(self.uids, self.thrids) if thrid in matched)
+        return sequence.MsgIdSet(
+            uid for uid, thrid, flag in zip(self.uids, self.thrids, self.matched) if flag and thrid not in partial
+        )
+
+    def stats(self) -> dict:
+        """
+        Return thread counts of the matched messages
+
+        Returns:
+            dict: "threads" touched by a match, "complete_threads" whose every message
+            matched, "partial_threads", "matched" messages and "thread_messages", the
+            number of messages in the touched threads.
+        """
+        matched, partial = self._threads()
+        return {
+            "threads": len(matched),
+            "complete_threads": len(matched) - len(partial),
+            "partial_threads": len(partial),
+            "matched": sum(self.matched),
+            "thread_messages": sum(1 for thrid in self.thrids if thrid in matched),
+        }
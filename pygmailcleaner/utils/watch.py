@@ -0,0 +1,217 @@
+import datetime
+import imaplib
+import logging
+import os
+import random
+import select
+import time
+
+from ..utils import sequence
+from ..utils.query import QueryError
+from ..utils.protocol import CRLF
+from ..utils.scheduler import BACKOFF_SECONDS, MAX_BACKOFF_SECONDS
+from ..utils.threads import ThreadIndex
+
+logger = logging.getLogger()
+
+# seconds before IDLE is re-issued, RFC 2177 servers may drop idle clients after 30 minutes
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", 25 * 60))
+
+# seconds between NOOP polls on servers without IDLE
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 60))
+
+
+def _buffered(imap) -> bool:
+    """
+    Whether response bytes already wait in a buffer where select cannot see them
+    """
+    deflate = getattr(imap, "deflate", None)
+    if deflate is not None and deflate.pending():
+        return True
+    # SSL records decrypted but not read yet
+    pending = getattr(imap.sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    timeout = imap.sock.gettimeout()
+    imap.sock.setblocking(False)
+    try:
+        return bool(imap.file.peek(1))
+    except OSError:
+        # nothing to read without blocking, including ssl.SSLWantReadError
+        return False
+    finally:
+        imap.sock.settimeout(timeout)
+
+
+def idle(imap, timeout=IDLE_TIMEOUT) -> bool:
+    """
+    Run an RFC 2177 IDLE command on `imap` until the server reports a change or `timeout` passes
+
+    `imaplib` before python 3.14 has no IDLE, so the command is written with
+    the connection's own tag bookkeeping. Untagged responses such as EXISTS
+    are stored in `imap.untagged_responses` as for any other command.
+
+    Returns:
+        bool: True if the server sent a response while idling.
+    """
+    tag = imap._new_tag()
+    imap.send(tag + b" IDLE" + CRLF)
+    # None is returned for the continuation request
+    while imap._get_response() is not None:
+        if imap.tagged_commands[tag] is not None:
+            typ, data = imap.tagged_commands.pop(tag)
+            raise imap.error(f"IDLE failed: {typ} {data}")
+    deadline = time.monotonic() + timeout
+    activity = False
+    while not activity:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not _buffered(imap) and not select.select([imap.sock], [], [], remaining)[0]:
+            break
+        imap._get_response()
+        activity = True
+    imap.send(b"DONE" + CRLF)
+    while imap.tagged_commands[tag] is None:
+        imap._get_response()
+    typ, data = imap.tagged_commands.pop(tag)
+    if typ != "OK":
+        raise imap.error(f"IDLE failed: {typ} {data}")
+    return activity
+
+
+class Watcher:
+    """
+    Applies a search to mail as it arrives in the client's folder
+
+    Only uids from the last known UIDNEXT on are searched, so every cycle
+    costs work proportional to the new mail rather than to the folder. The
+    client waits for new mail with IDLE, or with NOOP every `poll_interval`
+    seconds on servers without it. Failed cycles back off, reconnect and
+    catch up on everything that arrived meanwhile. If UIDVALIDITY changed the
+    old uids are meaningless and watching restarts from the current UIDNEXT.
+
+    Matches are deleted as by a batch cleanup with the same `threads`,
+    `targeted` and `archiver` settings, or only logged and counted with `dry_run`.
+    """
+
+    def __init__(self, client, method, idle_timeout=IDLE_TIMEOUT, poll_interval=POLL_INTERVAL,
+                 chunk_size=sequence.CHUNK_SIZE, sleep=time.sleep, dry_run=False, threads="messages",
+                 targeted=False, archiver=None):
+        self.client = client
+        self.method = method  # a Gmail search string or query.Query, as for SMPTClient.get_msg_ids
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.sleep = sleep
+        self.dry_run = dry_run
+        self.threads = threads  # "messages", "all" or "complete", see ThreadIndex.select
+        self.targeted = targeted  # expunge only the moved messages from Trash, see SMPTClient.delete_msgs
+        self.archiver = archiver  # optional archive.Archiver receiving matches before they are deleted
+        self.uidvalidity = None
+        self.uidnext = None
+        self.synced = False
+        self.scanned = 0  # new messages searched
+        self.matched = 0
+        self.deleted = 0
+        self.reconnects = 0
+
+    def sync(self):
+        """
+        Read UIDVALIDITY and UIDNEXT of the folder, keeping the position when UIDVALIDITY is unchanged
+        """
+        uidvalidity, uidnext = self.client.get_mailbox_state()[:2]
+        if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+            logger.warning(f"UIDVALIDITY of {self.client.folder} changed, watching from UID {uidnext}")
+            self.uidnext = None
+        self.uidvalidity = uidvalidity
+        if self.uidnext is None:
+            self.uidnext = uidnext
+        self.synced = True
+
+    def new_msg_ids(self) -> sequence.MsgIdSet:
+        """
+        Return the uids of the messages added since the last scan
+        """
+        # "n:*" also matches the highest uid when no message reached n yet
+        typ, [data] = self.client.imap.uid("SEARCH", "UID", f"{self.uidnext}:*")
+        if typ != "OK":
+            raise RuntimeError(data)
+        return sequence.MsgIdSet(uid for uid in sequence.MsgIdSet.from_search(data) if uid >= self.uidnext)
+
+    def scan(self) -> sequence.MsgIdSet:
+        """
+        Search the new messages and delete the matching ones, unless `dry_run`
+
+        Returns:
+            MsgIdSet: The uids matched, deleted unless `dry_run`.
+        """
+        # EXISTS received from now on announces mail this scan may not see
+        self.client.imap.untagged_responses.pop("EXISTS", None)
+        new = self.new_msg_ids()
+        if not new:
+            return new
+        self.scanned += len(new)
+        # new mail is never older than a date bound, only the filters apply
+        tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        matched = self.client.get_msg_ids(self.method, tomorrow, within=new)
+        if matched and self.threads != "messages":
+            matched = ThreadIndex.build(self.client, matched).select(self.threads)
+        logger.info(f"{len(matched)} messages match {len(new)} new messages")
+        self.matched += len(matched)
+        if matched and self.dry_run:
+            logger.info(f"Dry run, not deleting: {matched}")
+        elif matched:
+            self.client.delete_msgs(matched, chunk_size=self.chunk_size, targeted=self.targeted,
+                                    archiver=self.archiver)
+            self.client.imap.select(self.client.folder)
+            self.deleted += len(matched)
+        self.uidnext = max(new) + 1
+        return matched
+
+    def wait(self) -> bool:
+        """
+        Wait for the server to report new mail, with IDLE when supported and NOOP otherwise
+
+        Returns:
+            bool: True if new mail was announced.
+        """
+        imap = self.client.imap
+        if "EXISTS" not in imap.untagged_responses:
+            if "IDLE" in imap.capabilities and isinstance(imap, imaplib.IMAP4):
+                idle(imap, self.idle_timeout)
+            else:
+                self.sleep(self.poll_interval)
+                self.client._throttle()
+                imap.noop()
+        return "EXISTS" in imap.untagged_responses
+
+    def run(self, max_cycles=None):
+        """
+        Scan for new mail and wait for more until interrupted, or until `max_cycles` scans completed
+        """
+        cycles = failures = 0
+        while True:
+            try:
+                if not self.synced:
+                    self.sync()
+                self.scan()
+                cycles += 1
+                failures = 0
+                if max_cycles is not None and cycles >= max_cycles:
+                    return
+                self.wait()
+            except QueryError:
+                raise
+            except Exception as e:
+                self.synced = False
+                delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** failures))
+                failures += 1
+                logger.warning(f"Watching failed: {e!r}, reconnecting in {delay:.1f}s")
+                self.sleep(delay)
+                try:
+                    self.client.reconnect()
+                    self.reconnects += 1
+                except Exception as e:
+                    # the next cycle fails on the dead connection and reconnects again
+                    logger.warning(f"Reconnect failed: {e}")
@@ -0,0 +1,30 @@
+import contextlib
+import io
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, FakeGmailServer
+
+
+@pytest.fixture
+def connect():
+    """
+    Return a function logging a client into a FakeGmailServer, extra arguments go to SMPTClient
+    """
+    def connect(server, gmail, **kwargs):
+        client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.connect()
+        return client
+
+    return connect
+
+
+@pytest.fixture
+def client(gmail, connect):
+    """
+    A client connected to a FakeGmailServer serving the test module's `gmail` fixture
+    """
+    with FakeGmailServer(gmail) as server:
+        yield connect(server, gmail)
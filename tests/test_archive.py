@@ -0,0 +1,177 @@
+import contextlib
+import gzip
+import imaplib
+import io
+import mailbox
+import os
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import (
+    Archiver, ArchiveError, ChunkScheduler, MboxArchive, open_archive, size_batches, FakeGmail, MsgIdSet,
+)
+from pygmailcleaner.utils import archive as archive_module
+
+DATE_UNTIL = "2100-01-01"
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail()
+    for i in range(12):
+        gmail.add_message(sender=f"sender{i}@example.com", subject=f"Message {i}", body_size=2000 + i)
+    return gmail
+
+
+class TestArchive:
+
+    def test_size_batches(self):
+        sizes = {1: 10, 2: 10, 3: 100, 4: 10, 5: 10}
+        assert list(size_batches(sizes, batch_bytes=25, batch_size=10)) == [
+            MsgIdSet([1, 2]), MsgIdSet([3]), MsgIdSet([4, 5]),
+        ]
+        assert list(size_batches(sizes, batch_bytes=1000, batch_size=2)) == [
+            MsgIdSet([1, 2]), MsgIdSet([3, 4]), MsgIdSet([5]),
+        ]
+
+    def test_mbox_quotes_from_lines(self, tmp_path):
+        path = str(tmp_path / "archive.mbox")
+        archive = MboxArchive(path)
+        archive.add(b"Subject: a\n\nFrom here\n>From there\n")
+        archive.commit()
+        archive.close()
+        messages = list(mailbox.mbox(path))
+        assert len(messages) == 1
+        assert messages[0].get_payload() == ">From here\n>>From there\n"
+
+    @pytest.mark.parametrize("compression", [None, "gzip"])
+    def test_archive_before_delete(self, client, gmail, tmp_path, compression):
+        raws = {msg.subject: msg.raw() for msg in gmail.messages.values()}
+        path = str(tmp_path / "archive.mbox")
+        archiver = Archiver(open_archive(path, "mbox", compression), batch_bytes=5000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=5, archiver=archiver)
+        archiver.archive.close()
+
+        assert not gmail.messages
+        assert archiver.messages == 12
+        if compression == "gzip":
+            with gzip.open(path) as f, open(str(tmp_path / "plain.mbox"), "wb") as out:
+                out.write(f.read())
+            path = str(tmp_path / "plain.mbox")
+        archived = {msg["Subject"]: msg.as_bytes() for msg in mailbox.mbox(path)}
+        assert set(archived) == set(raws)
+        for subject, raw in raws.items():
+            # mbox ends every message with a line break
+            assert archived[subject].replace(b"\r\n", b"\n").rstrip(b"\n") == raw.replace(b"\r\n", b"\n")
+
+    def test_maildir(self, client, gmail, tmp_path):
+        path = str(tmp_path / "maildir")
+        archiver = Archiver(open_archive(path, "maildir"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=5, archiver=archiver)
+
+        assert not gmail.messages
+        assert not os.listdir(os.path.join(path, "tmp"))
+        assert sorted(msg["Subject"] for msg in mailbox.Maildir(path, create=False)) == sorted(
+            f"Message {i}" for i in range(12)
+        )
+
+    def test_failed_archive_keeps_messages(self, client, gmail, tmp_path):
+        archiver = Archiver(open_archive(str(tmp_path / "archive.mbox")))
+
+        def broken(raw, date=None):
+            raise OSError("disk full")
+
+        archiver.archive.add = broken
+        with contextlib.redirect_stdout(io.StringIO()), pytest.raises(RuntimeError):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=5, archiver=archiver)
+        assert len(gmail.messages) == 12
+
+    def test_failed_commit_is_not_retried(self, client, gmail, tmp_path):
+        archiver = Archiver(open_archive(str(tmp_path / "archive.mbox")))
+        commits = []
+
+        def broken():
+            commits.append(1)
+            raise OSError("No space left on device")
+
+        archiver.archive.commit = broken
+        with pytest.raises(ArchiveError):
+            archiver.archive_chunk(client, str(client.get_msg_ids("", DATE_UNTIL)[:5]))
+        with contextlib.redirect_stdout(io.StringIO()), pytest.raises(RuntimeError, match="No space left"):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=5, archiver=archiver)
+        assert len(commits) == 2
+        assert len(gmail.messages) == 12
+
+    def test_retried_chunk_is_not_archived_twice(self, client, tmp_path):
+        archiver = Archiver(open_archive(str(tmp_path / "archive.mbox")))
+        msg_ids = client.get_msg_ids("", DATE_UNTIL)
+        archiver.archive_chunk(client, str(msg_ids[:6]))
+        archiver.archive_chunk(client, str(msg_ids[:3]))
+        archiver.archive_chunk(client, str(msg_ids[3:9]))
+        assert archiver.messages == 9
+
+    def test_dropped_connection_while_archiving(self, client, gmail, tmp_path):
+        path = str(tmp_path / "archive.mbox")
+        archiver = Archiver(open_archive(path), batch_bytes=5000)
+        fetch = client.fetch
+        archive_fetches = []
+
+        def dropping(msg_ids, items, *args):
+            if items == archive_module.ARCHIVE_ITEMS:
+                archive_fetches.append(msg_ids)
+                if len(archive_fetches) == 2:
+                    # the first batch of the chunk is written, then the connection drops
+                    client.imap.shutdown()
+            return fetch(msg_ids, items, *args)
+
+        client.fetch = dropping
+        chunk_scheduler = ChunkScheduler(client, 5, sleep=lambda seconds: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=5, archiver=archiver,
+                               chunk_scheduler=chunk_scheduler)
+        archiver.archive.close()
+
+        assert not gmail.messages
+        assert archiver.messages == 12
+        assert sorted(msg["Subject"] for msg in mailbox.mbox(path)) == sorted(f"Message {i}" for i in range(12))
+
+    def test_pipelined_retry_is_not_archived_twice(self, client, gmail, tmp_path):
+        path = str(tmp_path / "archive.mbox")
+        archiver = Archiver(open_archive(path))
+        move_chunks_to_trash = client.move_chunks_to_trash
+        failures = [imaplib.IMAP4.abort("socket error: EOF")]
+
+        def interrupted(chunks, targeted=False):
+            # the first chunk of the window moves, the connection drops before the second
+            for i, gm_msgids in enumerate(move_chunks_to_trash(chunks, targeted)):
+                if i == 1 and failures:
+                    raise failures.pop()
+                yield gm_msgids
+
+        client.move_chunks_to_trash = interrupted
+        client.window = 3
+        chunk_scheduler = ChunkScheduler(client, 2, min_chunk_size=2, sleep=lambda seconds: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=2, archiver=archiver,
+                               chunk_scheduler=chunk_scheduler)
+        archiver.archive.close()
+
+        assert not failures
+        assert not gmail.messages
+        assert archiver.messages == 12
+        assert len(mailbox.mbox(path)) == 12
+        assert not archiver.archived
+
+    @pytest.mark.skipif(archive_module.zstandard is None, reason="zstandard is not installed")
+    def test_zstd(self, tmp_path):
+        path = str(tmp_path / "archive.mbox.zst")
+        archive = open_archive(path, "mbox", "zstd")
+        archive.add(b"Subject: a\n\nbody\n")
+        archive.commit()
+        archive.close()
+        with open(path, "rb") as f:
+            data = archive_module.zstandard.ZstdDecompressor().stream_reader(f).read()
+        assert b"Subject: a" in data
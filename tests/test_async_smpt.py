@@ -0,0 +1,111 @@
+import asyncio
+import re
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import AsyncSMPTClient, MsgIdSet
+
+
+async def scripted_server(commands, replies):
+    """
+    Start a minimal IMAP server answering each command from `replies`, a list of (pattern, untagged lines)
+
+    Untagged lines of None close the connection instead of answering.
+    """
+    async def handle(reader, writer):
+        writer.write(b"* OK ready\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            tag, command = line.decode().rstrip("\r\n").split(" ", 1)
+            commands.append(command)
+            for pattern, untagged in replies:
+                if re.match(pattern, command):
+                    if untagged is None:
+                        writer.close()
+                        return
+                    for data in untagged:
+                        writer.write(b"* " + data + b"\r\n")
+                    break
+            writer.write(f"{tag} OK done\r\n".encode())
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def run_client(replies, action):
+    commands = []
+
+    async def main():
+        server = await scripted_server(commands, replies)
+        port = server.sockets[0].getsockname()[1]
+        client = AsyncSMPTClient("127.0.0.1", port, "me", "pw", use_ssl=False)
+        await client.connect()
+        result = await action(client)
+        await client.close()
+        server.close()
+        return result
+
+    return asyncio.run(main()), commands
+
+
+class TestAsyncSMPTClient:
+
+    def test_get_msg_ids(self):
+        replies = [(r"UID SEARCH", [b"SEARCH 4 2 3"])]
+        msg_ids, commands = run_client(replies, lambda client: client.get_msg_ids("in:unread", "2023-01-01"))
+        assert msg_ids == MsgIdSet([2, 3, 4])
+        assert commands[1] == 'LOGIN "me" "pw"'
+        assert commands[2] == "CAPABILITY"
+        assert commands[4].startswith('UID SEARCH X-GM-RAW "in:unread before:')
+
+    def test_delete_msgs_targeted(self):
+        replies = [
+            (r"CAPABILITY", [b"CAPABILITY IMAP4rev1 UIDPLUS"]),
+            (r"UID FETCH 1:2", [b"1 FETCH (X-GM-MSGID 101 UID 1)", b"2 FETCH (X-GM-MSGID 102 UID 2)"]),
+            (r"UID FETCH 3", [b"3 FETCH (X-GM-MSGID 103 UID 3)"]),
+            (r"UID SEARCH", [b"SEARCH 70 71 72"]),
+        ]
+
+        async def action(client):
+            await client.delete_msgs(MsgIdSet([1, 2, 3]), chunk_size=2, targeted=True)
+
+        _, commands = run_client(replies, action)
+        assert "UID STORE 1:2 +X-GM-LABELS.SILENT \\Trash" in commands
+        assert "UID STORE 3 +X-GM-LABELS.SILENT \\Trash" in commands
+        assert "UID SEARCH OR OR X-GM-MSGID 101 X-GM-MSGID 102 X-GM-MSGID 103" in commands
+        assert "UID EXPUNGE 70:71" in commands
+        assert "UID EXPUNGE 72" in commands
+        assert "EXPUNGE" not in commands
+
+    def test_quoted_search(self):
+        replies = [(r"UID SEARCH", [b"SEARCH 1"])]
+        _, commands = run_client(replies, lambda client: client.get_msg_ids('subject:"a b"', "2023-01-01"))
+        assert commands[4].startswith('UID SEARCH X-GM-RAW "subject:\\"a b\\" before:')
+
+    def test_dropped_connection(self):
+        replies = [(r"UID SEARCH", None)]
+
+        async def action(client):
+            for attempt in range(2):
+                with pytest.raises(RuntimeError):
+                    await asyncio.wait_for(client.get_msg_ids("in:unread", "2023-01-01"), timeout=5)
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(client.imap.command("NOOP"), timeout=5)
+
+        commands = []
+
+        async def main():
+            server = await scripted_server(commands, replies)
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncSMPTClient("127.0.0.1", port, "me", "pw", use_ssl=False)
+            await client.connect()
+            await action(client)
+            await client.imap.close()
+            server.close()
+
+        asyncio.run(main())
+        assert commands.count("NOOP") == 0
@@ -0,0 +1,91 @@
+import contextlib
+import imaplib
+import io
+import sys
+import zlib
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import CommandProfiler, DeflateStream, FakeGmail, FakeGmailServer, SYNC_ITEMS
+from pygmailcleaner.utils.fakegmail import CAPABILITIES
+
+DATE_UNTIL = "2100-01-01"
+
+
+class TestDeflateStream:
+
+    def test_round_trip(self):
+        sender = DeflateStream(None)
+        payload = b"* 1 FETCH (UID 1)\r\n" * 1000 + b"{5}\r\nhello tail\r\n"
+        wire = sender.compress(payload) + sender.flush()
+        assert len(wire) < len(payload) / 10
+        # deliver the compressed bytes in small pieces to exercise buffering
+        pieces = [wire[i:i + 7] for i in range(0, len(wire), 7)]
+        receiver = DeflateStream(lambda size: pieces.pop(0) if pieces else b"")
+        lines = [receiver.readline() for _ in range(1001)]
+        assert lines[0] == b"* 1 FETCH (UID 1)\r\n"
+        assert lines[-1] == b"{5}\r\n"
+        assert receiver.read(5) == b"hello"
+        assert receiver.readline() == b" tail\r\n"
+        assert receiver.readline() == b""
+        assert receiver.wire_bytes_in == len(wire)
+
+    def test_raw_deflate(self):
+        stream = DeflateStream(None)
+        wire = stream.compress(b"a001 NOOP\r\n") + stream.flush()
+        assert zlib.decompressobj(-15).decompress(wire) == b"a001 NOOP\r\n"
+
+
+class TestCompressedClient:
+
+    @pytest.fixture
+    def gmail(self):
+        return FakeGmail().populate(300, seed=2)
+
+    def test_fetch_and_delete(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            plain = connect(server, gmail, compress=False)
+            msg_ids = plain.get_msg_ids("", DATE_UNTIL)
+            expected = list(plain.fetch(msg_ids, SYNC_ITEMS))
+
+            client = connect(server, gmail, compress=True)
+            assert client.imap.deflate is not None
+            assert list(client.fetch(msg_ids, SYNC_ITEMS)) == expected
+            assert client.imap.deflate.wire_bytes_in * 4 < client.imap.deflate.bytes_in
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.delete_msgs(client.get_msg_ids("category:promotions", DATE_UNTIL), chunk_size=50)
+            assert len(client.get_msg_ids("category:promotions", DATE_UNTIL)) == 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.close()
+
+    def test_profiled_wire_bytes(self, gmail, connect):
+        profiler = CommandProfiler()
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail, compress=True, profiler=profiler)
+            msg_ids = client.get_msg_ids("", DATE_UNTIL)
+            wire_in, wire_out = client.imap.deflate.wire_bytes_in, client.imap.deflate.wire_bytes_out
+            list(client.fetch(msg_ids, SYNC_ITEMS))
+            deflate = client.imap.deflate
+        commands = {command["command"]: command for command in profiler.report()["commands"]}
+        fetch = commands["UID FETCH"]
+        assert fetch["bytes_received"] == deflate.wire_bytes_in - wire_in
+        assert fetch["bytes_sent"] == deflate.wire_bytes_out - wire_out
+        assert fetch["bytes_received"] * 4 < deflate.bytes_in
+        assert commands["LOGIN"]["bytes_sent"] > len(gmail.password)
+
+    def test_compress_advertised_after_login(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            imap = imaplib.IMAP4(server.host, server.port)
+            assert "COMPRESS=DEFLATE" not in imap.capabilities
+            imap.logout()
+            client = connect(server, gmail, compress=True)
+            assert client.imap.deflate is not None
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 300
+
+    def test_server_without_compress(self, gmail, connect):
+        capabilities = CAPABILITIES.replace("COMPRESS=DEFLATE ", "")
+        with FakeGmailServer(gmail, capabilities=capabilities) as server:
+            client = connect(server, gmail, compress=True)
+            assert getattr(client.imap, "deflate", None) is None
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 300
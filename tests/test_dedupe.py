@@ -0,0 +1,56 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import DuplicateIndex, FakeGmail, header_key
+from pygmailcleaner.utils.fakegmail import ALL_MAIL
+
+DATE_UNTIL = "2100-01-01"
+DATE = 1700000000
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail()
+    for copy in range(3):
+        gmail.add_message(subject="Newsletter", date=DATE, message_id="<news@example.com>", body_seed=1)
+    gmail.add_message(subject="Cross-post", date=DATE, message_id="<post@example.com>", body_seed=2)
+    gmail.add_message(subject="Cross-post", date=DATE, message_id="<post@example.com>", body_seed=2)
+    # same headers and size, different body
+    gmail.add_message(subject="Edited", date=DATE, message_id="<edit@example.com>", body_seed=3)
+    gmail.add_message(subject="Edited", date=DATE, message_id="<edit@example.com>", body_seed=4)
+    gmail.add_message(subject="Unique", date=DATE)
+    return gmail
+
+
+class TestDuplicateIndex:
+
+    def test_header_key_normalization(self):
+        a = header_key(b"Subject: Hello\r\n  world\r\nFrom: a@example.com\r\n\r\n", 10)
+        b = header_key(b"from: a@example.com\nSubject:   Hello world\n", 10)
+        assert a == b
+        assert a != header_key(b"from: a@example.com\nSubject:   Hello world\n", 11)
+
+    def test_redundant(self, client, gmail):
+        msg_ids = client.get_msg_ids("", DATE_UNTIL)
+        duplicates = DuplicateIndex.build(client, msg_ids, batch_size=2, batch_bytes=1500)
+        redundant = duplicates.redundant()
+        folder = gmail.folder(ALL_MAIL)
+        assert sorted(folder.by_uid[uid].subject for uid in redundant) == ["Cross-post", "Newsletter", "Newsletter"]
+        assert min(msg_ids) not in redundant
+        stats = duplicates.stats()
+        assert stats["scanned"] == 8
+        assert stats["candidates"] == 7
+        assert stats["groups"] == 2
+        assert stats["redundant"] == 3
+        assert stats["bytes"] == sum(folder.by_uid[uid].size for uid in redundant)
+        duplicates.close()
+
+    def test_reused_file(self, client, tmp_path):
+        path = str(tmp_path / "dedupe.sqlite")
+        msg_ids = client.get_msg_ids("", DATE_UNTIL)
+        DuplicateIndex.build(client, msg_ids, path=path).close()
+        duplicates = DuplicateIndex.build(client, msg_ids[:3], path=path)
+        assert duplicates.stats()["scanned"] == 3
+        assert len(duplicates.redundant()) == 2
+        duplicates.close()
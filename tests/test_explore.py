@@ -0,0 +1,63 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import (
+    FakeGmail,
+    TermSets,
+    METHODS,
+    MsgIdSet,
+    Unread,
+    Important,
+    Attachment,
+    Category,
+)
+from pygmailcleaner.main import get_cumulative_query, print_count_matrix
+
+DATE_UNTIL = "2100-01-01"
+
+
+@pytest.fixture
+def gmail():
+    return FakeGmail().populate(400, seed=5)
+
+
+class TestTermSets:
+
+    def test_local_algebra(self):
+        term_sets = TermSets(
+            MsgIdSet(range(1, 11)),
+            {Unread(): MsgIdSet([1, 2, 3, 4]), Important(): MsgIdSet([3, 4, 5])},
+        )
+        assert term_sets.evaluate(Unread() & ~Important()) == MsgIdSet([1, 2])
+        assert term_sets.evaluate(Unread() | Important()) == MsgIdSet([1, 2, 3, 4, 5])
+        assert term_sets.count(~(Unread() | Important())) == 5
+        assert term_sets.count(None) == 10
+        assert term_sets.overlaps()[(Unread(), Important())] == 2
+        with pytest.raises(KeyError):
+            term_sets.evaluate(Attachment())
+
+    def test_count_matrix_matches_server(self, client):
+        searches = []
+        get_msg_ids = client.get_msg_ids
+        client.get_msg_ids = lambda method, date_until: searches.append(method) or get_msg_ids(method, date_until)
+        term_sets = TermSets.search(client, [method["y_query"] for method in METHODS], DATE_UNTIL)
+        rows = term_sets.count_matrix(METHODS)
+        client.get_msg_ids = get_msg_ids
+
+        assert len(searches) == 1 + len(METHODS)
+        assert len(rows) == 2 ** len(METHODS)
+        assert sum(1 for row in rows if row["count"]) > 1
+        for row in rows:
+            methods = [{**method, "response": row["responses"][method["description"]]} for method in METHODS]
+            query = get_cumulative_query(methods)
+            assert row["count"] == len(client.get_msg_ids(query, DATE_UNTIL))
+
+    def test_print_count_matrix(self, capsys):
+        term_sets = TermSets(MsgIdSet([1, 2, 3]), {Category("promotions"): MsgIdSet([1])})
+        rows = term_sets.count_matrix(METHODS[:1])
+        print_count_matrix(term_sets, rows)
+        output = capsys.readouterr().out
+        assert "category:promotions: 1" in output
+        assert "  1   y  1" in output
+        assert "  2   n  3" in output
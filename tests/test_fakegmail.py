@@ -0,0 +1,117 @@
+import asyncio
+import contextlib
+import io
+import imaplib
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import (
+    SMPTClient,
+    SMPTClientPool,
+    AsyncSMPTClient,
+    HeaderIndex,
+    FakeGmail,
+    FakeGmailServer,
+    compile_gm_raw,
+    TRASH_FOLDER,
+)
+
+DATE_UNTIL = "2100-01-01"
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail()
+    gmail.add_message(sender="deals@shop.com", subject="Sale", category="promotions")
+    gmail.add_message(sender="deals@shop.com", subject="Sale 2", category="promotions", labels=("\\Important",))
+    gmail.add_message(sender="friend@mail.com", subject="Hi", flags=("\\Seen",), attachment=True)
+    gmail.add_message(sender="old@trash.com", subject="Already trashed", labels=("\\Trash",))
+    return gmail
+
+
+@pytest.fixture
+def server(gmail):
+    with FakeGmailServer(gmail) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server, gmail):
+    client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.connect()
+    yield client
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.close()
+
+
+class TestGmRaw:
+
+    def test_compile_gm_raw(self, gmail):
+        messages = sorted(gmail.messages.values(), key=lambda msg: msg.gm_msgid)
+        matches = lambda query: [msg.subject for msg in messages if compile_gm_raw(query)(msg)]
+        assert matches("category:promotions") == ["Sale", "Sale 2"]
+        assert matches("category:promotions NOT is: important") == ["Sale"]
+        assert matches("in:unread -has:attachment") == ["Sale", "Sale 2", "Already trashed"]
+        assert matches("{from:friend from:old}") == ["Hi", "Already trashed"]
+
+
+class TestFakeGmailServer:
+
+    def test_search_and_status(self, client):
+        assert len(client.get_msg_ids("", DATE_UNTIL)) == 3
+        assert len(client.get_msg_ids("category:promotions", DATE_UNTIL)) == 2
+        assert client.count_search("in:unread", DATE_UNTIL) == 2
+        assert client.get_status(items=("MESSAGES", "UNSEEN")) == {"MESSAGES": 3, "UNSEEN": 2}
+
+    def test_extensions_advertised_after_login(self, server, gmail, client):
+        preauth = imaplib.IMAP4(server.host, server.port)
+        assert "UIDPLUS" not in preauth.capabilities
+        preauth.shutdown()
+        assert {"UIDPLUS", "CONDSTORE", "ESEARCH", "COMPRESS=DEFLATE"} <= set(client.imap.capabilities)
+
+    def test_wrong_password(self, server, gmail):
+        client = SMPTClient(server.host, server.port, gmail.user, "wrong", use_ssl=False)
+        with pytest.raises(ConnectionError):
+            client.connect()
+
+    def test_delete_msgs_empties_trash(self, client, gmail):
+        client.delete_msgs(client.get_msg_ids("category:promotions", DATE_UNTIL))
+        assert sorted(msg.subject for msg in gmail.messages.values()) == ["Hi"]
+
+    def test_delete_msgs_targeted_keeps_trash(self, client, gmail):
+        client.delete_msgs(client.get_msg_ids("category:promotions", DATE_UNTIL), targeted=True)
+        assert sorted(msg.subject for msg in gmail.messages.values()) == ["Already trashed", "Hi"]
+        assert client.get_status(TRASH_FOLDER, ("MESSAGES",)) == {"MESSAGES": 1}
+
+    def test_pool_delete(self, server, gmail):
+        gmail.populate(200, seed=3)
+        pool = SMPTClientPool(server.host, server.port, gmail.user, gmail.password, size=3, use_ssl=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool.connect()
+            msg_ids = pool.clients[0].get_msg_ids("", DATE_UNTIL)
+            pool.delete_msgs(msg_ids, chunk_size=20, targeted=True)
+            pool.close()
+        assert [msg.subject for msg in gmail.messages.values()] == ["Already trashed"]
+
+    def test_index_sync(self, client, gmail, tmp_path):
+        index = HeaderIndex(str(tmp_path / "index.sqlite"))
+        assert index.sync(client)["new"] == 3
+        gmail.add_message(sender="new@mail.com", subject="New")
+        client.imap.uid("STORE", "1", "+FLAGS", "\\Seen")
+        assert index.sync(client) == {"new": 1, "updated": 1, "removed": 0}
+        assert [row["subject"] for row in index.rows()] == ["Sale", "Sale 2", "Hi", "New"]
+        index.close()
+
+    def test_async_client(self, server, gmail):
+        async def run():
+            client = AsyncSMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False)
+            await client.connect()
+            msg_ids = await client.get_msg_ids("category:promotions", DATE_UNTIL)
+            await client.delete_msgs(msg_ids, chunk_size=1, targeted=True)
+            await client.close()
+            return msg_ids
+
+        assert len(asyncio.run(run())) == 2
+        assert sorted(msg.subject for msg in gmail.messages.values()) == ["Already trashed", "Hi"]
@@ -0,0 +1,101 @@
+import sys
+import pytest # type: ignore
+from unittest.mock import Mock
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, HeaderIndex, MsgIdSet, parse_headers
+
+HEADERS = (
+    b"From: Shop <deals@shop.com>\r\n"
+    b"Subject: Big sale\r\n"
+    b"Date: Mon, 01 Jan 2024 10:00:00 +0000\r\n\r\n"
+)
+
+
+def fetch_data(uids):
+    data = []
+    for uid in uids:
+        data.append((
+            f'{uid} (UID {uid} X-GM-MSGID {1000 + uid} RFC822.SIZE {uid * 10} '
+            f'X-GM-LABELS ("\\\\Inbox") FLAGS (\\Seen) BODY[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)] {{{len(HEADERS)}}}'.encode(),
+            HEADERS,
+        ))
+        data.append(b")")
+    return data
+
+
+class FakeMailbox:
+    def __init__(self, uids, uidvalidity=1):
+        self.uids = list(uids)
+        self.uidvalidity = uidvalidity
+        self.commands = []
+
+    def status(self, folder, items):
+        return "OK", [
+            f'"folder" (MESSAGES {len(self.uids)} UIDVALIDITY {self.uidvalidity} '
+            f"UIDNEXT {max(self.uids, default=0) + 1})".encode()
+        ]
+
+    def uid(self, command, *args):
+        self.commands.append((command,) + args)
+        if command == "SEARCH":
+            if args[0] == "ALL":
+                return "OK", [" ".join(map(str, self.uids)).encode()]
+            start = int(args[1].split(":")[0])
+            return "OK", [" ".join(str(u) for u in self.uids if u >= start).encode()]
+        if command == "FETCH":
+            return "OK", fetch_data(MsgIdSet.from_string(args[0]))
+        return "OK", [None]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = HeaderIndex(str(tmp_path / "index.sqlite"))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def client():
+    client = SMPTClient("imap.gmail.com", 993, "test@gmail.com", "pw")
+    client.imap = Mock()
+    client.imap.capabilities = ("IMAP4REV1",)
+    return client
+
+
+class TestHeaderIndex:
+
+    def test_parse_headers(self):
+        headers = parse_headers(HEADERS)
+        assert headers["sender_address"] == "deals@shop.com"
+        assert headers["subject"] == "Big sale"
+        assert headers["date"] == 1704103200
+
+    def test_incremental_sync(self, index, client):
+        mailbox = FakeMailbox([1, 2, 3])
+        client.imap.status.side_effect = mailbox.status
+        client.imap.uid.side_effect = mailbox.uid
+
+        assert index.sync(client)["new"] == 3
+        rows = list(index.rows())
+        assert [row["uid"] for row in rows] == [1, 2, 3]
+        assert rows[0]["labels"] == ["\\Inbox"]
+        assert rows[2]["size"] == 30
+
+        mailbox.uids = [2, 3, 4]
+        mailbox.commands = []
+        summary = index.sync(client)
+        assert summary == {"new": 1, "updated": 0, "removed": 1}
+        fetched = [c[1] for c in mailbox.commands if c[0] == "FETCH"]
+        assert fetched == ["4"]
+        assert list(index.uids()) == [2, 3, 4]
+
+    def test_uidvalidity_change_rebuilds(self, index, client):
+        mailbox = FakeMailbox([1, 2])
+        client.imap.status.side_effect = mailbox.status
+        client.imap.uid.side_effect = mailbox.uid
+        index.sync(client)
+
+        mailbox.uidvalidity = 2
+        assert index.sync(client)["new"] == 2
+        assert index.get_state()["uidvalidity"] == 2
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import DeleteJournal, ChunkScheduler, FakeGmail, MsgIdSet
+
+DATE_UNTIL = "2100-01-01"
+
+
+@pytest.fixture
+def gmail():
+    return FakeGmail().populate(40)
+
+
+class TestDeleteJournal:
+
+    def test_replay(self, tmp_path):
+        path = str(tmp_path / "journal.jsonl")
+        journal = DeleteJournal(path)
+        assert journal.start(MsgIdSet(range(1, 11))) == MsgIdSet(range(1, 11))
+        journal.record_moved("1:4", [101, 102])
+        with open(path, "a") as f:
+            f.write('{"moved": "5:')  # cut short by a crash
+
+        resumed = DeleteJournal(path)
+        assert resumed.moved == MsgIdSet(range(1, 5))
+        assert resumed.gm_msgids == [101, 102]
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert resumed.start(MsgIdSet([7, 8, 12])) == MsgIdSet([5, 6, 7, 8, 9, 10, 12])
+        resumed.finish()
+        assert DeleteJournal(path).planned == MsgIdSet()
+
+    def test_key_depends_on_search(self, client, tmp_path):
+        first = DeleteJournal.for_search(client, "a", str(tmp_path))
+        second = DeleteJournal.for_search(client, "b", str(tmp_path))
+        assert first.path != second.path
+        assert first.path == DeleteJournal.for_search(client, "a", str(tmp_path)).path
+
+    def test_resume_interrupted_delete(self, client, gmail, tmp_path):
+        msg_ids = client.get_msg_ids("", DATE_UNTIL)
+        journal = DeleteJournal.for_search(client, "everything", str(tmp_path))
+        move_chunks_to_trash = client.move_chunks_to_trash
+        stored = []
+
+        def interrupted(chunks, targeted=False):
+            # two chunks reach the server, then the connection stays down until the retries run out
+            sent = chunks[:max(0, 2 - len(stored))]
+            for chunk, gm_msgids in zip(sent, move_chunks_to_trash(sent, targeted)):
+                stored.append(chunk)
+                yield gm_msgids
+            raise ConnectionError("connection dropped")
+
+        def recorded(chunks, targeted=False):
+            stored.extend(chunks)
+            return move_chunks_to_trash(chunks, targeted)
+
+        client.move_chunks_to_trash = interrupted
+        chunk_scheduler = ChunkScheduler(client, 10, min_chunk_size=10, max_retries=2, sleep=lambda seconds: None)
+        with contextlib.redirect_stdout(io.StringIO()), pytest.raises(RuntimeError, match="connection dropped"):
+            client.delete_msgs(msg_ids, chunk_size=10, targeted=True, journal=journal,
+                               chunk_scheduler=chunk_scheduler)
+        assert len(stored) == 2
+
+        client.move_chunks_to_trash = recorded
+        client.imap.select(client.folder)
+        journal = DeleteJournal.for_search(client, "everything", str(tmp_path))
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete_msgs(client.get_msg_ids("", DATE_UNTIL), chunk_size=10, targeted=True, journal=journal)
+
+        assert len(stored) == 4
+        assert len(MsgIdSet.from_string(",".join(stored))) == len(msg_ids)
+        assert not gmail.messages
+        assert not list(tmp_path.iterdir())
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import sys
+import time
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import CommandProfiler, FakeGmail, FakeGmailServer, uid_pipeline
+
+DATE_UNTIL = "2100-01-01"
+RTT = 0.05
+
+
+@pytest.fixture
+def gmail():
+    return FakeGmail().populate(80)
+
+
+class TestPipeline:
+
+    def test_responses_in_order(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            msg_ids = client.get_msg_ids("", DATE_UNTIL)
+            commands = [("FETCH", chunk, "(UID RFC822.SIZE)") for chunk, count in msg_ids.chunks(7)]
+            commands.insert(3, ("SEARCH", "ALL"))
+            responses = list(uid_pipeline(client.imap, commands, window=4))
+            assert [typ for typ, data in responses] == ["OK"] * len(commands)
+            assert responses[3][1] == [" ".join(str(uid) for uid in msg_ids).encode()]
+            fetched = [item["UID"] for item in client.fetch(msg_ids, "(UID RFC822.SIZE)", 7)]
+            assert fetched == list(msg_ids)
+
+    def test_abandoned_pipeline_is_drained(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            msg_ids = client.get_msg_ids("", DATE_UNTIL)
+            responses = uid_pipeline(client.imap, [("FETCH", chunk, "(UID)") for chunk, count in msg_ids.chunks(5)])
+            next(responses)
+            responses.close()
+            assert client.get_msg_ids("", DATE_UNTIL) == msg_ids
+
+    def test_overlaps_round_trips(self, gmail, connect):
+        with FakeGmailServer(gmail, rtt=RTT) as server:
+            timings = {}
+            for window in (1, 16):
+                client = connect(server, gmail, window=window)
+                msg_ids = client.get_msg_ids("", DATE_UNTIL)
+                started = time.perf_counter()
+                assert len(list(client.fetch(msg_ids, "(UID RFC822.SIZE)", 8))) == len(msg_ids)
+                timings[window] = time.perf_counter() - started
+            assert timings[1] >= 10 * RTT
+            assert timings[16] < timings[1] / 3
+
+    def test_delete_overlaps_chunks(self, connect):
+        timings = {}
+        for window in (1, 16):
+            gmail = FakeGmail().populate(80)
+            with FakeGmailServer(gmail, rtt=RTT) as server:
+                client = connect(server, gmail, window=window)
+                msg_ids = client.get_msg_ids("", DATE_UNTIL)
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client.delete_msgs(msg_ids, chunk_size=8, targeted=True)
+                timings[window] = time.perf_counter() - started
+                assert not gmail.messages
+        assert timings[16] < timings[1] / 2
+
+    def test_pipelined_commands_are_profiled(self, gmail, connect):
+        profiler = CommandProfiler()
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail, profiler=profiler)
+            msg_ids = client.get_msg_ids("", DATE_UNTIL)
+            list(client.fetch(msg_ids, "(UID RFC822.SIZE)", 10))
+        commands = {command["command"]: command for command in profiler.report()["commands"]}
+        assert commands["UID FETCH"]["count"] == 8
+        assert commands["UID FETCH"]["bytes_received"] > 80 * len("RFC822.SIZE")
@@ -0,0 +1,49 @@
+import sys
+import pytest # type: ignore
+from unittest.mock import MagicMock, patch
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClientPool, MsgIdSet
+
+SERVER = "imap.gmail.com"
+PORT = 993
+USER = "test@gmail.com"
+PASSWORD = "testpassword"
+
+
+@pytest.fixture
+def imaplib_mock():
+    with patch("imaplib.IMAP4_SSL") as mock:
+        def connection(*args):
+            imap = MagicMock()
+            imap.uid.return_value = ("OK", [None])
+            return imap
+
+        mock.side_effect = connection
+        yield mock
+
+
+class TestSMPTClientPool:
+
+    def test_size_is_capped(self):
+        pool = SMPTClientPool(SERVER, PORT, USER, PASSWORD, size=50, max_connections=3)
+        assert pool.size == 3
+
+    def test_connect(self, imaplib_mock):
+        pool = SMPTClientPool(SERVER, PORT, USER, PASSWORD, size=3)
+        pool.connect()
+        assert imaplib_mock.call_count == 3
+        assert len({id(client.imap) for client in pool.clients}) == 3
+
+    def test_delete_msgs_splits_chunks(self, imaplib_mock):
+        pool = SMPTClientPool(SERVER, PORT, USER, PASSWORD, size=2)
+        pool.connect()
+        pool.delete_msgs(MsgIdSet(range(1, 11)), chunk_size=3)
+        stored = sorted(
+            c.args[1]
+            for client in pool.clients
+            for c in client.imap.uid.call_args_list
+        )
+        assert stored == ["10", "1:3", "4:6", "7:9"]
+        expunges = sum(client.imap.expunge.call_count for client in pool.clients)
+        assert expunges == 1
@@ -0,0 +1,45 @@
+import contextlib
+import io
+import json
+import sys
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, CommandProfiler, FakeGmail, FakeGmailServer
+
+
+class TestCommandProfiler:
+
+    def test_record_and_export(self, tmp_path):
+        profiler = CommandProfiler()
+        profiler.record("UID STORE", 0.02, 100, 50)
+        profiler.record("UID STORE", 0.2, 100, 5000)
+        profiler.record("SELECT", 0.001, 20, 300)
+
+        report = profiler.report()
+        assert [command["command"] for command in report["commands"]] == ["UID STORE", "SELECT"]
+        store = report["commands"][0]
+        assert store["count"] == 2
+        assert store["bytes_received"] == 5050
+        assert store["max_response_bytes"] == 5000
+
+        text = profiler.prometheus()
+        assert 'pygmailcleaner_imap_command_seconds_bucket{command="UID STORE",le="0.025"} 1' in text
+        assert 'pygmailcleaner_imap_command_seconds_bucket{command="UID STORE",le="+Inf"} 2' in text
+        assert 'pygmailcleaner_imap_bytes_sent_total{command="SELECT"} 20' in text
+
+        profiler.write_json(str(tmp_path / "profile.json"))
+        assert json.loads((tmp_path / "profile.json").read_text())["commands"][1]["command"] == "SELECT"
+
+    def test_profiled_client(self):
+        gmail = FakeGmail().populate(50)
+        profiler = CommandProfiler()
+        with FakeGmailServer(gmail) as server:
+            client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False, profiler=profiler)
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.connect()
+                client.get_msg_ids("", "2100-01-01")
+                client.close()
+        commands = {command["command"]: command for command in profiler.report()["commands"]}
+        assert {"LOGIN", "SELECT", "UID SEARCH", "CLOSE"} <= set(commands)
+        assert commands["UID SEARCH"]["bytes_received"] > 100
+        assert commands["UID SEARCH"]["bytes_sent"] > 0
@@ -0,0 +1,34 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import ResponseParser, format_command, quote
+
+
+class TestResponseParser:
+
+    def test_tagged_and_untagged(self):
+        parser = ResponseParser()
+        responses = parser.feed(b"* SEARCH 1 2 3\r\nA0001 OK SEARCH completed\r\n")
+        assert [r.tag for r in responses] == ["*", "A0001"]
+        assert responses[0].split() == ("SEARCH", b"1 2 3")
+        assert responses[1].status == "OK"
+
+    def test_literal_split_across_reads(self):
+        parser = ResponseParser()
+        assert parser.feed(b"* 1 FETCH (UID 5 BODY[] {10}\r\nhello") == []
+        responses = parser.feed(b"\r\nyou)\r\n")
+        assert len(responses) == 1
+        assert responses[0].literals == [b"hello\r\nyou"]
+        assert responses[0].to_imaplib() == [(b"1 (UID 5 BODY[] {10}", b"hello\r\nyou"), b")"]
+
+    def test_numbered_response(self):
+        response = ResponseParser().feed(b"* 3 EXISTS\r\n")[0]
+        assert response.split() == ("EXISTS", b"3")
+
+    def test_unexpected_response(self):
+        with pytest.raises(ValueError):
+            ResponseParser().feed(b"garbage\r\n")
+
+    def test_format_command(self):
+        assert format_command("A1", "LOGIN", quote("me"), quote('p"w')) == b'A1 LOGIN "me" "p\\"w"\r\n'
@@ -0,0 +1,171 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import (
+    HeaderIndex,
+    FakeGmail,
+    FakeGmailServer,
+    METHODS,
+    QueryError,
+    Category,
+    Unread,
+    Important,
+    Attachment,
+    From,
+    Subject,
+    Before,
+    Larger,
+    And,
+    Or,
+    Not,
+    sender_query,
+    pack_or,
+    resolve_methods,
+    index_path,
+)
+from pygmailcleaner.utils.fakegmail import CAPABILITIES
+from pygmailcleaner.main import get_cumulative_search_term, get_cumulative_query, search_msg_ids
+
+DATE_UNTIL = "2100-01-01"
+
+MESSAGE = {
+    "sender": "Shop <deals@shop.com>",
+    "subject": "Big sale",
+    "date": 1704103200,
+    "received": 1704103200,
+    "size": 5000,
+    "labels": ["\\Inbox", "\\Important"],
+    "flags": [],
+    "content_type": "multipart/mixed",
+}
+
+
+class TestQuery:
+
+    def test_methods_search_term(self):
+        assert get_cumulative_search_term(METHODS) == "category:promotions NOT is:important NOT has:attachment"
+
+    def test_to_gm_raw(self):
+        assert Or(From("a@shop.com"), From("b@news.org")).to_gm_raw() == "{from:a@shop.com from:b@news.org}"
+        assert (Subject("big sale") & Larger(1000)).to_gm_raw() == 'subject:"big sale" larger:1000'
+        assert Not(Unread() & Important()).to_gm_raw() == "NOT (is:unread is:important)"
+        assert Or(Unread(), Important() & Attachment()).to_gm_raw() == "{is:unread (is:important has:attachment)}"
+
+    def test_to_imap(self):
+        assert And(Unread(), Not(Important()), From("a@shop.com")).to_imap() == [
+            "UNSEEN", "NOT", "KEYWORD", "$Important", "FROM", '"a@shop.com"'
+        ]
+        assert Or(Unread(), Larger(10), Subject("x")).to_imap() == [
+            "OR", "UNSEEN", "OR", "LARGER", "10", "SUBJECT", '"x"'
+        ]
+        assert Not(Unread() & Larger(10)).to_imap() == ["NOT", "(UNSEEN LARGER 10)"]
+        assert Before("2024-03-05").to_imap() == ["BEFORE", "5-Mar-2024"]
+        assert And().to_imap() == ["ALL"]
+        with pytest.raises(QueryError):
+            Category("promotions").to_imap()
+
+    def test_matches(self):
+        assert (From("deals@shop") & Subject("SALE") & Larger(4000)).matches(MESSAGE)
+        assert not Unread().matches({**MESSAGE, "flags": ["\\Seen"]})
+        assert Important().matches(MESSAGE)
+        assert Before("2024-01-02").matches(MESSAGE) and not Before("2023-12-31").matches(MESSAGE)
+        assert Category("promotions").matches({**MESSAGE, "category": "promotions"})
+        # what the index cannot evaluate exactly is left to the server
+        with pytest.raises(QueryError):
+            Category("promotions").matches(MESSAGE)
+        with pytest.raises(QueryError):
+            Attachment().matches(MESSAGE)
+        with pytest.raises(QueryError):
+            Before("2024-01-02").matches({**MESSAGE, "received": None})
+
+    def test_equality_and_terms(self):
+        query = (Unread() | From("a")) & Not(Unread())
+        assert Unread() == Unread() and From("a") != From("b")
+        assert len({Unread(), Unread(), From("a")}) == 2
+        assert query.terms() == [Unread(), From("a")]
+
+
+class TestSenderQueries:
+
+    def test_sender_query(self):
+        assert sender_query("News@Example.com ") == From("news@example.com")
+        assert sender_query("example.com") == From("@example.com")
+        assert sender_query("*@example.com") == From("@example.com")
+        assert sender_query("@example.com").matches({"sender": "Shop <deals@example.com>"})
+        assert not sender_query("example.com").matches({"sender": "deals@notexample.com"})
+
+    def test_pack_or(self):
+        queries = [From(f"sender{i}@example.com") for i in range(300)] + [From("sender0@example.com")]
+        groups = pack_or(queries, max_length=500)
+        assert 1 < len(groups) < 30
+        assert all(len(group.to_gm_raw()) <= 500 for group in groups)
+        assert [query for group in groups for query in group.queries] == queries[:300]
+        assert pack_or([From("a@example.com")]) == [Or(From("a@example.com"))]
+        assert pack_or([]) == []
+
+
+class TestQueryAgainstServer:
+
+    @pytest.fixture
+    def gmail(self):
+        return FakeGmail().populate(300, seed=3)
+
+    def test_imap_matches_gm_raw(self, gmail, connect):
+        query = Not(Important()) & Or(Unread(), Attachment()) & Larger(5000)
+        with FakeGmailServer(gmail) as server:
+            gm_raw = connect(server, gmail).get_msg_ids(query, DATE_UNTIL)
+        with FakeGmailServer(gmail, capabilities=CAPABILITIES.replace("X-GM-EXT-1 ", "")) as server:
+            imap = connect(server, gmail).get_msg_ids(query, DATE_UNTIL)
+        assert len(gm_raw) > 0
+        assert gm_raw == imap
+
+    def test_rule_filters_without_gmail_extensions(self, gmail, connect):
+        query = get_cumulative_query(resolve_methods({"Only include promotions": "n"}))
+        with FakeGmailServer(gmail) as server:
+            gm_raw = connect(server, gmail).get_msg_ids(query, DATE_UNTIL)
+        with FakeGmailServer(gmail, capabilities=CAPABILITIES.replace("X-GM-EXT-1 ", "")) as server:
+            client = connect(server, gmail)
+            assert client.get_msg_ids(query, DATE_UNTIL) == gm_raw
+            with pytest.raises(QueryError, match="does not support Gmail search, category:promotions"):
+                client.get_msg_ids(get_cumulative_query(resolve_methods({})), DATE_UNTIL)
+
+    def test_search_msg_ids_from_index(self, gmail, connect, tmp_path, monkeypatch):
+        monkeypatch.setattr("pygmailcleaner.utils.index.INDEX_DIR", str(tmp_path))
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            index = HeaderIndex(index_path(client.user))
+            index.sync(client)
+            index.close()
+            query = Not(Important()) & Unread()
+            local = search_msg_ids(client, query, "2024-06-01", use_index=True)
+            assert len(local) > 0
+            assert local == client.get_msg_ids(query, "2024-06-01")
+            # categories and attachments are not indexed, the server is searched instead
+            for query in (Category("promotions"), Not(Attachment())):
+                assert search_msg_ids(client, query, DATE_UNTIL, use_index=True) == client.get_msg_ids(query, DATE_UNTIL)
+
+    def test_local_refinement(self, gmail, connect, tmp_path):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            index = HeaderIndex(str(tmp_path / "index.sqlite"))
+            index.sync(client)
+            base = client.get_msg_ids(Category("promotions"), DATE_UNTIL)
+            refinement = Not(Important()) & Unread() & Larger(2000)
+            local = index.search(refinement, uids=base)
+            server_side = client.get_msg_ids(Category("promotions") & refinement, DATE_UNTIL)
+        assert len(local) > 0
+        assert local == server_side
+
+    def test_get_msg_ids_any(self, gmail, connect):
+        senders = sorted({msg.sender for msg in gmail.messages.values()})
+        domains = sorted({sender.rsplit("@", 1)[1] for sender in senders})
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            expected = client.get_msg_ids("", DATE_UNTIL)
+            searches = []
+            search = client._search_command
+            client._search_command = lambda method, date: searches.append(method) or search(method, date)
+            assert client.get_msg_ids_any([From(sender) for sender in senders], DATE_UNTIL, max_length=1000) == expected
+            assert 1 < len(searches) < len(senders) / 5
+            assert client.get_msg_ids_any([sender_query(f"*@{domain}") for domain in domains], DATE_UNTIL) == expected
@@ -0,0 +1,120 @@
+import contextlib
+import io
+import sys
+from unittest.mock import Mock
+
+sys.path.append("./")
+from pygmailcleaner.utils import (
+    SMPTClient, SpaceSaving, MsgIdSet, top_senders, impact_report, largest_messages, has_attachment,
+    FakeGmail, FakeGmailServer,
+)
+
+
+def sender_fetch(senders):
+    def uid(command, chunk, items):
+        data = []
+        for uid in MsgIdSet.from_string(chunk):
+            header = f"From: {senders[uid]}\r\n\r\n".encode()
+            data.append((
+                f"{uid} (UID {uid} RFC822.SIZE {uid * 100} BODY[HEADER.FIELDS (FROM)] {{{len(header)}}}".encode(),
+                header,
+            ))
+            data.append(b")")
+        return "OK", data
+    return uid
+
+
+class TestSpaceSaving:
+
+    def test_exact_when_under_capacity(self):
+        counter = SpaceSaving(capacity=10)
+        for key in "aababcabcd":
+            counter.add(key, weight=1)
+        assert [(t["key"], t["count"]) for t in counter.top(2)] == [("a", 4), ("b", 3)]
+
+    def test_heavy_hitter_survives_eviction(self):
+        counter = SpaceSaving(capacity=3)
+        for i in range(1000):
+            counter.add("heavy")
+            counter.add(f"noise{i}")
+        assert len(counter) == 3
+        top = counter.top(1)[0]
+        assert top["key"] == "heavy"
+        assert top["count"] - top["error"] <= 1000 <= top["count"]
+
+    def test_weighted_by_bytes(self):
+        counter = SpaceSaving(capacity=3)
+        for i in range(1000):
+            counter.add(f"noise{i}", weight=1, count=10)
+            if i % 10 == 0:
+                counter.add("large", weight=1, count=1000)
+        top = counter.top(1)[0]
+        assert top["key"] == "large"
+        assert top["count"] - top["error"] <= 100 * 1000 <= top["count"]
+
+
+class TestTopSenders:
+
+    def test_top_senders(self):
+        senders = {1: "a@x.com", 2: "B <b@y.com>", 3: "a@x.com", 4: "b@y.com", 5: "a@x.com"}
+        client = SMPTClient("imap.gmail.com", 993, "test@gmail.com", "pw")
+        client.imap = Mock()
+        client.imap.uid.side_effect = sender_fetch(senders)
+        top = top_senders(client, MsgIdSet(senders), k=2, chunk_size=2)
+        assert [(t["sender"], t["count"], t["bytes"]) for t in top] == [
+            ("a@x.com", 3, 900),
+            ("b@y.com", 2, 600),
+        ]
+        top = top_senders(client, MsgIdSet(senders), k=1, by="bytes")[0]
+        assert (top["sender"], top["count"], top["bytes"], top["error"]) == ("a@x.com", 3, 900, 0)
+
+
+class TestImpactReport:
+
+    def test_impact_report(self):
+        sizes = {1: 2048, 2: 50 * 1024, 3: 20 * 1024 * 1024}
+
+        def uid(command, chunk, items):
+            data = [
+                f'{uid} (UID {uid} RFC822.SIZE {sizes[uid]} X-GM-LABELS ("\\\\Inbox" Receipts))'.encode()
+                for uid in MsgIdSet.from_string(chunk)
+            ]
+            return "OK", data
+
+        client = SMPTClient("imap.gmail.com", 993, "test@gmail.com", "pw")
+        client.imap = Mock()
+        client.imap.uid.side_effect = uid
+        client.get_msg_ids = Mock(return_value=MsgIdSet([2, 3, 9]))
+        report = impact_report(client, MsgIdSet(sizes), {"Only include promotions": "category:promotions"}, "2024-01-01")
+        assert report["messages"] == 3
+        assert report["bytes"] == sum(sizes.values())
+        assert [bucket["count"] for bucket in report["histogram"]] == [1, 1, 0, 0, 1]
+        assert report["labels"]["Receipts"] == {"count": 3, "bytes": sum(sizes.values())}
+        assert report["filters"] == {"Only include promotions": 2}
+
+
+class TestLargestMessages:
+
+    def test_has_attachment(self):
+        text = ["TEXT", "PLAIN", ["CHARSET", "utf-8"], None, None, "7BIT", 10, 1, None, None, None, None]
+        pdf = ["APPLICATION", "PDF", ["NAME", "a.pdf"], None, None, "BASE64", 10, None, ["ATTACHMENT", ["FILENAME", "a.pdf"]], None, None]
+        assert not has_attachment(text)
+        assert has_attachment([text, pdf, "MIXED", ["BOUNDARY", "b1"], None, None, None])
+        assert not has_attachment([text, text, "ALTERNATIVE"])
+        assert not has_attachment(None)
+
+    def test_largest_messages(self):
+        gmail = FakeGmail()
+        for i in range(30):
+            gmail.add_message(sender=f"s{i}@example.com", subject=f"Message {i}", body_size=1000 + 37 * i,
+                              attachment=i % 2 == 0)
+        with FakeGmailServer(gmail) as server:
+            client = SMPTClient(server.host, server.port, gmail.user, gmail.password, use_ssl=False)
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.connect()
+            messages = largest_messages(client, client.get_msg_ids("", "2100-01-01"), k=3, chunk_size=7)
+        expected = sorted(gmail.messages.values(), key=lambda msg: msg.size, reverse=True)[:3]
+        assert [message["subject"] for message in messages] == [msg.subject for msg in expected]
+        assert [message["sender"] for message in messages] == [msg.sender for msg in expected]
+        assert [message["attachment"] for message in messages] == [msg.attachment for msg in expected]
+        assert [message["bytes"] for message in messages] == [msg.size for msg in expected]
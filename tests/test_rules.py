@@ -0,0 +1,61 @@
+import datetime
+import json
+import multiprocessing
+import sys
+import time
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import load_rules, resolve_methods, resolve_date_until, RateLimiter
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORK_PASSWORD", "secret")
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({
+        "defaults": {"older_than_days": 30, "filters": {"Exclude attachments": "n"}},
+        "accounts": [
+            {"email": "me@gmail.com", "password_env": "WORK_PASSWORD"},
+            {"email": "you@gmail.com", "password": "pw", "date_until": "2024-01-01",
+             "filters": {"Only include unread": True}},
+        ],
+    }))
+    return str(path)
+
+
+class TestRules:
+
+    def test_load_rules(self, rules_file):
+        rules = load_rules(rules_file)
+        assert [rule["email"] for rule in rules] == ["me@gmail.com", "you@gmail.com"]
+        assert rules[0]["password"] == "secret"
+        assert rules[1]["date_until"] == "2024-01-01"
+        responses = {m["description"]: m["response"] for m in rules[1]["methods"]}
+        assert responses["Only include unread"] == "y"
+        assert responses["Exclude attachments"] == "n"
+        assert responses["Only include promotions"] == "y"
+
+    def test_missing_password(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("GMAIL_PASSWORD", raising=False)
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps({"accounts": [{"email": "me@gmail.com"}]}))
+        with pytest.raises(ValueError):
+            load_rules(str(path))
+
+    def test_unknown_filter(self):
+        with pytest.raises(ValueError):
+            resolve_methods({"Delete everything": "y"})
+
+    def test_resolve_date_until(self):
+        today = datetime.date(2024, 3, 31)
+        assert resolve_date_until({"older_than_days": 31}, today) == "2024-02-29"
+        assert resolve_date_until({"date_until": "2023-01-01"}, today) == "2023-01-01"
+
+    def test_rate_limiter(self):
+        with multiprocessing.Manager() as manager:
+            limiter = RateLimiter(manager, rate=50, burst=1)
+            started = time.monotonic()
+            for _ in range(6):
+                limiter.acquire("imap.gmail.com")
+            assert time.monotonic() - started >= 0.09
@@ -0,0 +1,127 @@
+import imaplib
+import sys
+import time
+import pytest # type: ignore
+from unittest.mock import Mock, patch
+
+sys.path.append("./")
+from pygmailcleaner.utils import SMPTClient, ChunkScheduler, ThrottledError, MsgIdSet, check_response
+
+
+@pytest.fixture
+def client():
+    client = Mock()
+    client.imap.uid.return_value = ("OK", [None])
+    return client
+
+
+def scheduler(client, **kwargs):
+    return ChunkScheduler(client, sleep=lambda seconds: None, **kwargs)
+
+
+class TestChunkScheduler:
+
+    def test_aimd(self, client):
+        chunk_scheduler = scheduler(client, chunk_size=1000, min_chunk_size=100, target_seconds=1, increase=50)
+        chunk_scheduler.observe(2)
+        assert chunk_scheduler.size == 500
+        chunk_scheduler.observe(0.1)
+        assert chunk_scheduler.size == 550
+        for _ in range(5):
+            chunk_scheduler.shrink()
+        assert chunk_scheduler.size == 100
+        for _ in range(100):
+            chunk_scheduler.observe(0.1)
+        assert chunk_scheduler.size == 1000
+
+    def test_check_response(self):
+        assert check_response("OK", [b"1"]) == [b"1"]
+        with pytest.raises(ThrottledError):
+            check_response("NO", [b"[THROTTLED] Too many commands"])
+        with pytest.raises(RuntimeError):
+            check_response("NO", [b"[ALERT] Something else"])
+
+    def test_prepare_is_not_timed(self, client):
+        prepared = []
+
+        def prepare(chunk):
+            prepared.append(chunk)
+            time.sleep(0.02)
+
+        chunk_scheduler = scheduler(client, chunk_size=4, min_chunk_size=1, target_seconds=0.01)
+        list(chunk_scheduler.run(MsgIdSet(range(1, 13)), lambda chunk: None, prepare=prepare))
+        assert prepared == ["1:4", "5:8", "9:12"]
+        assert chunk_scheduler.size == 4
+
+    def test_run_shrinks_on_throttle(self, client):
+        responses = iter([ThrottledError("[THROTTLED]")])
+        chunks = []
+
+        def operation(chunk):
+            error = next(responses, None)
+            if error is not None:
+                raise error
+            chunks.append(chunk)
+
+        chunk_scheduler = scheduler(client, chunk_size=8, min_chunk_size=2, increase=1)
+        list(chunk_scheduler.run(MsgIdSet(range(1, 21)), operation))
+        assert chunks[0] == "1:4"
+        assert MsgIdSet.from_string(",".join(chunks)) == MsgIdSet(range(1, 21))
+        client.reconnect.assert_not_called()
+
+    def test_run_reconnects_after_abort(self, client):
+        failures = [imaplib.IMAP4.abort("socket error: EOF")]
+
+        def operation(chunk):
+            if failures:
+                raise failures.pop()
+            return chunk
+
+        chunk_scheduler = scheduler(client, chunk_size=10)
+        results = list(chunk_scheduler.run(MsgIdSet(range(1, 6)), operation, folder="Trash"))
+        assert results == [("1:5", 5, "1:5")]
+        client.reconnect.assert_called_once_with("Trash")
+
+    def test_run_pipelined_resends_unfinished_chunks(self, client):
+        batches = []
+
+        def operation(chunks):
+            batches.append(chunks)
+            for chunk in chunks:
+                if len(batches) == 1 and chunk == "5:6":
+                    raise imaplib.IMAP4.abort("socket error: EOF")
+                yield chunk
+
+        chunk_scheduler = scheduler(client, chunk_size=2, increase=1)
+        results = list(chunk_scheduler.run_pipelined(MsgIdSet(range(1, 11)), operation, window=3, folder="Trash"))
+        assert batches == [["1:2", "3:4", "5:6"], ["5:6", "7:8", "9:10"]]
+        assert [result for chunk, count, result in results] == ["1:2", "3:4", "5:6", "7:8", "9:10"]
+        client.reconnect.assert_called_once_with("Trash")
+
+    def test_gives_up_after_max_retries(self, client):
+        def operation():
+            raise ThrottledError("[THROTTLED]")
+
+        with pytest.raises(ThrottledError):
+            scheduler(client, max_retries=3).call(operation)
+
+    def test_delete_msgs_reconnects(self):
+        with patch("imaplib.IMAP4_SSL") as imaplib_mock:
+            smpt_client = SMPTClient("imap.gmail.com", 993, "test@gmail.com", "password")
+            smpt_client.connect()
+            failures = [("NO", [b"[THROTTLED] Slow down"]), imaplib.IMAP4.abort("connection dropped")]
+
+            def uid(command, *args):
+                if failures:
+                    failure = failures.pop()
+                    if isinstance(failure, Exception):
+                        raise failure
+                    return failure
+                return ("OK", [None])
+
+            imaplib_mock.return_value.uid.side_effect = uid
+            with patch("pygmailcleaner.utils.scheduler.time.sleep"):
+                smpt_client.delete_msgs(MsgIdSet(range(1, 11)))
+            assert imaplib_mock.call_count == 2
+            stored = [c.args[1] for c in imaplib_mock.return_value.uid.call_args_list if c.args[0] == "STORE"]
+            assert stored == ["1:10", "1:10", "1:10"]
@@ -0,0 +1,121 @@
+import contextlib
+import io
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import SearchCache, CommandProfiler, MsgIdSet, FakeGmail, FakeGmailServer
+from pygmailcleaner.utils.fakegmail import CAPABILITIES, TRASH
+
+DATE_UNTIL = "2100-01-01"
+STATE = (1, 11, 10, 5)
+
+
+@pytest.fixture
+def gmail():
+    return FakeGmail().populate(50)
+
+
+def count(profiler, name):
+    commands = {command["command"]: command for command in profiler.report()["commands"]}
+    return commands.get(name, {}).get("count", 0)
+
+
+class TestSearchCache:
+
+    def test_lru_eviction(self):
+        cache = SearchCache(capacity=2)
+        cache.put("a", STATE, MsgIdSet([1]))
+        cache.put("b", STATE, MsgIdSet([2]))
+        assert cache.get("a", STATE) == MsgIdSet([1])
+        cache.put("c", STATE, MsgIdSet([3]))
+        assert cache.get("b", STATE) is None
+        assert cache.get("a", STATE) == MsgIdSet([1])
+        assert cache.get("c", (1, 12, 11, 6)) is None
+        assert (cache.hits, cache.misses) == (2, 2)
+
+    def test_persisted(self, tmp_path):
+        path = str(tmp_path / "searches.sqlite")
+        cache = SearchCache(capacity=2, path=path)
+        cache.put("a", STATE, MsgIdSet([1, 2, 3, 7]))
+        cache.put("b", STATE, MsgIdSet())
+        cache.get("a", STATE)
+        cache.put("c", STATE, MsgIdSet([5]))
+        cache.close()
+        cache = SearchCache(capacity=2, path=path)
+        assert list(cache.entries) == ["a", "c"]
+        assert cache.get("a", STATE) == MsgIdSet([1, 2, 3, 7])
+        cache.close()
+
+    def test_repeated_search_is_cached(self, gmail, connect):
+        profiler = CommandProfiler()
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail, profiler=profiler)
+            msg_ids = client.get_msg_ids("is:unread", DATE_UNTIL)
+            assert client.get_msg_ids("is:unread  ", DATE_UNTIL) == msg_ids
+            assert count(profiler, "UID SEARCH") == 1
+            assert client.get_msg_ids("is:unread", "2099-01-01") == msg_ids
+            assert count(profiler, "UID SEARCH") == 2
+            # the state comes from SELECT and the untagged updates, not STATUS on the selected mailbox
+            assert count(profiler, "STATUS") == 0
+
+    def test_changes_invalidate(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            unread = client.get_msg_ids("is:unread", DATE_UNTIL)
+            client.imap.uid("STORE", str(unread[0]), "+FLAGS", "(\\Seen)")
+            assert client.get_msg_ids("is:unread", DATE_UNTIL) == unread - MsgIdSet([unread[0]])
+            gmail.add_message(subject="New")
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 51
+            assert client.search_cache.hits == 0
+
+    def test_removal_by_another_client_invalidates(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            msg_ids = client.get_msg_ids("", DATE_UNTIL)
+            other = connect(server, gmail)
+            with contextlib.redirect_stdout(io.StringIO()):
+                other.delete_msgs(MsgIdSet([msg_ids[0]]))
+            assert client.get_msg_ids("", DATE_UNTIL) == msg_ids - MsgIdSet([msg_ids[0]])
+            assert client.search_cache.hits == 0
+
+    def test_flag_change_by_another_client_invalidates(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            assert client.imap.condstore
+            unread = client.get_msg_ids("is:unread", DATE_UNTIL)
+            other = connect(server, gmail)
+            other.imap.uid("STORE", str(unread[0]), "+FLAGS.SILENT", "(\\Seen)")
+            assert client.get_msg_ids("is:unread", DATE_UNTIL) == unread - MsgIdSet([unread[0]])
+            assert client.search_cache.hits == 0
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 50
+
+    def test_keyed_on_selected_mailbox(self, gmail, connect):
+        gmail.add_message(subject="Trashed", labels=("\\Trash",))
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 50
+            client.imap.select(TRASH)
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 1
+            client.imap.select(client.folder)
+            assert len(client.get_msg_ids("", DATE_UNTIL)) == 50
+            assert client.search_cache.hits == 1
+
+    @pytest.mark.parametrize("capability", ["CONDSTORE", "ENABLE"])
+    def test_not_cached_without_condstore(self, gmail, connect, capability):
+        with FakeGmailServer(gmail, capabilities=CAPABILITIES.replace(f" {capability} ", " ")) as server:
+            client = connect(server, gmail)
+            client.get_msg_ids("", DATE_UNTIL)
+            client.get_msg_ids("", DATE_UNTIL)
+            assert not client.search_cache.entries
+
+    def test_warm_run(self, gmail, connect, tmp_path):
+        path = str(tmp_path / "searches.sqlite")
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail, search_cache=SearchCache(path=path))
+            msg_ids = client.get_msg_ids("category:promotions", DATE_UNTIL)
+            client.search_cache.close()
+            profiler = CommandProfiler()
+            client = connect(server, gmail, search_cache=SearchCache(path=path), profiler=profiler)
+            assert client.get_msg_ids("category:promotions", DATE_UNTIL) == msg_ids
+            assert count(profiler, "UID SEARCH") == 0
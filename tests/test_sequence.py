@@ -0,0 +1,58 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import sequence
+
+
+class TestSequence:
+
+    def test_parse_msg_ids(self):
+        assert sequence.parse_msg_ids("3,1,2,2") == [1, 2, 3]
+        assert sequence.parse_msg_ids("1:3,7") == [1, 2, 3, 7]
+        assert sequence.parse_msg_ids("") == []
+
+    def test_to_ranges(self):
+        assert sequence.to_ranges([1, 2, 3, 5, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
+        assert sequence.to_ranges([]) == []
+
+    def test_format_sequence_set(self):
+        assert sequence.format_sequence_set([(1, 5000), (5002, 9000)]) == "1:5000,5002:9000"
+        assert sequence.format_sequence_set([(4, 4)]) == "4"
+
+    def test_chunk_ranges_by_size(self):
+        chunks = list(sequence.chunk_ranges([(1, 10), (12, 12)], chunk_size=4))
+        assert chunks == [("1:4", 4), ("5:8", 4), ("9:10,12", 3)]
+
+    def test_chunk_ranges_by_length(self):
+        ranges = [(i, i) for i in range(1, 20, 2)]
+        chunks = list(sequence.chunk_ranges(ranges, chunk_size=100, max_length=8))
+        assert all(len(chunk) <= 8 for chunk, _ in chunks)
+        assert sum(count for _, count in chunks) == 10
+
+    def test_chunk_ranges_invalid_size(self):
+        with pytest.raises(ValueError):
+            list(sequence.chunk_ranges([(1, 2)], chunk_size=0))
+
+    def test_msg_id_set(self):
+        ids = sequence.MsgIdSet([5, 1, 2, 3, 3])
+        assert len(ids) == 4
+        assert list(ids) == [1, 2, 3, 5]
+        assert 5 in ids and 4 not in ids
+        assert str(ids) == "1:3,5"
+        assert sequence.MsgIdSet.from_search(b"3 1 2") == sequence.MsgIdSet([1, 2, 3])
+        assert sequence.MsgIdSet.from_search(b"") == sequence.MsgIdSet()
+
+    def test_msg_id_set_algebra(self):
+        a = sequence.MsgIdSet([1, 2, 3, 4])
+        b = sequence.MsgIdSet([3, 4, 5])
+        assert list(a & b) == [3, 4]
+        assert list(a | b) == [1, 2, 3, 4, 5]
+        assert list(a - b) == [1, 2]
+        assert list(a ^ b) == [1, 2, 5]
+
+    def test_bitmap(self):
+        ids = sequence.MsgIdSet([0, 1, 7, 8, 9, 100, 70000])
+        assert sequence.MsgIdSet.from_bitmap(ids.to_bitmap()) == ids
+        assert sequence.MsgIdSet().to_bitmap() == 0
+        assert sequence.bitmap_count(ids.to_bitmap()) == 7
@@ -4,7 +4,7 @@ import pytest # type: ignore
 from unittest.mock import Mock, patch
 
 sys.path.append("./")
-from pygmailcleaner.utils import SMPTClient
+from pygmailcleaner.utils import SMPTClient, MsgIdSet
 
 TRASH_FOLDER = os.getenv("TRASH_FOLDER", '"[Google Mail]/Trash"')
 
@@ -42,20 +42,95 @@ class TestSMPTClient:
 
     def test_get_msg_ids(self, smpt_client):
         smpt_client.imap = Mock()
-        smpt_client.imap.search.return_value = ("OK", [b"1 2 3 4"])
+        smpt_client.imap.uid.return_value = ("OK", [b"1 2 3 4"])
         method = "delete_unread"
         date_until = "2023-01-01"
         msg_ids = smpt_client.get_msg_ids(method, date_until)
-        assert msg_ids == "1,2,3,4"
+        assert msg_ids == MsgIdSet([1, 2, 3, 4])
+        assert smpt_client.imap.uid.call_args.args[:2] == ("SEARCH", "X-GM-RAW")
 
     def test_count_msgs(self, smpt_client):
         assert smpt_client.count_msgs("1,2,3,4") == 4
         assert smpt_client.count_msgs("") == 0
+        assert smpt_client.count_msgs(MsgIdSet([1, 2, 3])) == 3
 
     def test_delete_msgs(self, smpt_client):
         smpt_client.imap = Mock()
         smpt_client.imap.expunge.return_value = ("OK",)
-        smpt_client.delete_msgs("1,2,3,4")
-        assert smpt_client.imap.store.call_count == 2
+        smpt_client.imap.uid.return_value = ("OK", [None])
+        smpt_client.delete_msgs(MsgIdSet([1, 2, 3, 4]))
+        smpt_client.imap.uid.assert_called_once_with("STORE", "1:4", "+X-GM-LABELS", "\\Trash")
+        smpt_client.imap.store.assert_called_once_with("1:*", "+FLAGS", "\\Deleted")
         smpt_client.imap.select.assert_called_with(TRASH_FOLDER)
         smpt_client.imap.expunge.assert_called_once()
+
+    def test_delete_msgs_chunked(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.uid.return_value = ("OK", [None])
+        smpt_client.delete_msgs("1,2,3,4,6,7", chunk_size=3)
+        stored = [c.args[1] for c in smpt_client.imap.uid.call_args_list]
+        assert stored == ["1:3", "4,6:7"]
+
+    def test_search_gm_msgids(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.uid.return_value = ("OK", [b"7 9"])
+        uids = smpt_client.search_gm_msgids([11, 12, 13])
+        smpt_client.imap.uid.assert_called_once_with(
+            "SEARCH", "OR", "OR", "X-GM-MSGID", "11", "X-GM-MSGID", "12", "X-GM-MSGID", "13"
+        )
+        assert uids == MsgIdSet([7, 9])
+
+    def test_delete_msgs_targeted(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.capabilities = ("IMAP4REV1", "UIDPLUS")
+
+        def uid(command, *args):
+            if command == "FETCH":
+                return ("OK", [b"1 (X-GM-MSGID 101 UID 1)", b"2 (X-GM-MSGID 102 UID 2)"])
+            if command == "SEARCH":
+                return ("OK", [b"55 56"])
+            return ("OK", [None])
+
+        smpt_client.imap.uid.side_effect = uid
+        smpt_client.delete_msgs(MsgIdSet([1, 2]), targeted=True)
+        commands = [c.args for c in smpt_client.imap.uid.call_args_list]
+        assert ("STORE", "55:56", "+FLAGS", "\\Deleted") in commands
+        assert ("EXPUNGE", "55:56") in commands
+        smpt_client.imap.store.assert_not_called()
+        smpt_client.imap.expunge.assert_not_called()
+
+    def test_delete_msgs_targeted_requires_uidplus(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.capabilities = ("IMAP4REV1",)
+        smpt_client.imap.uid.return_value = ("OK", [b"1"])
+        with pytest.raises(RuntimeError, match="UIDPLUS"):
+            smpt_client.delete_msgs(MsgIdSet([1]), targeted=True)
+        # nothing was moved to Trash
+        smpt_client.imap.uid.assert_not_called()
+        smpt_client.imap.select.assert_not_called()
+
+    def test_get_status(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.status.return_value = (
+            "OK", [b'"[Google Mail]/All Mail" (MESSAGES 22614 UNSEEN 4714)']
+        )
+        status = smpt_client.get_status(items=("MESSAGES", "UNSEEN"))
+        smpt_client.imap.status.assert_called_once_with('"[Google Mail]/All Mail"', "(MESSAGES UNSEEN)")
+        assert status == {"MESSAGES": 22614, "UNSEEN": 4714}
+
+    def test_count_search_esearch(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.capabilities = ("IMAP4REV1", "ESEARCH")
+        smpt_client.imap.uid.return_value = ("OK", [None])
+        smpt_client.imap.response.return_value = ("ESEARCH", [b'(TAG "A5") UID COUNT 42'])
+        assert smpt_client.count_search("in:unread", "2023-01-01") == 42
+        assert smpt_client.imap.uid.call_args.args[:3] == ("SEARCH", "RETURN", "(COUNT)")
+        smpt_client.imap.status.assert_not_called()
+
+    def test_count_search_quotes_term(self, smpt_client):
+        smpt_client.imap = Mock()
+        smpt_client.imap.capabilities = ("IMAP4REV1", "ESEARCH")
+        smpt_client.imap.uid.return_value = ("OK", [None])
+        smpt_client.imap.response.return_value = ("ESEARCH", [b"UID COUNT 1"])
+        smpt_client.count_search('subject:"a\\b"', "2023-01-01")
+        assert smpt_client.imap.uid.call_args.args[4].startswith('"subject:\\"a\\\\b\\" before:')
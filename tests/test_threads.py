@@ -0,0 +1,76 @@
+import sys
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import ThreadIndex, FakeGmail, FakeGmailServer, MsgIdSet
+from pygmailcleaner.utils.fakegmail import CAPABILITIES, ALL_MAIL
+
+DATE_UNTIL = "2100-01-01"
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail()
+    # thread 1 is entirely promotional, thread 2 mixes a promotion with a reply
+    gmail.add_message(subject="Sale", category="promotions", thrid=1)
+    gmail.add_message(subject="Re: Sale", category="promotions", thrid=1)
+    gmail.add_message(subject="Offer", category="promotions", thrid=2)
+    gmail.add_message(subject="Re: Offer", category="primary", thrid=2)
+    gmail.add_message(subject="Hello", category="primary", thrid=3)
+    return gmail
+
+
+class TestThreadIndex:
+
+    def test_select(self):
+        index = ThreadIndex()
+        for uid, thrid, matched in [(1, 10, 1), (2, 10, 1), (3, 20, 1), (4, 20, 0), (5, 30, 0)]:
+            index.add(uid, thrid, matched)
+        assert index.select("messages") == MsgIdSet([1, 2, 3])
+        assert index.select("all") == MsgIdSet([1, 2, 3, 4])
+        assert index.select("complete") == MsgIdSet([1, 2])
+        assert index.stats() == {
+            "threads": 2, "complete_threads": 1, "partial_threads": 1, "matched": 3, "thread_messages": 4,
+        }
+        with pytest.raises(ValueError):
+            index.select("unknown")
+
+    def test_build(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            msg_ids = client.get_msg_ids("category:promotions", DATE_UNTIL)
+            index = ThreadIndex.build(client, msg_ids, batch_size=2)
+            assert len(index) == 4
+            folder = gmail.folder(ALL_MAIL)
+            subjects = lambda uids: sorted(folder.by_uid[uid].subject for uid in uids)
+            assert subjects(index.select("all")) == ["Offer", "Re: Offer", "Re: Sale", "Sale"]
+            assert subjects(index.select("complete")) == ["Re: Sale", "Sale"]
+
+    def test_build_looks_up_matched_threads_only(self, gmail, connect):
+        for i in range(50):
+            gmail.add_message(subject=f"Other {i}", category="primary", thrid=100 + i)
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            msg_ids = client.get_msg_ids("category:promotions", DATE_UNTIL)
+            fetch = client.fetch
+            fetched = []
+
+            def recorded(msg_ids, items, *args):
+                fetched.extend(msg_ids)
+                return fetch(msg_ids, items, *args)
+
+            def uid(command, *args):
+                raise AssertionError(f"unexpected UID {command} {args}")
+
+            client.fetch = recorded
+            client.imap.uid = uid
+            index = ThreadIndex.build(client, msg_ids)
+        assert len(index) == 4
+        assert sorted(fetched) == sorted(index.uids)
+
+    def test_requires_gmail_extension(self, gmail, connect):
+        capabilities = CAPABILITIES.replace(" X-GM-EXT-1", "")
+        with FakeGmailServer(gmail, capabilities=capabilities) as server:
+            client = connect(server, gmail)
+            with pytest.raises(RuntimeError):
+                ThreadIndex.build(client, MsgIdSet([1]))
@@ -0,0 +1,161 @@
+import contextlib
+import io
+import mailbox
+import sys
+import threading
+import time
+import pytest # type: ignore
+
+sys.path.append("./")
+from pygmailcleaner.utils import Watcher, Archiver, FakeGmail, FakeGmailServer, idle, open_archive
+from pygmailcleaner.utils.fakegmail import ALL_MAIL, CAPABILITIES
+
+QUERY = "from:news@example.com"
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail()
+    gmail.add_message(sender="news@example.com", subject="Old news")
+    gmail.add_message(sender="friend@example.com", subject="Old letter")
+    return gmail
+
+
+def subjects(gmail):
+    folder = gmail.folder(ALL_MAIL)
+    return sorted(folder.by_uid[uid].subject for uid in folder.uids)
+
+
+def add_new_mail(gmail):
+    gmail.add_message(sender="news@example.com", subject="New news")
+    gmail.add_message(sender="friend@example.com", subject="New letter")
+
+
+class TestWatch:
+
+    def test_idle_timeout(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            assert idle(client.imap, 0.2) is False
+            assert len(client.get_msg_ids("", "2100-01-01")) == 2
+
+    def test_idle_reports_new_mail(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail, compress=True)
+            threading.Timer(0.2, gmail.add_message).start()
+            started = time.monotonic()
+            assert idle(client.imap, 10) is True
+            assert time.monotonic() - started < 5
+            assert client.imap.untagged_responses["EXISTS"][-1] == b"3"
+
+    def test_deletes_new_matching_mail(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            watcher = Watcher(client, QUERY, idle_timeout=10)
+            threading.Timer(0.2, add_new_mail, [gmail]).start()
+            started = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher.run(max_cycles=2)
+            assert time.monotonic() - started < 5
+            assert subjects(gmail) == ["New letter", "Old letter", "Old news"]
+            assert watcher.scanned == 2
+            assert watcher.matched == watcher.deleted == 1
+
+    def test_dry_run_leaves_mailbox_unchanged(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            watcher = Watcher(client, QUERY, dry_run=True)
+            watcher.sync()
+            add_new_mail(gmail)
+            client.imap.noop()
+            assert len(watcher.scan()) == 1
+            assert subjects(gmail) == ["New letter", "New news", "Old letter", "Old news"]
+            assert watcher.matched == 1
+            assert watcher.deleted == 0
+
+    def test_rule_settings(self, gmail, connect, tmp_path):
+        path = str(tmp_path / "archive.mbox")
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            archiver = Archiver(open_archive(path))
+            watcher = Watcher(client, QUERY, threads="all", targeted=True, archiver=archiver)
+            watcher.sync()
+            gmail.add_message(sender="news@example.com", subject="Re: Old letter",
+                              thrid=gmail.folder(ALL_MAIL).by_uid[2].thrid)
+            gmail.add_message(sender="news@example.com", subject="Unrelated", labels=("\\Trash",))
+            client.imap.noop()
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher.scan()
+            archiver.archive.close()
+            # the whole thread of the match goes, trashed mail watching did not move stays
+            assert subjects(gmail) == ["Old news"]
+            assert gmail.folder("[Gmail]/Trash").uids
+            assert sorted(message["subject"] for message in mailbox.mbox(path)) == ["Old letter", "Re: Old letter"]
+
+    def test_thread_lookup_follows_new_mail(self, gmail, connect):
+        for i in range(100):
+            gmail.add_message(sender="friend@example.com", subject=f"Letter {i}")
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            watcher = Watcher(client, QUERY, threads="all")
+            watcher.sync()
+            add_new_mail(gmail)
+            client.imap.noop()
+            fetch = client.fetch
+            fetched = []
+
+            def recorded(msg_ids, items, *args):
+                fetched.extend(msg_ids)
+                return fetch(msg_ids, items, *args)
+
+            client.fetch = recorded
+            with contextlib.redirect_stdout(io.StringIO()):
+                assert len(watcher.scan()) == 1
+            # only the new match is fetched, not the thread ids of the whole folder
+            assert len(fetched) == 1
+            assert "New news" not in subjects(gmail)
+
+    def test_noop_fallback(self, gmail, connect):
+        capabilities = CAPABILITIES.replace(" IDLE", "")
+        with FakeGmailServer(gmail, capabilities=capabilities) as server:
+            client = connect(server, gmail)
+            sleeps = []
+
+            def sleep(seconds):
+                sleeps.append(seconds)
+                add_new_mail(gmail)
+
+            watcher = Watcher(client, QUERY, poll_interval=30, sleep=sleep)
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher.run(max_cycles=2)
+            assert sleeps == [30]
+            assert subjects(gmail) == ["New letter", "Old letter", "Old news"]
+
+    def test_reconnects_and_catches_up(self, gmail, connect):
+        capabilities = CAPABILITIES.replace(" IDLE", "")
+        with FakeGmailServer(gmail, capabilities=capabilities) as server:
+            client = connect(server, gmail)
+            sleeps = []
+
+            def sleep(seconds):
+                if not sleeps:
+                    # the connection drops while new mail arrives
+                    client.imap.shutdown()
+                    add_new_mail(gmail)
+                sleeps.append(seconds)
+
+            watcher = Watcher(client, QUERY, sleep=sleep)
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher.run(max_cycles=2)
+            assert watcher.reconnects == 1
+            assert subjects(gmail) == ["New letter", "Old letter", "Old news"]
+
+    def test_uidvalidity_change(self, gmail, connect):
+        with FakeGmailServer(gmail) as server:
+            client = connect(server, gmail)
+            watcher = Watcher(client, QUERY)
+            watcher.sync()
+            watcher.uidnext, watcher.uidvalidity = 1, 0
+            watcher.sync()
+            assert watcher.uidnext == gmail.folder(ALL_MAIL).uidnext
+            assert not watcher.scan()